@@ -0,0 +1,31 @@
+"""Движок объединения аудиофайлов без графического интерфейса
+
+Имена загружаются при первом обращении: командной строке (engine.cli) не
+нужно импортировать движок, чтобы разобрать аргументы или показать справку.
+"""
+import importlib
+
+# Имя -> модуль, в котором оно определено
+EXPORTS = {
+    'CancelToken': 'api',
+    'DuplicateInputsError': 'api',
+    'InputInfo': 'api',
+    'MergeCancelled': 'api',
+    'MergeOptions': 'api',
+    'MergePlan': 'api',
+    'MergeResult': 'api',
+    'Progress': 'api',
+    'merge': 'api',
+    'split_audio': 'split',
+    'VirtualMerge': 'virtual',
+}
+
+__all__ = list(EXPORTS)
+
+
+def __getattr__(name):
+    if name not in EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
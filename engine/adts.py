@@ -0,0 +1,140 @@
+"""AAC в ADTS: объединение по фреймам без тегов и мусора между ними"""
+import logging
+import os
+import struct
+from array import array
+
+from .formats import id3v2_length, trailing_tags_length
+from .taps import SampleCountTap
+
+# Частоты дискретизации по индексу из заголовка ADTS
+ADTS_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000,
+                     22050, 16000, 12000, 11025, 8000, 7350)
+ADTS_PROFILES = ('Main', 'LC', 'SSR', 'LTP')
+
+# Отсчётов в одном блоке сырых данных AAC
+AAC_BLOCK_SAMPLES = 1024
+
+ADTS_HEADER_LENGTH = 7
+
+
+def parse_adts_header(view, pos, end):
+    """Заголовок ADTS: (длина фрейма, (профиль, индекс частоты, каналы), блоков) или None"""
+    if end - pos < ADTS_HEADER_LENGTH or view[pos] != 0xFF or view[pos + 1] & 0xF6 != 0xF0:
+        return None
+    b2, b3, b4, b5, b6 = view[pos + 2:pos + 7]
+    profile = b2 >> 6
+    rate_index = (b2 >> 2) & 0x0F
+    channels = ((b2 & 0x01) << 2) | (b3 >> 6)
+    frame_length = ((b3 & 0x03) << 11) | (b4 << 3) | (b5 >> 5)
+    header_length = ADTS_HEADER_LENGTH if view[pos + 1] & 0x01 else ADTS_HEADER_LENGTH + 2
+    if rate_index >= len(ADTS_SAMPLE_RATES) or frame_length <= header_length:
+        return None
+    return frame_length, (profile, rate_index, channels), (b6 & 0x03) + 1
+
+
+class AdtsIndex:
+    """Непрерывные серии верных фреймов входа и их суммарные счётчики"""
+
+    def __init__(self, params, runs, frames, blocks, skipped):
+        self.params = params
+        self.runs = runs
+        self.frames = frames
+        self.blocks = blocks
+        self.skipped = skipped
+
+    @property
+    def sample_rate(self):
+        return ADTS_SAMPLE_RATES[self.params[1]]
+
+    def describe(self):
+        profile, _, channels = self.params
+        return f"AAC {ADTS_PROFILES[profile]}, {self.sample_rate} Hz, {channels} ch"
+
+    def to_bytes(self):
+        return struct.pack('<BBBQQQ', *self.params, self.frames, self.blocks, self.skipped) + self.runs.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob):
+        profile, rate_index, channels, frames, blocks, skipped = struct.unpack_from('<BBBQQQ', blob)
+        runs = array('Q')
+        runs.frombytes(blob[struct.calcsize('<BBBQQQ'):])
+        return cls((profile, rate_index, channels), runs, frames, blocks, skipped)
+
+
+def index_adts(mapped, cache=None):
+    """Проходит фреймы входа; серии (смещение, длина) кэшируются в кэше разбора"""
+    view = mapped.data
+    start = id3v2_length(view)
+    end = mapped.size - trailing_tags_length(view)
+    kind = f"adts-runs:{start}:{end}"
+    if cache is not None:
+        cached = cache.get(mapped, kind)
+        if cached is not None:
+            return AdtsIndex.from_bytes(cached)
+
+    runs = array('Q')
+    params = None
+    frames = blocks = skipped = 0
+    run_start = run_end = None
+    pos = start
+    while pos < end:
+        header = parse_adts_header(view, pos, end)
+        valid = header is not None and pos + header[0] <= end and (params is None or header[1] == params)
+        if valid and params is None:
+            # Первый фрейм принимаем, только если за ним следует ещё один такой же (или конец файла)
+            following = pos + header[0]
+            next_header = parse_adts_header(view, following, end)
+            valid = following == end or (next_header is not None and next_header[1] == header[1])
+        if not valid:
+            # Мусор: ищем следующую синхропоследовательность
+            candidate = mapped.find(b'\xff', pos + 1, end)
+            if candidate == -1:
+                candidate = end
+            skipped += candidate - pos
+            pos = candidate
+            continue
+        frame_length, params, frame_blocks = header[0], header[1], header[2]
+        if pos != run_end:
+            if run_start is not None:
+                runs.extend((run_start, run_end - run_start))
+            run_start = pos
+        run_end = pos + frame_length
+        frames += 1
+        blocks += frame_blocks
+        pos = run_end
+    if run_start is not None:
+        runs.extend((run_start, run_end - run_start))
+    if params is None:
+        raise ValueError(f"No ADTS frames found in {os.path.basename(mapped.path)}")
+
+    index = AdtsIndex(params, runs, frames, blocks, skipped)
+    if cache is not None:
+        cache.put(mapped, kind, index.to_bytes())
+    return index
+
+
+def merge_aac(paths, writer, session, on_file=None, peaks=False, cache=None, chapters=None):
+    """AAC (ADTS): только верные фреймы всех входов, без ID3 тегов и мусора"""
+    inputs = []
+    for path in paths:
+        mapped = session.open(path, pin=True)
+        inputs.append((path, mapped, index_adts(mapped, cache)))
+
+    first = inputs[0][2]
+    for path, mapped, index in inputs[1:]:
+        if index.params != first.params:
+            raise ValueError(f"AAC format of {os.path.basename(path)} differs from "
+                             f"{os.path.basename(paths[0])} ({index.describe()})")
+
+    duration = writer.add_tap('duration', SampleCountTap(first.sample_rate))
+    for i, (path, mapped, index) in enumerate(inputs, 1):
+        if on_file:
+            on_file(i, path)
+        if index.skipped:
+            logging.info(f"Skipped {index.skipped} bytes of non-ADTS data in {os.path.basename(path)}")
+        runs = index.runs
+        for r in range(0, len(runs), 2):
+            writer.copy_from(mapped, runs[r], runs[r + 1])
+        duration.add(index.blocks * AAC_BLOCK_SAMPLES, frames=index.frames)
+    logging.info(f"AAC merge wrote {duration.frames} frames, {duration.samples} samples")
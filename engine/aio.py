@@ -0,0 +1,84 @@
+"""asyncio-интерфейс: объединение в рабочем потоке, не блокирующее цикл событий
+
+    job = aio.MergeJob(inputs, 'out.wav', semaphore=limit)
+    async for progress in job:
+        ...
+    result = await job
+
+Чтение и запись идут в потоке исполнителя (копирование средствами ядра и клонирование
+диапазонов отпускают GIL). Отмена задачи взводит CancelToken: поток останавливается
+на ближайшем блоке и удаляет неполный результат, после чего отмена доходит до вызывающего.
+"""
+import asyncio
+import functools
+
+from . import api
+
+# Конец потока событий прогресса
+_DONE = object()
+
+
+class MergeJob:
+    """Запущенное объединение: await даёт MergeResult, async for - события Progress
+
+    semaphore (общий asyncio.Semaphore) ограничивает число одновременных объединений;
+    пока место не освободилось, задание ждёт, не занимая поток исполнителя.
+    """
+
+    def __init__(self, inputs, output, options=None, semaphore=None, executor=None):
+        self.loop = asyncio.get_running_loop()
+        self.token = api.CancelToken()
+        self.events = asyncio.Queue()
+        self.task = self.loop.create_task(self._run(list(inputs), output, options, semaphore, executor))
+
+    async def _run(self, inputs, output, options, semaphore, executor):
+        try:
+            if semaphore is not None:
+                await semaphore.acquire()
+            try:
+                future = self.loop.run_in_executor(executor, functools.partial(
+                    api.merge, inputs, output, options, progress=self._on_progress, cancel=self.token))
+                try:
+                    return await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    self.token.cancel()
+                    # Поток должен завершиться сам: он удаляет неполный результат
+                    try:
+                        await future
+                    except api.MergeCancelled:
+                        pass
+                    raise
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+        finally:
+            self.events.put_nowait(_DONE)
+
+    def _on_progress(self, progress):
+        """Вызывается в рабочем потоке; события передаются в цикл по порядку"""
+        self.loop.call_soon_threadsafe(self.events.put_nowait, progress)
+
+    def cancel(self):
+        return self.task.cancel()
+
+    def done(self):
+        return self.task.done()
+
+    def __await__(self):
+        return self.task.__await__()
+
+    def __aiter__(self):
+        return self.progress()
+
+    async def progress(self):
+        """События Progress до завершения объединения (успешного или нет)"""
+        while True:
+            event = await self.events.get()
+            if event is _DONE:
+                return
+            yield event
+
+
+async def merge(inputs, output, options=None, semaphore=None, executor=None):
+    """Асинхронный engine.merge; возвращает MergeResult"""
+    return await MergeJob(inputs, output, options, semaphore, executor)
@@ -0,0 +1,377 @@
+"""Программный интерфейс движка: план объединения, выполнение с прогрессом и отменой, итог
+
+    from engine import merge, MergeOptions
+    result = merge(['1.wav', '2.wav'], 'out.wav', MergeOptions(peaks=True))
+    print(result.bytes, result.duration, result.sha256)
+
+Окно приложения и командная строка - клиенты этого интерфейса.
+"""
+import logging
+import os
+import threading
+import time
+
+from .concat import merge_audio
+from .formats import detect_format
+from .inputs import find_duplicates, sort_inputs
+from .mapped import MappedSession
+from .probe import probe_duration
+from .taps import ProgressTap, write_sha256_sidecar
+from .writer import is_stream
+
+# Как часто (в долях общего объёма) вызывается обратный вызов прогресса во время записи
+PROGRESS_STEPS = 200
+
+
+class MergeCancelled(Exception):
+    """Объединение отменено через CancelToken; неполный результат удалён"""
+
+
+class DuplicateInputsError(ValueError):
+    """Среди входов есть вероятные дубликаты"""
+
+    def __init__(self, groups):
+        super().__init__("Found potentially duplicate files: " +
+                         "; ".join(', '.join(os.path.basename(path) for path in group) for group in groups))
+        self.groups = groups
+
+
+class CancelToken:
+    """Флаг отмены, который можно взвести из другого потока"""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise MergeCancelled("Merge was cancelled")
+
+
+class MergeOptions:
+    """Параметры объединения"""
+
+    def __init__(self, sort=True, allow_duplicates=False, overwrite=True, use_reflink=True,
+                 sidecar=True, peaks=False, verify=False, verify_workers=None, cache=None,
+                 output_cache=None, tree=None, max_part_bytes=None, max_part_seconds=None, mirrors=None,
+                 mirror_buffer=None, chapters=False):
+        # Порядок входов: по возрастанию имён, как в окне приложения
+        self.sort = sort
+        self.allow_duplicates = allow_duplicates
+        self.overwrite = overwrite
+        self.use_reflink = use_reflink
+        self.sidecar = sidecar
+        self.peaks = peaks
+        self.verify = verify
+        self.verify_workers = verify_workers
+        # ProbeCache для пиков, индексов и проверки; без него кэш открывается на время объединения
+        self.cache = cache
+        # OutputCache (engine.outputcache): то же объединение берётся готовым, новое - запоминается
+        self.output_cache = output_cache
+        # Иерархическое объединение (engine.tree): None - когда нужно, True или размер группы, False - никогда
+        self.tree = tree
+        # Результат частями (engine.split.merge_parts): пределы размера части в байтах и в секундах
+        self.max_part_bytes = max_part_bytes
+        self.max_part_seconds = max_part_seconds
+        # Копии результата в других местах (engine.tee): пути или папки и очередь каждой, байт
+        self.mirrors = mirrors
+        self.mirror_buffer = mirror_buffer
+        # Главы по входам (engine.chapters): лист .cue и метки в WAV, MP3 и FLAC
+        self.chapters = chapters
+
+    @property
+    def sharded(self):
+        return bool(self.max_part_bytes or self.max_part_seconds)
+
+
+class InputInfo:
+    """Сведения о входе, собранные при построении плана"""
+
+    def __init__(self, path, size, format, duration):
+        self.path = path
+        self.size = size
+        self.format = format
+        self.duration = duration
+
+    def to_dict(self):
+        return {'path': self.path, 'size': self.size, 'format': self.format, 'duration': self.duration}
+
+
+class Progress:
+    """Состояние для обратного вызова прогресса"""
+
+    def __init__(self, index, count, path, bytes_written, total_bytes):
+        self.index = index
+        self.count = count
+        self.path = path
+        self.bytes_written = bytes_written
+        # Оценка: сумма размеров входов (заголовки и теги меняют её незначительно)
+        self.total_bytes = total_bytes
+
+    @property
+    def fraction(self):
+        return min(1.0, self.bytes_written / self.total_bytes) if self.total_bytes else 0.0
+
+
+class MergeResult:
+    """Итог объединения"""
+
+    def __init__(self, plan, writer, timings, hit=None, parts=None):
+        """writer - OutputWriter объединения; для результата из кэша - hit (engine.outputcache.CacheHit),
+        для результата частями - parts (список engine.split.SplitPart)"""
+        self.output = writer.path if plan.streaming else os.path.abspath(plan.output)
+        self.format = plan.format
+        self.inputs = plan.inputs
+        self.mirrors = [os.path.abspath(path) for path in plan.mirrors]
+        # Части результата; у объединения в один файл - None
+        self.parts = parts
+        self.manifest = None
+        # Главы результата (engine.chapters.Chapter) и лист .cue рядом с ним
+        self.chapters = getattr(writer, 'chapters', None)
+        self.cue = None
+        if self.chapters and not plan.streaming:
+            from .chapters import cue_path
+            self.cue = cue_path(self.output)
+        if parts is not None:
+            from .split import manifest_path
+            self.manifest = manifest_path(plan.output)
+            self.bytes = sum(part.bytes for part in parts)
+            self.duration = sum(part.duration for part in parts)
+            # У частей свои хеши; общего файла, а значит и его хеша, нет
+            self.sha256 = None
+            self.cloned_bytes = sum(part.cloned_bytes for part in parts)
+            self.copied_bytes = sum(part.copied_bytes for part in parts)
+            self.verification = None
+        elif hit is None:
+            self.bytes = writer.position
+            self.duration = writer.taps['duration'].duration
+            self.sha256 = writer.taps['sha256'].hexdigest
+            self.cloned_bytes = writer.cloned_bytes
+            self.copied_bytes = writer.copied_bytes
+            self.verification = writer.verification
+        else:
+            self.bytes = hit.size
+            self.duration = hit.duration
+            self.sha256 = hit.sha256
+            self.cloned_bytes = hit.size if hit.method == 'reflink' else 0
+            self.copied_bytes = hit.size if hit.method == 'copy' else 0
+            self.verification = None
+        # Как результат взят из кэша результатов ('reflink', 'hardlink', 'copy') или None
+        self.cached = hit.method if hit is not None else None
+        # Секунды по этапам: plan, write, verify, total
+        self.timings = timings
+
+    def to_dict(self):
+        return {
+            'output': self.output,
+            'mirrors': self.mirrors,
+            'format': self.format,
+            'inputs': [info.to_dict() for info in self.inputs],
+            'bytes': self.bytes,
+            'duration': self.duration,
+            'sha256': self.sha256,
+            'cloned_bytes': self.cloned_bytes,
+            'copied_bytes': self.copied_bytes,
+            'verified': self.verification is not None or bool(
+                self.parts and all(part.verification is not None for part in self.parts)),
+            'cached': self.cached,
+            'parts': [part.to_dict() for part in self.parts] if self.parts is not None else None,
+            'manifest': self.manifest,
+            'chapters': [chapter.to_dict() for chapter in self.chapters] if self.chapters else None,
+            'cue': self.cue,
+            'timings': {name: round(seconds, 6) for name, seconds in self.timings.items()},
+        }
+
+
+class MergePlan:
+    """Что и куда будет объединено: порядок входов, формат, дубликаты, продолжительности
+
+    Входы отображаются в память один раз (сеанс передаётся объединению), поэтому
+    построение плана и последующее выполнение читают каждый файл однократно.
+    """
+
+    def __init__(self, inputs, output, options=None, session=None):
+        from .streams import STREAM_FORMATS
+
+        self.options = options or MergeOptions()
+        # Результат может быть потоком: stdout, каналом или сокетом
+        self.output = output
+        self.streaming = is_stream(output)
+        if self.options.mirrors and self.options.sharded:
+            raise ValueError("Output parts cannot be mirrored")
+        self.mirrors = []
+        if self.options.mirrors:
+            from .tee import mirror_paths
+            self.mirrors = mirror_paths(output, self.options.mirrors, self.streaming)
+        self.paths = sort_inputs(inputs) if self.options.sort else list(inputs)
+        if not self.paths:
+            raise ValueError("No input files")
+        self.own_session = session is None
+        self.session = MappedSession() if session is None else session
+        started = time.perf_counter()
+
+        formats = {detect_format(path, self.session.open(path)) for path in self.paths}
+        self.format = formats.pop() if len(formats) == 1 else 'raw'
+        if self.options.verify or self.format not in STREAM_FORMATS:
+            # Потоки, которые объединение всё равно сохранит во временные файлы, сохраняются
+            # сразу - тогда у плана есть их размеры, продолжительности и поиск дубликатов
+            for path in self.paths:
+                self.session.spool(path, self.format)
+        self.duplicates = find_duplicates(self.paths, self.session)
+        self.inputs = []
+        for path in self.paths:
+            mapped = self.session.open(path)
+            self.inputs.append(InputInfo(path, mapped.size, detect_format(path, mapped),
+                                         probe_duration(mapped, self.options.cache)))
+        self.plan_seconds = time.perf_counter() - started
+
+    @property
+    def total_bytes(self):
+        # Размер потока заранее неизвестен (None) и в сумму не входит
+        return sum(info.size or 0 for info in self.inputs)
+
+    @property
+    def duration(self):
+        """Ожидаемая продолжительность результата или None, если какой-то вход не удалось оценить"""
+        durations = [info.duration for info in self.inputs]
+        return None if None in durations else sum(durations)
+
+    def execute(self, progress=None, cancel=None):
+        """Выполняет план; progress(Progress) вызывается по файлам и по мере записи"""
+        try:
+            return self._execute(progress, cancel)
+        finally:
+            if self.own_session:
+                self.session.close()
+
+    def _execute(self, progress, cancel):
+        options = self.options
+        if self.duplicates and not options.allow_duplicates:
+            raise DuplicateInputsError(self.duplicates)
+        if options.sharded and self.streaming:
+            raise ValueError("Output parts need a file name, not a stream")
+        if not self.streaming and not options.sharded and not options.overwrite and os.path.exists(self.output):
+            raise FileExistsError(f"Output file already exists: {self.output}")
+        for mirror in self.mirrors:
+            if not options.overwrite and os.path.exists(mirror):
+                raise FileExistsError(f"Output file already exists: {mirror}")
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+
+        count = len(self.paths)
+        total = self.total_bytes
+        state = {'index': 0, 'path': None}
+
+        def report(bytes_written):
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            if progress is not None:
+                progress(Progress(state['index'], count, state['path'], bytes_written, total))
+
+        tap = ProgressTap(report, step=total // PROGRESS_STEPS)
+
+        def on_file(i, path):
+            state['index'], state['path'] = i, path
+            report(tap.bytes)
+
+        if not self.streaming:
+            # Перезаписываемый файл не должен оставаться отображённым
+            self.session.discard(self.output)
+        started = time.perf_counter()
+        if options.sharded:
+            return self._execute_parts(on_file, tap, started)
+        key = None
+        output_abs = None if self.streaming else os.path.abspath(self.output)
+        # Совпадение результата со входом обнаружит merge_audio - до этого в кэш не заглядываем;
+        # копии пишутся из кусков самого объединения, поэтому с ними кэш не используется
+        if (options.output_cache is not None and output_abs is not None and not self.mirrors
+                and all(os.path.abspath(path) != output_abs for path in self.paths)):
+            key = self._cache_key()
+            # Пики и главы в кэше не учтены (пики - отдельные файлы рядом с результатом, главы меняют
+            # его заголовок): такое объединение выполняется
+            if key is not None and not options.peaks and not options.chapters:
+                hit = options.output_cache.fetch(key, self.output, check=options.verify)
+                if hit is not None:
+                    if options.sidecar:
+                        write_sha256_sidecar(self.output, hit.sha256)
+                    elapsed = time.perf_counter() - started
+                    timings = {'plan': self.plan_seconds, 'write': elapsed, 'verify': 0.0,
+                               'total': self.plan_seconds + elapsed}
+                    return MergeResult(self, None, timings, hit)
+        try:
+            writer = merge_audio(self.paths, self.output, session=self.session, on_file=on_file,
+                                 use_reflink=options.use_reflink, sidecar=options.sidecar,
+                                 peaks=options.peaks, cache=options.cache, verify=options.verify,
+                                 verify_workers=options.verify_workers, taps={'progress': tap},
+                                 tree=options.tree, mirrors=self.mirrors, mirror_buffer=options.mirror_buffer,
+                                 chapters=options.chapters)
+        except MergeCancelled:
+            # Временный файл при любой ошибке удаляет само объединение, прежний результат остаётся
+            logging.info(f"Merge into {self.output} was cancelled")
+            raise
+        if key is not None:
+            options.output_cache.store(key, self.output, writer.taps['sha256'].hexdigest,
+                                       writer.taps['duration'].duration)
+        elapsed = time.perf_counter() - started
+
+        verify_seconds = writer.verification.seconds if writer.verification is not None else 0.0
+        timings = {
+            'plan': self.plan_seconds,
+            'write': elapsed - verify_seconds,
+            'verify': verify_seconds,
+            'total': self.plan_seconds + elapsed,
+        }
+        return MergeResult(self, writer, timings)
+
+    def _execute_parts(self, on_file, tap, started):
+        """Объединение сразу частями; неполные части удаляет сама merge_parts"""
+        from .split import merge_parts
+
+        options = self.options
+        if options.peaks:
+            logging.info("Waveform peaks are not written for output parts")
+        if options.chapters:
+            logging.info("Chapters are not written for output parts, their starts are in the parts list")
+        try:
+            parts = merge_parts(self.paths, self.output, options.max_part_bytes, options.max_part_seconds,
+                                session=self.session, on_file=on_file, overwrite=options.overwrite,
+                                use_reflink=options.use_reflink, sidecar=options.sidecar, cache=options.cache,
+                                verify=options.verify, verify_workers=options.verify_workers,
+                                taps={'progress': tap})
+        except MergeCancelled:
+            logging.info(f"Merge into parts of {self.output} was cancelled")
+            raise
+        elapsed = time.perf_counter() - started
+        verify_seconds = sum(part.verification.seconds for part in parts if part.verification is not None)
+        timings = {
+            'plan': self.plan_seconds,
+            'write': elapsed - verify_seconds,
+            'verify': verify_seconds,
+            'total': self.plan_seconds + elapsed,
+        }
+        return MergeResult(self, None, timings, parts=parts)
+
+    def _cache_key(self):
+        """Ключ кэша результатов; хеши входов запоминаются в кэше разбора"""
+        from .outputcache import merge_key
+
+        cache = self.options.cache
+        if cache is None:
+            from .probecache import ProbeCache
+            cache = ProbeCache()
+        try:
+            return merge_key(self, cache)
+        finally:
+            if cache is not self.options.cache:
+                cache.close()
+
+
+def merge(inputs, output, options=None, progress=None, cancel=None, session=None):
+    """Строит план и выполняет его; возвращает MergeResult"""
+    return MergePlan(inputs, output, options, session).execute(progress, cancel)
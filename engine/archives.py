@@ -0,0 +1,185 @@
+"""Входы прямо из архивов ZIP и TAR, без распаковки на диск
+
+Элемент архива задаётся путём "архив::имя/в/архиве.wav". Несжатые элементы
+(ZIP без сжатия, обычный TAR) - окна в отображении файла архива: их данные
+переносятся так же, как данные обычных файлов (клонирование, copy_file_range,
+срезы памяти). Сжатые элементы читаются как поток (engine.streams.StreamInput)
+и распаковываются по ходу объединения.
+"""
+import logging
+import os
+import struct
+
+from .inputs import is_audio_file, name_key
+from .mapped import ARCHIVE_SEPARATOR
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Локальный заголовок элемента ZIP: за ним имя и дополнительное поле, затем данные
+ZIP_LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+ZIP_LOCAL_MAGIC = b'PK\x03\x04'
+
+# Сигнатуры gzip, bzip2 и xz: у сжатого TAR данные элементов не лежат в файле как есть
+COMPRESSED_SIGNATURES = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00')
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def member_path(archive, name):
+    return archive + ARCHIVE_SEPARATOR + name
+
+
+def split_member(path):
+    """(путь архива, имя элемента) для пути элемента или None"""
+    archive, separator, name = path.partition(ARCHIVE_SEPARATOR)
+    if not separator or not name or not is_archive(archive):
+        return None
+    return archive, name
+
+
+def is_listed(name):
+    """Аудиофайл архива, кроме скрытых и служебных (__MACOSX, ._имя)"""
+    parts = name.split('/')
+    if any(part.startswith('.') or part == '__MACOSX' for part in parts):
+        return False
+    return is_audio_file(parts[-1])
+
+
+class Archive:
+    """Открытый архив: оглавление и чтение элементов по имени"""
+
+    def __init__(self, path, mapped):
+        self.path = path
+        # Отображение файла архива (из сеанса): из него читаются несжатые элементы
+        self.mapped = mapped
+        self.zip = None
+        self.tar = None
+        self.compressed = False
+        import tarfile
+        import zipfile
+
+        try:
+            if path.lower().endswith('.zip'):
+                self.zip = zipfile.ZipFile(path)
+                self.members = {info.filename: info for info in self.zip.infolist() if not info.is_dir()}
+            else:
+                self.compressed = bytes(mapped.head(6)).startswith(COMPRESSED_SIGNATURES)
+                self.tar = tarfile.open(path, 'r:*')
+                self.members = {member.name: member for member in self.tar.getmembers() if member.isfile()}
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            self.close()
+            raise ValueError(f"Cannot read archive {path}: {str(e)}")
+
+    def open(self, name):
+        """Элемент архива: окно в архиве без сжатия или распаковываемый поток"""
+        from .streams import StreamInput
+
+        info = self.members.get(name)
+        if info is None:
+            raise FileNotFoundError(f"No {name} in archive {self.path}")
+        path = member_path(self.path, name)
+        if self.zip is not None:
+            if info.compress_type == 0 and not info.flag_bits & 1:
+                header = ZIP_LOCAL_HEADER.unpack(self.mapped.view(info.header_offset, ZIP_LOCAL_HEADER.size))
+                if header[0] != ZIP_LOCAL_MAGIC:
+                    raise ValueError(f"Corrupt local header of {name} in {self.path}")
+                base = info.header_offset + ZIP_LOCAL_HEADER.size + header[9] + header[10]
+                return ArchiveMember(self, path, base, info.file_size)
+            return StreamInput(path, file=self.zip.open(info))
+        if not self.compressed and not info.issparse():
+            return ArchiveMember(self, path, info.offset_data, info.size)
+        # Сжатый TAR читается последовательно; обращение к более раннему элементу распаковывает архив заново
+        return StreamInput(path, file=self.tar.extractfile(info))
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+        if self.tar is not None:
+            self.tar.close()
+
+
+class ArchiveMember:
+    """Несжатый элемент архива: окно в отображении файла архива
+
+    Смещения отсчитываются от начала данных элемента; file_path и base говорят
+    writer'у и проверке, где эти данные лежат в файле архива.
+    """
+
+    def __init__(self, archive, path, base, size):
+        self.path = path
+        self.name = path
+        self.file_path = archive.path
+        self.base = base
+        self.size = size
+        self.archive = archive.mapped
+        self.stamp = archive.mapped.stamp
+        self.data = archive.mapped.view(base, size)
+        if len(self.data) < size:
+            raise ValueError(f"{path} is truncated")
+
+    def fileno(self):
+        return self.archive.fileno()
+
+    def view(self, offset=0, length=None):
+        if length is None:
+            return self.data[offset:]
+        return self.data[offset:offset + length]
+
+    def find(self, sub, start=0, end=None):
+        found = self.archive.find(sub, self.base + start, self.base + (self.size if end is None else end))
+        return found - self.base if found >= 0 else -1
+
+    def head(self, length):
+        return self.data[:length]
+
+    def tail(self, length):
+        return self.data[max(0, self.size - length):]
+
+    def seek(self, offset):
+        self.archive.seek(self.base + offset)
+
+    def readinto(self, buffer):
+        return self.archive.readinto(buffer)
+
+    def close(self):
+        self.data.release()
+
+
+def open_member(session, path):
+    """Элемент архива для сеанса (engine.mapped.MappedSession) или None, если путь - не элемент"""
+    member = split_member(path)
+    if member is None:
+        return None
+    archive_path, name = member
+    # Элементы ссылаются на отображение архива - оно не должно закрыться раньше них
+    mapped = session.open(archive_path, pin=True)
+    key = os.path.abspath(archive_path)
+    archive = session.archives.get(key)
+    if archive is None or archive.mapped is not mapped:
+        # Архив впервые открыт в сеансе или изменился с прошлого раза
+        if archive is not None:
+            archive.close()
+        archive = session.archives[key] = Archive(archive_path, mapped)
+    return archive.open(name)
+
+
+def archive_members(path):
+    """Пути аудиофайлов архива в естественном порядке полных имён (каталог за каталогом)"""
+    import tarfile
+    import zipfile
+
+    try:
+        if path.lower().endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                names = [info.filename for info in archive.infolist() if not info.is_dir()]
+        else:
+            with tarfile.open(path, 'r:*') as archive:
+                names = [member.name for member in archive.getmembers() if member.isfile()]
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise ValueError(f"Cannot read archive {path}: {str(e)}")
+    names = sorted((name for name in names if is_listed(name)), key=name_key)
+    if not names:
+        logging.warning(f"No audio files in archive {path}")
+    return [member_path(path, name) for name in names]
@@ -0,0 +1,253 @@
+"""Пакетный режим: много независимых объединений из манифеста на общем пуле потоков
+
+Манифест - JSON (список заданий или {"jobs": [...]}) или CSV с колонками
+output, inputs и необязательными колонками параметров MergeOptions.
+Во входах допускаются каталоги и маски; в CSV входы разделяются ";".
+Относительные пути считаются от каталога манифеста.
+
+Задания распределяются по устройствам (st_dev) входов и результата: на одном
+устройстве одновременно идёт не больше per_device заданий, поэтому два задания
+не гоняют головки одного диска, пока другие диски простаивают.
+"""
+import csv
+import json
+import logging
+import os
+import threading
+import time
+
+from .api import MergeOptions, merge
+from .inputs import expand_inputs, resolve_output
+
+# Параметры MergeOptions, которые можно задать в манифесте, и их типы
+JOB_OPTIONS = {
+    'sort': bool,
+    'allow_duplicates': bool,
+    'overwrite': bool,
+    'use_reflink': bool,
+    'sidecar': bool,
+    'peaks': bool,
+    'verify': bool,
+    'verify_workers': int,
+    'max_part_bytes': int,
+    'max_part_seconds': float,
+    'chapters': bool,
+}
+
+CSV_INPUT_SEPARATOR = ';'
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+class BatchJob:
+    """Задание манифеста: входы (уже раскрытые), результат и параметры"""
+
+    def __init__(self, name, inputs, output, options, error=None):
+        self.name = name
+        self.inputs = inputs
+        self.output = output
+        self.options = options
+        # Ошибка в записи манифеста: задание не выполняется, но попадает в отчёт
+        self.error = error
+        self.devices = job_devices(inputs, output) if error is None else frozenset()
+
+
+class JobResult:
+    """Итог задания: MergeResult или текст ошибки"""
+
+    def __init__(self, job, result=None, error=None, seconds=0.0):
+        self.job = job
+        self.result = result
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def to_dict(self):
+        data = {'name': self.job.name, 'output': self.job.output, 'ok': self.ok, 'seconds': round(self.seconds, 6)}
+        if self.ok:
+            data.update(self.result.to_dict())
+        else:
+            data['error'] = self.error
+        return data
+
+
+class BatchReport:
+    """Итог пакета: результаты заданий в порядке манифеста и общая пропускная способность"""
+
+    def __init__(self, results, seconds):
+        self.results = results
+        self.seconds = seconds
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def bytes(self):
+        return sum(result.result.bytes for result in self.results if result.ok)
+
+    @property
+    def throughput(self):
+        """Записано байт в секунду по всему пакету (время - от начала до конца, а не сумма заданий)"""
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def to_dict(self):
+        return {
+            'jobs': len(self.results),
+            'succeeded': len(self.results) - len(self.failed),
+            'failed': len(self.failed),
+            'bytes': self.bytes,
+            'seconds': round(self.seconds, 6),
+            'throughput': round(self.throughput),
+            'results': [result.to_dict() for result in self.results],
+        }
+
+
+def path_device(path):
+    """st_dev пути; для ещё не созданного результата - ближайшего существующего каталога"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev
+
+
+def job_devices(inputs, output):
+    return frozenset({path_device(path) for path in inputs} | {path_device(os.path.dirname(os.path.abspath(output)))})
+
+
+def parse_options(values, where):
+    """MergeOptions из словаря манифеста (значения CSV приходят строками)"""
+    options = {}
+    for key, value in values.items():
+        if key not in JOB_OPTIONS:
+            raise ValueError(f"Unknown option {key!r} in {where}")
+        if value is None or value == '':
+            continue
+        if JOB_OPTIONS[key] is bool and isinstance(value, str):
+            value = value.strip().lower() in TRUE_VALUES
+        options[key] = JOB_OPTIONS[key](value)
+    return MergeOptions(**options)
+
+
+def make_job(entry, base_dir, number):
+    """Задание из записи манифеста: пути относительно манифеста, входы раскрыты"""
+    where = f"job {number}"
+    entry = dict(entry)
+    name = entry.pop('name', None) or str(number)
+    output = entry.pop('output', None)
+    inputs = entry.pop('inputs', None)
+    if not output or not inputs:
+        raise ValueError(f"{where} needs 'output' and 'inputs'")
+    if isinstance(inputs, str):
+        inputs = [item.strip() for item in inputs.split(CSV_INPUT_SEPARATOR) if item.strip()]
+    paths = expand_inputs([os.path.join(base_dir, item) for item in inputs])
+    if not paths:
+        raise ValueError(f"{where} has no input files")
+    output = resolve_output(os.path.join(base_dir, output), paths)
+    return BatchJob(name, paths, output, parse_options(entry, where))
+
+
+def load_manifest(path):
+    """Задания из JSON или CSV манифеста"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if os.path.splitext(path)[1].lower() == '.csv':
+            entries = list(csv.DictReader(f))
+        else:
+            entries = json.load(f)
+            if isinstance(entries, dict):
+                entries = entries.get('jobs', [])
+    jobs = []
+    for number, entry in enumerate(entries, 1):
+        try:
+            jobs.append(make_job(entry, base_dir, number))
+        except (ValueError, TypeError, OSError) as e:
+            logging.warning(f"Skipping job {number} of {path}: {str(e)}")
+            name = entry.get('name') if isinstance(entry, dict) else None
+            output = entry.get('output') if isinstance(entry, dict) else None
+            jobs.append(BatchJob(name or str(number), [], output, None, error=str(e)))
+    return jobs
+
+
+class DeviceScheduler:
+    """Выдаёт задания потокам так, чтобы на каждом устройстве шло не больше limit заданий"""
+
+    def __init__(self, jobs, limit=1):
+        self.pending = list(jobs)
+        self.limit = limit
+        self.busy = {}
+        self.condition = threading.Condition()
+
+    def _runnable(self):
+        for job in self.pending:
+            if all(self.busy.get(device, 0) < self.limit for device in job.devices):
+                return job
+        return None
+
+    def acquire(self, cancel=None):
+        """Следующее задание, которое можно начать, или None, когда заданий не осталось"""
+        with self.condition:
+            while self.pending and not (cancel is not None and cancel.cancelled):
+                job = self._runnable()
+                if job is not None:
+                    self.pending.remove(job)
+                    for device in job.devices:
+                        self.busy[device] = self.busy.get(device, 0) + 1
+                    return job
+                self.condition.wait()
+            return None
+
+    def release(self, job):
+        with self.condition:
+            for device in job.devices:
+                self.busy[device] -= 1
+            self.condition.notify_all()
+
+
+def run_job(job, cancel=None):
+    if job.error is not None:
+        return JobResult(job, error=job.error)
+    started = time.perf_counter()
+    try:
+        result = merge(job.inputs, job.output, job.options, cancel=cancel)
+    except Exception as e:
+        logging.warning(f"Batch job {job.name} failed: {str(e)}")
+        return JobResult(job, error=str(e), seconds=time.perf_counter() - started)
+    logging.info(f"Batch job {job.name} done: {job.output} ({result.bytes} bytes)")
+    return JobResult(job, result, seconds=time.perf_counter() - started)
+
+
+def run_batch(jobs, workers=4, per_device=1, cancel=None):
+    """Выполняет задания на пуле из workers потоков; возвращает BatchReport"""
+    scheduler = DeviceScheduler(jobs, per_device)
+    results = {}
+
+    def worker():
+        while True:
+            job = scheduler.acquire(cancel)
+            if job is None:
+                return
+            try:
+                results[id(job)] = run_job(job, cancel)
+            finally:
+                scheduler.release(job)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"smerge-batch-{i}", daemon=True)
+               for i in range(max(1, min(workers, len(jobs))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    ordered = [results.get(id(job)) or JobResult(job, error="Cancelled before start") for job in jobs]
+    report = BatchReport(ordered, seconds)
+    logging.info(f"Batch finished: {len(jobs) - len(report.failed)}/{len(jobs)} jobs, "
+                 f"{report.bytes} bytes in {seconds:.2f} s ({report.throughput / 1e6:.1f} MB/s)")
+    return report
@@ -0,0 +1,271 @@
+"""Главы объединения: где в результате начинается каждый вход
+
+Начала глав складываются из продолжительностей входов, известных по их
+заголовкам (так же, как у плана объединения), - аудиоданные для этого не
+читаются. Из них пишутся лист <результат без расширения>.cue рядом с
+результатом и метки внутри него, которые движки добавляют в уже собираемые
+заголовки: кадры CHAP и CTOC в ведущем ID3v2 теге MP3, чанки cue и LIST adtl
+после данных WAV, блок CUESHEET и комментарии CHAPTERnnn в FLAC.
+"""
+import logging
+import os
+import struct
+
+from .archives import split_member
+from .mapped import STDIN_PATH
+
+# Кадров в секунде у времени листа .cue (mm:ss:ff)
+CUE_FRAMES = 75
+
+CUE_SUFFIX = '.cue'
+
+# Тип файла в строке FILE листа .cue; прочие форматы плееры принимают как WAVE
+CUE_FILE_TYPES = {'mp3': 'MP3'}
+
+# Больше элементов одного кадра CTOC не вмещает (счётчик - один байт)
+CTOC_LIMIT = 255
+
+# Номер завершающей дорожки CUESHEET не с CD; дорожки нумеруются до него
+FLAC_LEAD_OUT = 255
+
+# Флаги CTOC: оглавление верхнего уровня, элементы упорядочены
+CTOC_FLAGS = 0x03
+
+# Флаги тега ID3v2: рассинхронизация, расширенный заголовок, завершающий заголовок
+ID3_UNSYNC = 0x80
+ID3_EXTENDED = 0x40
+ID3_FOOTER = 0x10
+
+# Смещение CHAP не задано: главы определяются временем
+CHAP_NO_OFFSET = 0xFFFFFFFF
+
+
+class Chapter:
+    """Глава результата: название и положение в секундах"""
+
+    def __init__(self, title, start, duration):
+        self.title = title
+        self.start = start
+        self.duration = duration
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    def to_dict(self):
+        return {'title': self.title, 'start': self.start, 'duration': self.duration}
+
+
+def chapter_title(path, number):
+    """Название главы: имя входа (элемента архива) без расширения"""
+    if path == STDIN_PATH:
+        return f"Track {number}"
+    member = split_member(path)
+    name = member[1] if member else path
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def plan_chapters(paths, durations):
+    """Главы по продолжительностям входов: каждая начинается там, где кончилась предыдущая"""
+    chapters = []
+    start = 0.0
+    for number, (path, duration) in enumerate(zip(paths, durations), 1):
+        if duration is None:
+            raise ValueError(f"Could not determine the duration of {os.path.basename(path)} for chapters")
+        chapters.append(Chapter(chapter_title(path, number), start, duration))
+        start += duration
+    return chapters
+
+
+def cue_path(output_path):
+    return os.path.splitext(output_path)[0] + CUE_SUFFIX
+
+
+def cue_time(seconds):
+    """Время листа .cue: минуты, секунды и кадры по 1/75 секунды"""
+    frames = round(seconds * CUE_FRAMES)
+    minutes, frames = divmod(frames, 60 * CUE_FRAMES)
+    return f"{minutes:02d}:{frames // CUE_FRAMES:02d}:{frames % CUE_FRAMES:02d}"
+
+
+def cue_sheet(file_name, fmt, chapters):
+    """Текст листа .cue: одна дорожка на главу"""
+    lines = [f'FILE "{file_name.replace(chr(34), chr(39))}" {CUE_FILE_TYPES.get(fmt, "WAVE")}']
+    for number, chapter in enumerate(chapters, 1):
+        lines.append(f"  TRACK {number:02d} AUDIO")
+        lines.append(f'    TITLE "{chapter.title.replace(chr(34), chr(39))}"')
+        lines.append(f"    INDEX 01 {cue_time(chapter.start)}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_cue(output_path, fmt, chapters):
+    """Пишет лист .cue рядом с результатом и возвращает его путь"""
+    path = cue_path(output_path)
+    temp_path = path + '.tmp'
+    # Метка порядка байтов нужна плеерам Windows, чтобы не читать лист в кодировке ANSI
+    with open(temp_path, 'w', encoding='utf-8-sig') as f:
+        f.write(cue_sheet(os.path.basename(output_path), fmt, chapters))
+    os.replace(temp_path, path)
+    return path
+
+
+def sample_positions(chapters, sample_rate):
+    """Начала глав и конец последней в сэмплах"""
+    return [round(chapter.start * sample_rate) for chapter in chapters] + [round(chapters[-1].end * sample_rate)]
+
+
+def wav_chapter_chunks(chapters, sample_rate):
+    """Чанки cue (точки начала глав) и LIST adtl (их названия и длины) для конца WAV"""
+    positions = sample_positions(chapters, sample_rate)
+    points = bytearray(struct.pack('<I', len(chapters)))
+    notes = bytearray(b'adtl')
+    for number, chapter in enumerate(chapters, 1):
+        start, length = positions[number - 1], positions[number] - positions[number - 1]
+        points += struct.pack('<II4sIII', number, start, b'data', 0, 0, start)
+        notes += riff_chunk(b'labl', struct.pack('<I', number) + chapter.title.encode('utf-8') + b'\x00')
+        # Регион главы: редакторы показывают его вместе с длиной
+        notes += riff_chunk(b'ltxt', struct.pack('<II4sHHHH', number, length, b'rgn ', 0, 0, 0, 0))
+    return riff_chunk(b'cue ', points) + riff_chunk(b'LIST', notes)
+
+
+def riff_chunk(chunk_id, body):
+    return chunk_id + struct.pack('<I', len(body)) + body + (b'\x00' if len(body) & 1 else b'')
+
+
+def syncsafe(value):
+    return bytes((value >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+
+def syncsafe_value(data):
+    """Синхробезопасное число: по 7 бит в байте"""
+    value = 0
+    for b in data:
+        value = (value << 7) | (b & 0x7F)
+    return value
+
+
+def id3_frame(frame_id, body, major):
+    """Кадр ID3v2.3 или 2.4 (в 2.4 размер кадра тоже синхробезопасный)"""
+    size = syncsafe(len(body)) if major == 4 else struct.pack('>I', len(body))
+    return frame_id + size + b'\x00\x00' + body
+
+
+def id3_title(text, major):
+    """Кадр TIT2: UTF-8 в ID3v2.4, UTF-16 с меткой порядка байтов в 2.3"""
+    body = b'\x03' + text.encode('utf-8') if major == 4 else b'\x01' + text.encode('utf-16')
+    return id3_frame(b'TIT2', body, major)
+
+
+def id3_chapter_frames(chapters, major):
+    """Кадры CHAP для каждой главы и оглавление CTOC"""
+    frames = bytearray()
+    ids = []
+    for number, chapter in enumerate(chapters, 1):
+        element = f"ch{number}".encode('ascii') + b'\x00'
+        ids.append(element)
+        body = element + struct.pack('>IIII', round(chapter.start * 1000), round(chapter.end * 1000),
+                                     CHAP_NO_OFFSET, CHAP_NO_OFFSET)
+        frames += id3_frame(b'CHAP', body + id3_title(chapter.title, major), major)
+    if len(ids) > CTOC_LIMIT:
+        logging.warning(f"The ID3v2 table of contents lists only the first {CTOC_LIMIT} "
+                        f"of {len(ids)} chapters")
+        ids = ids[:CTOC_LIMIT]
+    frames += id3_frame(b'CTOC', b'toc\x00' + bytes([CTOC_FLAGS, len(ids)]) + b''.join(ids), major)
+    return frames
+
+
+def id3_with_chapters(tag, chapters):
+    """ID3v2 тег tag (или новый ID3v2.3, если tag пуст) с кадрами глав вместо прежних
+
+    Прочие кадры переносятся как есть, расширенный заголовок и заполнение
+    отбрасываются. Тег, кадры которого нельзя дописать без перекодирования
+    (ID3v2.2, рассинхронизация, завершающий заголовок), возвращается без
+    изменений - главы тогда остаются только в листе .cue.
+    """
+    if not tag:
+        body = id3_chapter_frames(chapters, 3)
+        return b'ID3\x03\x00\x00' + syncsafe(len(body)) + body
+    major, flags = tag[3], tag[5]
+    if major not in (3, 4) or flags & (ID3_UNSYNC | ID3_FOOTER):
+        logging.warning(f"Chapters are not added to an ID3v2.{major} tag with flags 0x{flags:02x}")
+        return tag
+    end = 10 + syncsafe_value(tag[6:10])
+    pos = 10
+    if flags & ID3_EXTENDED:
+        if major == 4:
+            pos += syncsafe_value(tag[10:14])
+        else:
+            pos += 4 + struct.unpack_from('>I', tag, 10)[0]
+    kept = bytearray()
+    while pos + 10 <= end and tag[pos] != 0:
+        size = syncsafe_value(tag[pos + 4:pos + 8]) if major == 4 else struct.unpack_from('>I', tag, pos + 4)[0]
+        frame = tag[pos:pos + 10 + size]
+        if frame[:4] not in (b'CHAP', b'CTOC'):
+            kept += frame
+        pos += 10 + size
+    body = bytes(kept) + id3_chapter_frames(chapters, major)
+    return b'ID3' + bytes([major, tag[4], flags & ~ID3_EXTENDED]) + syncsafe(len(body)) + body
+
+
+def vorbis_comment(body):
+    """(поставщик, комментарии) блока VORBIS_COMMENT"""
+    length = struct.unpack_from('<I', body, 0)[0]
+    vendor = bytes(body[4:4 + length])
+    pos = 4 + length
+    count = struct.unpack_from('<I', body, pos)[0]
+    pos += 4
+    comments = []
+    for _ in range(count):
+        length = struct.unpack_from('<I', body, pos)[0]
+        comments.append(bytes(body[pos + 4:pos + 4 + length]))
+        pos += 4 + length
+    return vendor, comments
+
+
+def vorbis_time(seconds):
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    return f"{hours:02d}:{minutes:02d}:{milliseconds // 1000:02d}.{milliseconds % 1000:03d}"
+
+
+def flac_chapter_comment(body, chapters):
+    """Блок VORBIS_COMMENT (или новый, если body None) с комментариями CHAPTERnnn вместо прежних"""
+    vendor, comments = vorbis_comment(body) if body is not None else (b'smerge', [])
+    comments = [comment for comment in comments if not comment[:7].upper() == b'CHAPTER']
+    width = max(3, len(str(len(chapters))))
+    for number, chapter in enumerate(chapters, 1):
+        key = f"CHAPTER{number:0{width}d}"
+        comments.append(f"{key}={vorbis_time(chapter.start)}".encode('utf-8'))
+        comments.append(f"{key}NAME={chapter.title}".encode('utf-8'))
+    data = bytearray(struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', len(comments)))
+    for comment in comments:
+        data += struct.pack('<I', len(comment)) + comment
+    return bytes(data)
+
+
+def flac_cuesheet(chapters, sample_rate):
+    """Блок CUESHEET (не CD): дорожка с индексом 1 на каждую главу и завершающая дорожка"""
+    positions = sample_positions(chapters, sample_rate)
+    # Каталог, lead-in, флаг CD с резервом и число дорожек
+    data = bytearray(bytes(128) + bytes(8) + bytes(259) + bytes([len(chapters) + 1]))
+    for number, start in enumerate(positions[:-1], 1):
+        data += struct.pack('>QB', start, number) + bytes(12 + 14) + b'\x01'
+        data += struct.pack('>QB', 0, 1) + bytes(3)
+    data += struct.pack('>QB', positions[-1], FLAC_LEAD_OUT) + bytes(12 + 14) + b'\x00'
+    return bytes(data)
+
+
+def flac_chapter_blocks(blocks, chapters, sample_rate):
+    """Сохраняемые блоки метаданных FLAC с главами: комментарии CHAPTERnnn и CUESHEET"""
+    from .flac import BLOCK_CUESHEET, BLOCK_VORBIS_COMMENT
+    comment = next((body for block_type, body in blocks if block_type == BLOCK_VORBIS_COMMENT), None)
+    result = [(block_type, body) for block_type, body in blocks
+              if block_type not in (BLOCK_VORBIS_COMMENT, BLOCK_CUESHEET)]
+    result.insert(0, (BLOCK_VORBIS_COMMENT, flac_chapter_comment(comment, chapters)))
+    if len(chapters) < FLAC_LEAD_OUT:
+        result.append((BLOCK_CUESHEET, flac_cuesheet(chapters, sample_rate)))
+    else:
+        logging.warning(f"FLAC CUESHEET holds at most {FLAC_LEAD_OUT - 1} tracks, "
+                        f"{len(chapters)} chapters are only written as comments")
+    return result
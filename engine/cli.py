@@ -0,0 +1,414 @@
+"""Командная строка без графического интерфейса: python -m smerge merge -o out.wav in1.wav in2.wav
+
+tkinter здесь не импортируется; тяжёлые модули движка загружаются только при объединении.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+
+COMMANDS = ('merge', 'split', 'batch', 'watch', 'serve')
+
+# Коды завершения
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_DUPLICATES = 3
+EXIT_EXISTS = 4
+EXIT_VERIFY = 5
+
+# Имя результата, означающее стандартный вывод
+STDOUT_OUTPUT = '-'
+
+# Суффиксы размеров (--max-size) и единицы продолжительности (--max-duration)
+SIZE_SUFFIXES = 'KMGT'
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+
+# Предел кэша результатов по умолчанию, ГБ
+DEFAULT_REUSE_LIMIT = 20
+
+
+class CommandError(Exception):
+    """Ошибка команды с кодом завершения и дополнительными полями для JSON"""
+
+    def __init__(self, message, exit_code=EXIT_FAILED, **details):
+        super().__init__(message)
+        self.exit_code = exit_code
+        self.details = details
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='smerge', description="Merges audio files without conversion or quality loss")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    merge = commands.add_parser('merge', help="merge audio files into one")
+    merge.add_argument('inputs', nargs='+',
+                       help="audio files, directories, glob patterns, ZIP/TAR archives, "
+                            "named pipes, or - for standard input")
+    merge.add_argument('-o', '--output', required=True,
+                       help="output file, or - for standard output; "
+                            "without an extension the first input's extension is used")
+    merge.add_argument('-f', '--force', action='store_true', help="replace an existing output file")
+    merge.add_argument('--keep-order', action='store_true',
+                       help="merge in the given order instead of sorting by file name")
+    merge.add_argument('-r', '--recursive', action='store_true',
+                       help="include subfolders of input folders (folder by folder, each in name order)")
+    merge.add_argument('--allow-duplicates', action='store_true',
+                       help="merge even if some inputs look like duplicates")
+    merge.add_argument('--peaks', action='store_true', help="write waveform peaks next to a WAV output")
+    merge.add_argument('--verify', action='store_true', help="re-read and verify the output after writing")
+    merge.add_argument('--chapters', action='store_true',
+                       help="mark where each input starts: a .cue sheet and chapters inside WAV/MP3/FLAC")
+    merge.add_argument('--no-reflink', action='store_true', help="always copy data, never clone extents")
+    merge.add_argument('--no-sidecar', action='store_true', help="do not write the .sha256 file")
+    merge.add_argument('--tree', nargs='?', type=int, const=True, metavar='N',
+                       help="merge in parallel groups of N files first (automatic for huge WAV/FLAC/Ogg/AAC sets)")
+    merge.add_argument('--max-part-size', type=parse_size, metavar='SIZE',
+                       help="write the output as standalone parts of at most SIZE (e.g. 700M) plus a manifest "
+                            "(WAV, MP3, FLAC and AAC; not Ogg)")
+    merge.add_argument('--max-part-duration', type=parse_duration, metavar='TIME',
+                       help="write the output as standalone parts of at most TIME (e.g. 30m) plus a manifest "
+                            "(WAV, MP3, FLAC and AAC; not Ogg)")
+    merge.add_argument('--mirror', action='append', metavar='PATH',
+                       help="also write the output to PATH (a file or a folder) in the same pass; repeatable")
+    merge.add_argument('--mirror-buffer', type=parse_size, metavar='SIZE',
+                       help="how far a slow mirror may fall behind (default: 64M)")
+    merge.add_argument('--reuse', action='store_true',
+                       help="take an identical earlier merge from the output cache, remember new ones")
+    merge.add_argument('--reuse-limit', type=float, default=DEFAULT_REUSE_LIMIT, metavar='GB',
+                       help=f"output cache size limit (default: {DEFAULT_REUSE_LIMIT:g} GB)")
+    merge.add_argument('--json', action='store_true', help="print the result as JSON")
+    merge.add_argument('-v', '--verbose', action='store_true', help="log progress to stderr")
+
+    split = commands.add_parser('split', help="cut an audio file into parts at frame boundaries")
+    split.add_argument('input', help="WAV, MP3, FLAC or AAC file (or an archive member)")
+    split.add_argument('-o', '--output-dir', help="folder for the parts (default: next to the input)")
+    split.add_argument('-n', '--parts', type=int, help="this many parts of equal duration")
+    split.add_argument('--max-size', type=parse_size, metavar='SIZE', help="largest part, e.g. 700M or 2G")
+    split.add_argument('--fat32', action='store_true', help="parts small enough for FAT32 media (under 4 GiB)")
+    split.add_argument('--max-duration', type=parse_duration, metavar='TIME',
+                       help="longest part, e.g. 90s, 30m or 1h")
+    split.add_argument('-f', '--force', action='store_true', help="replace existing part files")
+    split.add_argument('--no-reflink', action='store_true', help="always copy data, never clone extents")
+    split.add_argument('--no-sidecar', action='store_true', help="do not write .sha256 files")
+    split.add_argument('--json', action='store_true', help="print the result as JSON")
+    split.add_argument('-v', '--verbose', action='store_true', help="log progress to stderr")
+
+    batch = commands.add_parser('batch', help="run the merge jobs of a JSON or CSV manifest")
+    batch.add_argument('manifest', help="JSON list of jobs or CSV with output and inputs columns")
+    batch.add_argument('-j', '--workers', type=int, default=4, help="jobs running at the same time")
+    batch.add_argument('--per-device', type=int, default=1,
+                       help="jobs running at the same time on one disk (by st_dev)")
+    batch.add_argument('--json', action='store_true', help="print the report as JSON")
+    batch.add_argument('-v', '--verbose', action='store_true', help="log progress to stderr")
+
+    watch = commands.add_parser('watch', help="merge segment folders once they stop growing")
+    watch.add_argument('root', help="folder whose subfolders are segment sets")
+    watch.add_argument('--output-dir', help="where merged files go (default: the watched folder)")
+    watch.add_argument('--settle', type=float, default=30.0,
+                       help="seconds a set must stay unchanged before it is merged")
+    watch.add_argument('--interval', type=float, default=5.0, help="polling interval without inotify")
+    watch.add_argument('--state', help="state database (default: .smerge-watch.sqlite in the watched folder)")
+    watch.add_argument('--once', action='store_true', help="scan once and exit (for cron)")
+    watch.add_argument('--verify', action='store_true', help="re-read and verify each output after writing")
+    watch.add_argument('--json', action='store_true', help="print merged sets as JSON on exit")
+    watch.add_argument('-v', '--verbose', action='store_true', help="log progress to stderr")
+
+    serve = commands.add_parser('serve', help="run a local HTTP merge service with a job queue")
+    serve.add_argument('--host', default='127.0.0.1', help="address to listen on (default: localhost only)")
+    serve.add_argument('--port', type=int, default=8765, help="port to listen on")
+    serve.add_argument('-j', '--workers', type=int, default=2, help="jobs running at the same time")
+    serve.add_argument('--state', help="job queue database (default: serve.sqlite in the current folder)")
+    serve.add_argument('--json', action='store_true', help="print the final status as JSON")
+    serve.add_argument('-v', '--verbose', action='store_true', help="log requests and jobs to stderr")
+    return parser
+
+
+def parse_size(text):
+    """Размер в байтах: число с необязательным суффиксом K, M, G или T (степени 1024)"""
+    text = text.strip().upper().rstrip('B')
+    scale = 1
+    if text[-1:] in SIZE_SUFFIXES:
+        scale = 1024 ** (SIZE_SUFFIXES.index(text[-1]) + 1)
+        text = text[:-1]
+    try:
+        size = int(float(text) * scale)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {text!r}")
+    if size <= 0:
+        raise argparse.ArgumentTypeError("size must be positive")
+    return size
+
+
+def parse_duration(text):
+    """Продолжительность в секундах: число с необязательным суффиксом s, m или h"""
+    text = text.strip().lower()
+    scale = DURATION_UNITS.get(text[-1:], None)
+    try:
+        seconds = float(text[:-1]) * scale if scale else float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {text!r}")
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError("duration must be positive")
+    return seconds
+
+
+def resolve_inputs(arguments, recursive=False):
+    """Раскрывает каталоги и маски; порядок объединения задаёт MergeOptions.sort"""
+    from .archives import split_member
+    from .inputs import expand_inputs
+    from .streams import is_stream_path
+
+    paths = expand_inputs(arguments, recursive)
+    if not paths:
+        raise CommandError("No input files", EXIT_USAGE)
+    # Наличие элемента архива проверяется при открытии архива
+    missing = [path for path in paths
+               if not (os.path.isfile(path) or is_stream_path(path) or split_member(path))]
+    if missing:
+        raise CommandError(f"Input file not found: {missing[0]}", EXIT_USAGE, missing=missing)
+    return paths
+
+
+def open_stdout():
+    """Стандартный вывод для двоичных данных результата"""
+    if os.name == 'nt':
+        # В текстовом режиме Windows заменила бы \n на \r\n прямо в аудиоданных
+        import msvcrt
+        msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+    return sys.stdout.buffer
+
+
+def run_merge(args):
+    """Объединение через engine.merge; возвращает словарь результата для вывода"""
+    from .api import DuplicateInputsError, MergeOptions, merge
+    from .inputs import resolve_output
+    from .verify import VerificationError
+
+    paths = resolve_inputs(args.inputs, args.recursive)
+    if args.output == STDOUT_OUTPUT:
+        if args.verify:
+            raise CommandError("--verify needs an output file, not standard output", EXIT_USAGE)
+        if sys.stdout.isatty():
+            raise CommandError("Refusing to write audio data to a terminal", EXIT_USAGE)
+        output = open_stdout()
+    else:
+        output = resolve_output(args.output, paths)
+    # Рекурсивный обход уже упорядочен по каталогам; сортировка по одним именам их перемешала бы
+    options = MergeOptions(sort=not (args.keep_order or args.recursive), allow_duplicates=args.allow_duplicates,
+                           overwrite=args.force, use_reflink=not args.no_reflink,
+                           sidecar=not args.no_sidecar, peaks=args.peaks, verify=args.verify,
+                           tree=args.tree, max_part_bytes=args.max_part_size,
+                           max_part_seconds=args.max_part_duration, mirrors=args.mirror,
+                           mirror_buffer=args.mirror_buffer, chapters=args.chapters)
+    if options.sharded and args.output == STDOUT_OUTPUT:
+        raise CommandError("Output parts need an output file name, not standard output", EXIT_USAGE)
+    if args.reuse:
+        if args.output == STDOUT_OUTPUT:
+            raise CommandError("--reuse needs an output file, not standard output", EXIT_USAGE)
+        from .outputcache import OutputCache
+        options.output_cache = OutputCache(limit=int(args.reuse_limit * 1024 ** 3))
+
+    current = [None]
+
+    def on_progress(progress):
+        # Прогресс приходит и по мере записи - в журнал попадает только начало каждого файла
+        if progress.index != current[0]:
+            current[0] = progress.index
+            logging.info(f"Processing file {progress.index}/{progress.count}: "
+                         f"{os.path.basename(progress.path)} ({progress.fraction:.0%})")
+
+    try:
+        result = merge(paths, output, options, progress=on_progress)
+    except DuplicateInputsError as e:
+        raise CommandError(str(e), EXIT_DUPLICATES, duplicates=e.groups)
+    except FileExistsError as e:
+        raise CommandError(str(e), EXIT_EXISTS)
+    except VerificationError as e:
+        raise CommandError(str(e), EXIT_VERIFY)
+    finally:
+        if options.output_cache is not None:
+            options.output_cache.close()
+    return {'ok': True, **result.to_dict()}
+
+
+def run_split(args):
+    """Разрезание файла на части; возвращает словарь с частями для вывода"""
+    from .archives import split_member
+    from .split import FAT32_LIMIT, split_audio
+
+    if not (os.path.isfile(args.input) or split_member(args.input)):
+        raise CommandError(f"Input file not found: {args.input}", EXIT_USAGE)
+    max_bytes = args.max_size
+    if args.fat32:
+        max_bytes = min(max_bytes or FAT32_LIMIT, FAT32_LIMIT)
+    if args.parts is not None and (max_bytes or args.max_duration):
+        raise CommandError("--parts cannot be combined with size or duration limits", EXIT_USAGE)
+    if not (args.parts or max_bytes or args.max_duration):
+        raise CommandError("Give --parts, --max-size, --fat32 or --max-duration", EXIT_USAGE)
+    try:
+        parts = split_audio(args.input, max_bytes=max_bytes, max_seconds=args.max_duration, parts=args.parts,
+                            output_dir=args.output_dir, overwrite=args.force, use_reflink=not args.no_reflink,
+                            sidecar=not args.no_sidecar)
+    except FileExistsError as e:
+        raise CommandError(str(e), EXIT_EXISTS)
+    return {'ok': True, 'input': os.path.abspath(args.input), 'parts': [part.to_dict() for part in parts]}
+
+
+def run_batch(args):
+    """Пакет заданий; неудачное задание не останавливает остальные"""
+    from .batch import load_manifest, run_batch
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except (ValueError, OSError) as e:
+        raise CommandError(f"Invalid manifest {args.manifest}: {str(e)}", EXIT_USAGE)
+    report = run_batch(jobs, workers=args.workers, per_device=args.per_device)
+    result = {'ok': not report.failed, **report.to_dict()}
+    if report.failed:
+        result['error'] = f"{len(report.failed)} of {len(jobs)} jobs failed"
+    return result
+
+
+def run_watch(args):
+    """Наблюдение до Ctrl+C (или один проход с --once); итог - объединённые наборы"""
+    from .api import MergeOptions
+    from .watch import FolderWatcher
+
+    if not os.path.isdir(args.root):
+        raise CommandError(f"Not a folder: {args.root}", EXIT_USAGE)
+    options = MergeOptions(allow_duplicates=True, overwrite=True, verify=args.verify)
+    watcher = FolderWatcher(args.root, args.output_dir, settle=args.settle, interval=args.interval,
+                            state_path=args.state, options=options)
+    try:
+        watcher.run(once=args.once)
+    except KeyboardInterrupt:
+        logging.info("Watch stopped")
+    finally:
+        watcher.close()
+    merged = [{'folder': folder, 'output': output, 'ok': result is not None,
+               **({'bytes': result.bytes, 'sha256': result.sha256} if result else {'error': error})}
+              for folder, output, result, error in watcher.history]
+    failed = [item for item in merged if not item['ok']]
+    result = {'ok': not failed, 'merged': merged}
+    if failed:
+        result['error'] = f"{len(failed)} of {len(merged)} sets failed"
+    return result
+
+
+def run_serve(args):
+    """HTTP-служба до Ctrl+C; выполняющиеся задания вернутся в очередь при следующем запуске"""
+    from .serve import make_server
+
+    try:
+        server = make_server(args.host, args.port, args.state, args.workers)
+    except OSError as e:
+        raise CommandError(f"Could not listen on {args.host}:{args.port}: {str(e)}")
+    host, port = server.server_address[:2]
+    print(f"smerge service listening on http://{host}:{port}/jobs", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Service stopped")
+    finally:
+        server.server_close()
+        server.service.stop()
+    return {'ok': True, 'url': f"http://{host}:{port}/jobs"}
+
+
+RUNNERS = {
+    'merge': run_merge,
+    'split': run_split,
+    'batch': run_batch,
+    'watch': run_watch,
+    'serve': run_serve,
+}
+
+
+def print_merge(result):
+    if result['parts'] is not None:
+        for part in result['parts']:
+            print(f"{part['path']} ({part['bytes']} bytes, {part['duration']:.3f} s)")
+        print(f"Merged {len(result['inputs'])} files into {len(result['parts'])} parts listed in "
+              f"{result['manifest']} ({result['bytes']} bytes, {result['duration']:.3f} s)")
+        return
+    cached = f", from cache by {result['cached']}" if result['cached'] else ""
+    print(f"Merged {len(result['inputs'])} files into {result['output']} "
+          f"({result['bytes']} bytes, {result['duration'] or 0:.3f} s{cached})")
+    for mirror in result['mirrors']:
+        print(f"Mirrored to {mirror}")
+    if result['chapters']:
+        where = f" in {result['cue']}" if result['cue'] else ""
+        print(f"Wrote {len(result['chapters'])} chapters{where}")
+
+
+def print_split(result):
+    for part in result['parts']:
+        print(f"{part['path']} ({part['bytes']} bytes, {part['duration']:.3f} s)")
+    print(f"Split {result['input']} into {len(result['parts'])} parts")
+
+
+def print_batch(result):
+    for job in result['results']:
+        status = f"{job['bytes']} bytes" if job['ok'] else f"failed: {job['error']}"
+        print(f"{job['name']}: {job['output']} ({status}, {job['seconds']:.2f} s)")
+    print(f"{result['succeeded']}/{result['jobs']} jobs, {result['bytes']} bytes in "
+          f"{result['seconds']:.2f} s ({result['throughput'] / 1e6:.1f} MB/s)")
+
+
+def print_watch(result):
+    for item in result['merged']:
+        status = f"{item['bytes']} bytes" if item['ok'] else f"failed: {item['error']}"
+        print(f"{item['folder']} -> {item['output']} ({status})")
+
+
+PRINTERS = {
+    'merge': print_merge,
+    'split': print_split,
+    'batch': print_batch,
+    'watch': print_watch,
+    'serve': lambda result: None,
+}
+
+
+def print_result(result, command, as_json, stream=None):
+    stream = stream or sys.stdout
+    if as_json:
+        json.dump(result, stream, ensure_ascii=False)
+        stream.write('\n')
+        return
+    # Отчёты пакета и наблюдения печатаются и тогда, когда часть заданий не удалась
+    if result['ok'] or 'results' in result or 'merged' in result:
+        with contextlib.redirect_stdout(stream):
+            PRINTERS[command](result)
+    if not result['ok']:
+        print(f"smerge: {result['error']}", file=sys.stderr)
+        for group in result.get('duplicates', []):
+            print("  duplicates: " + ', '.join(os.path.basename(path) for path in group), file=sys.stderr)
+
+
+def main(argv=None):
+    """Точка входа командной строки; возвращает код завершения"""
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stderr
+    )
+    try:
+        result = RUNNERS[args.command](args)
+        exit_code = EXIT_OK if result['ok'] else EXIT_FAILED
+    except CommandError as e:
+        result = {'ok': False, 'error': str(e), **e.details}
+        exit_code = e.exit_code
+    except (ValueError, OSError) as e:
+        result = {'ok': False, 'error': str(e)}
+        exit_code = EXIT_FAILED
+    result['exit_code'] = exit_code
+    # Когда в стандартный вывод идёт сам результат, отчёт уходит в stderr
+    streamed = getattr(args, 'output', None) == STDOUT_OUTPUT
+    print_result(result, args.command, args.json, sys.stderr if streamed else sys.stdout)
+    return exit_code
@@ -0,0 +1,409 @@
+"""Движки объединения, которые склеивают полезные данные входов подряд"""
+import logging
+import os
+import struct
+
+from .adts import merge_aac
+from .flac import merge_flac
+from .formats import detect_format, locate_payload, trailing_tags_length
+from .mapped import MappedSession
+from .ogg import merge_ogg
+from .probe import probe_duration
+from .streams import MP3_TRAILER_WINDOW, STREAM_FORMATS, is_stream_path
+from .taps import HashTap, Mp3DurationTap, PcmDurationTap, PeakTap, SizeDurationTap, write_sha256_sidecar
+from .tree import build_levels, needs_tree
+from .writer import OutputWriter, is_stream
+
+# Предел размеров в заголовке RIFF
+RIFF_LIMIT = 0xFFFFFFFF
+
+
+def merge_raw(paths, writer, session, on_file=None, peaks=False, cache=None, chapters=None):
+    """Простой режим: файлы склеиваются целиком без изменений"""
+    writer.add_tap('duration', SizeDurationTap())
+    for i, path in enumerate(paths, 1):
+        if on_file:
+            on_file(i, path)
+        mapped = session.open(path)
+        if mapped.size is None:
+            writer.copy_stream(mapped, 0)
+        else:
+            writer.copy_from(mapped, 0, mapped.size)
+
+
+def riff_length(info, data_length):
+    """Размер RIFF для WAV с чанком fmt из info и data_length байт данных"""
+    return 4 + 8 + len(info.fmt) + (len(info.fmt) & 1) + 8 + data_length + (data_length & 1)
+
+
+def wav_header(info, data_length, trailer_length=0):
+    """Заголовок WAV: RIFF, чанк fmt из info (engine.formats.WavInfo) и заголовок чанка data
+
+    trailer_length - длина чанков, которые пишутся после данных.
+    """
+    riff = riff_length(info, data_length) + trailer_length
+    header = bytearray(b'RIFF' + struct.pack('<I', riff) + b'WAVE')
+    header += b'fmt ' + struct.pack('<I', len(info.fmt)) + info.fmt
+    if len(info.fmt) & 1:
+        header += b'\x00'
+    header += b'data' + struct.pack('<I', data_length)
+    return header
+
+
+def check_wav(paths, infos):
+    """Все входы WAV должны быть в формате первого (infos - их engine.formats.WavInfo)"""
+    for path, info in zip(paths[1:], infos[1:]):
+        if info.params() != infos[0].params():
+            raise ValueError(f"WAV format of {os.path.basename(path)} differs from "
+                             f"{os.path.basename(paths[0])} ({info.sample_rate} Hz, "
+                             f"{info.channels} ch, {info.bits_per_sample} bit)")
+
+
+def check_inputs(fmt, paths, session):
+    """Разбирает заголовки входов до создания результата, чтобы ошибка входа не начинала его
+
+    Движки FLAC, Ogg и ADTS сами разбирают все входы до записи первого байта,
+    у MP3 разбирать нечего; здесь проверяются WAV. Потоки проверяются по мере
+    чтения.
+    """
+    if fmt != 'wav':
+        return
+    files = []
+    infos = []
+    for path in paths:
+        mapped = session.open(path)
+        if not getattr(mapped, 'streaming', False):
+            files.append(path)
+            infos.append(locate_payload(mapped, fmt).info)
+    check_wav(files, infos)
+
+
+def merge_wav(paths, writer, session, on_file=None, peaks=False, cache=None, chapters=None):
+    """WAV: один заголовок RIFF на весь результат и подряд идущие PCM данные
+
+    Главы chapters пишутся после данных чанками cue и LIST adtl.
+    """
+    inputs = []
+    for path in paths:
+        mapped = session.open(path, pin=True)
+        payload = locate_payload(mapped, 'wav')
+        if payload is None:
+            # Поток без длины данных: заголовок результата нельзя записать, не дочитав его
+            logging.info(f"{mapped.name} does not declare its data length, spooling it")
+            mapped = session.spool(path, 'wav')
+            payload = locate_payload(mapped, 'wav')
+        inputs.append((path, mapped, payload))
+
+    first = inputs[0][2].info
+    check_wav(paths, [payload.info for _, _, payload in inputs])
+
+    data_length = sum(payload.length for _, _, payload in inputs)
+    trailer = b''
+    if chapters:
+        from .chapters import wav_chapter_chunks
+        trailer = wav_chapter_chunks(chapters, first.sample_rate)
+    if riff_length(first, data_length) + len(trailer) > RIFF_LIMIT:
+        raise ValueError("Merged WAV data exceeds the 4 GiB RIFF size limit")
+    header = wav_header(first, data_length, len(trailer))
+
+    writer.add_tap('duration', PcmDurationTap(first.block_align, first.sample_rate,
+                                              skip=len(header), limit=data_length))
+    builder = None
+    if peaks:
+        from .peaks import PeakBuilder, peaks_supported
+        if peaks_supported(first):
+            builder = PeakBuilder(first, cache)
+            writer.add_tap('peaks', PeakTap(builder, skip=len(header), limit=data_length))
+        else:
+            logging.info(f"Peaks are not supported for WAV format {first.format_tag:#06x} "
+                         f"({first.bits_per_sample}-bit)")
+    writer.write(header)
+
+    for i, (path, mapped, payload) in enumerate(inputs, 1):
+        if on_file:
+            on_file(i, path)
+        if builder is not None:
+            builder.begin_input(mapped, payload)
+        writer.copy_from(mapped, payload.offset, payload.length)
+        if builder is not None:
+            builder.end_input()
+    if data_length & 1:
+        writer.write(b'\x00')
+    if trailer:
+        writer.write(trailer)
+
+
+def mp3_toc(segments, total_bytes, start):
+    """Таблица перемотки Xing склеенного потока: доля байт для каждого процента времени
+
+    segments - (фреймов, байт, таблица входа или None) по входам; внутри входа
+    положение берётся из его собственной таблицы, без неё - пропорционально.
+    start - длина служебного фрейма перед данными.
+    """
+    frame_starts, byte_starts = [], []
+    total_frames, position = 0, start
+    for frames, length, _ in segments:
+        frame_starts.append(total_frames)
+        byte_starts.append(position)
+        total_frames += frames
+        position += length
+
+    toc = bytearray(100)
+    k = 0
+    for i in range(100):
+        frame = i * total_frames / 100
+        while k + 1 < len(segments) and frame_starts[k + 1] <= frame:
+            k += 1
+        frames, length, own = segments[k]
+        fraction = (frame - frame_starts[k]) / frames if frames else 0.0
+        if own is not None:
+            percent = min(int(fraction * 100), 99)
+            high = own[percent + 1] if percent < 99 else 256
+            fraction = (own[percent] + (high - own[percent]) * (fraction * 100 - percent)) / 256
+        toc[i] = min(255, int((byte_starts[k] + fraction * length) * 256 / total_bytes))
+    return bytes(toc)
+
+
+def mp3_info_frame(paths, session, cache=None):
+    """Служебный фрейм Xing/Info для результата или None, если он не нужен или невозможен
+
+    Он нужен, если хоть у одного входа был свой (VBR, служебный фрейм LAME)
+    или у входов разный битрейт: без него декодеры оценивают длину результата
+    по первому фрейму. Число фреймов входа берётся из его заголовка, а если его
+    там нет - из индекса фреймов (engine.split.index_mp3, кэшируется). Для
+    потоков длина заранее неизвестна, и фрейм не пишется.
+    """
+    from .formats import Mp3InfoFrame, build_mp3_info_frame
+
+    inputs = []
+    for path in paths:
+        mapped = session.open(path)
+        if getattr(mapped, 'streaming', False):
+            logging.info(f"{mapped.name} is a stream, the merged MP3 gets no Xing header")
+            return None
+        payload = locate_payload(mapped, 'mp3')
+        if payload.info is None:
+            return None
+        view = mapped.data
+        header = struct.unpack_from('>I', view, payload.offset)[0]
+        info = None
+        if payload.info_offset is not None:
+            info = Mp3InfoFrame(view[payload.info_offset:payload.offset])
+        inputs.append((mapped, payload, header, info))
+
+    first_header = inputs[0][2]
+    if (first_header >> 17) & 3 != 1:
+        # Xing описывает только Layer III
+        return None
+    bitrates = {header >> 12 & 0xF for _, _, header, _ in inputs}
+    if len(bitrates) == 1 and all(info is None for _, _, _, info in inputs):
+        return None
+
+    segments = []
+    for mapped, payload, _, info in inputs:
+        frames = info.frames if info is not None else None
+        if frames is None:
+            from .split import index_mp3
+            index = index_mp3(mapped, payload.offset, payload.offset + payload.length, cache)
+            frames = len(index.offsets) - 1
+        segments.append((frames, payload.length, info.toc if info is not None else None))
+
+    template = inputs[0][3]
+    last = inputs[-1][3]
+    padding = last.padding() if last is not None else None
+    total_frames = sum(frames for frames, _, _ in segments)
+    data_length = sum(length for _, length, _ in segments)
+    length = len(build_mp3_info_frame(first_header, template, 0, 0, bytes(100)))
+    total_bytes = length + data_length
+    toc = mp3_toc(segments, total_bytes, length)
+    return build_mp3_info_frame(first_header, template, total_frames, total_bytes, toc, padding)
+
+
+def merge_mp3(paths, writer, session, on_file=None, peaks=False, cache=None, chapters=None):
+    """MP3: ID3v2 тег первого файла, общий фрейм Xing/Info и аудиофреймы всех входов
+
+    Теги и служебные фреймы входов не переносятся: фрейм Xing/Info (если он
+    нужен, см. mp3_info_frame) пересчитывается на весь результат. Главы chapters
+    добавляются в тег кадрами CHAP и CTOC (если у первого файла тега нет,
+    пишется новый).
+    """
+    writer.add_tap('duration', Mp3DurationTap())
+    info_frame = mp3_info_frame(paths, session, cache)
+    for i, path in enumerate(paths, 1):
+        if on_file:
+            on_file(i, path)
+        mapped = session.open(path)
+        payload = locate_payload(mapped, 'mp3')
+        if i == 1 and chapters:
+            from .chapters import id3_with_chapters
+            writer.write(id3_with_chapters(bytes(mapped.head(payload.tag_length)), chapters))
+        elif i == 1 and payload.tag_length:
+            writer.copy_from(mapped, 0, payload.tag_length)
+        if i == 1 and info_frame is not None:
+            writer.write(info_frame)
+        if payload.length is None:
+            # Поток: теги в конце отрезаются по придержанному хвосту
+            writer.copy_stream(mapped, payload.offset, MP3_TRAILER_WINDOW, trailing_tags_length)
+        else:
+            writer.copy_from(mapped, payload.offset, payload.length)
+
+
+ENGINES = {
+    'raw': merge_raw,
+    'wav': merge_wav,
+    'mp3': merge_mp3,
+    'flac': merge_flac,
+    'ogg': merge_ogg,
+    'aac': merge_aac,
+}
+
+
+def merge_audio(paths, output_path, session=None, on_file=None, use_reflink=True,
+                sidecar=True, peaks=False, cache=None, verify=False, verify_workers=None, taps=None,
+                tree=None, mirrors=None, mirror_buffer=None, chapters=False):
+    """Объединяет файлы в output_path движком, подходящим для их формата
+
+    Хеш, продолжительность и (для PCM при peaks=True) пики считаются отводами
+    во время записи; результаты доступны в writer.taps возвращаемого writer.
+    Пики пишутся рядом с результатом в файлы <результат>.<окно>.dat.
+    С verify=True результат после записи перечитывается параллельными
+    сегментами и сверяется с хешами входов; при расхождении - VerificationError.
+    Дополнительные отводы taps ({имя: отвод}) подключаются до записи первого байта.
+    output_path может быть потоком (stdout, канал, сокет): заголовки всех движков
+    известны до записи данных, поэтому результат пишется строго подряд; файлы
+    рядом с результатом (.sha256, пики) для потока не создаются.
+    tree - иерархическое объединение (engine.tree): True или число входов в
+    группе; по умолчанию оно включается, только когда движку пришлось бы
+    держать открытыми больше входов, чем позволяет сеанс.
+    Результат и копии пишутся во временные файлы рядом с ними и заменяют
+    прежние файлы только после успешной записи (и проверки); при любой ошибке,
+    включая отмену, временные файлы удаляются, а прежние остаются нетронутыми.
+    mirrors - пути (или папки) копий результата (engine.tee): они пишутся
+    своими потоками из тех же кусков, с очередью до mirror_buffer байт на
+    каждую; с verify проверяются и они.
+    chapters=True отмечает начало каждого входа главой (engine.chapters):
+    лист <результат без расширения>.cue рядом с результатом и копиями, а в
+    WAV, MP3 и FLAC ещё и метки внутри файла; writer.chapters - список глав.
+    """
+    streaming = is_stream(output_path)
+    if streaming:
+        if verify:
+            raise ValueError("Verification needs an output file, not a stream")
+        sidecar = False
+        if peaks:
+            logging.info("Waveform peaks are not written for streamed output")
+            peaks = False
+    else:
+        output_abs = os.path.abspath(output_path)
+        if any(os.path.abspath(path) == output_abs for path in paths):
+            raise ValueError("The output file cannot be one of the input files")
+    if mirrors:
+        from .tee import mirror_paths
+        mirrors = mirror_paths(output_path, mirrors, streaming)
+    mirrors = mirrors or []
+    if any(os.path.abspath(path) == os.path.abspath(mirror) for mirror in mirrors for path in paths):
+        raise ValueError("An output mirror cannot be one of the input files")
+
+    own_session = session is None
+    if own_session:
+        session = MappedSession()
+    own_cache = (peaks or verify) and cache is None
+    if own_cache:
+        from .probecache import ProbeCache
+        cache = ProbeCache()
+    try:
+        # Поток без расширения (stdin) распознаётся по первым байтам
+        formats = {detect_format(path, session.open(path)) for path in paths}
+        fmt = formats.pop() if len(formats) == 1 else 'raw'
+        if fmt == 'raw' and formats:
+            logging.warning("Input files have different formats, concatenating them as-is")
+        if verify or chapters or fmt not in STREAM_FORMATS:
+            # Индексам FLAC, Ogg и ADTS, проверке и главам нужен произвольный доступ: потоки сохраняются
+            for path in paths:
+                session.spool(path, fmt)
+        chapter_list = None
+        if chapters:
+            # Продолжительности входов известны по заголовкам, как у плана; главы считаются до
+            # иерархического объединения, которое заменяет входы промежуточными файлами
+            from .chapters import plan_chapters
+            chapter_list = plan_chapters(paths, [probe_duration(session.open(path), cache) for path in paths])
+        if tree is None:
+            tree = needs_tree(fmt, paths, session)
+        if tree and any(is_stream_path(path) for path in paths):
+            logging.warning("Stream inputs cannot be merged hierarchically, merging directly")
+        elif tree:
+            directory = None if streaming else os.path.dirname(output_abs)
+            paths, spans = build_levels(paths, session, directory, None if tree is True else tree,
+                                        on_file=on_file, use_reflink=use_reflink, cache=cache,
+                                        verify=verify, verify_workers=verify_workers)
+            if on_file:
+                # Последняя склейка сообщает о первом входе каждого промежуточного файла
+                leaf_on_file = on_file
+                on_file = lambda i, path: leaf_on_file(*spans[i - 1])
+
+        check_inputs(fmt, paths, session)
+        copies = []
+        # Результат и копии пишутся во временные файлы и встают на место только после проверки
+        with OutputWriter(output_path, use_reflink=use_reflink, record_digests=verify, deferred=True) as writer:
+            writer.add_tap('sha256', HashTap())
+            for name, tap in (taps or {}).items():
+                writer.add_tap(name, tap)
+            try:
+                if mirrors:
+                    from .tee import DEFAULT_MIRROR_BUFFER, MirrorTap
+                for mirror in mirrors:
+                    copies.append(writer.add_tap(f"mirror:{mirror}",
+                                                 MirrorTap(mirror, mirror_buffer or DEFAULT_MIRROR_BUFFER)))
+                ENGINES[fmt](paths, writer, session, on_file, peaks=peaks, cache=cache, chapters=chapter_list)
+            except BaseException:
+                for copy in copies:
+                    copy.abort()
+                raise
+        try:
+            failed = [copy for copy in copies if copy.error is not None]
+            if failed:
+                raise OSError(f"Could not write mirror {failed[0].path}: {str(failed[0].error)}")
+            writer.chapters = chapter_list
+            writer.verification = None
+            if verify:
+                from .verify import VerificationError, remember_digests, verify_output
+                for target in [writer] + copies:
+                    report = verify_output(target.written_path, writer.layout, cache, workers=verify_workers)
+                    if not report.ok:
+                        raise VerificationError(report)
+                    if target is writer:
+                        writer.verification = report
+                # Хеши входов пригодятся следующим проверкам тех же файлов
+                remember_digests(writer.layout, cache, writer.segment_size)
+            writer.commit()
+            for copy in copies:
+                copy.commit()
+        except BaseException:
+            writer.discard()
+            for copy in copies:
+                copy.abort()
+            raise
+    finally:
+        if own_session:
+            session.close()
+        if own_cache:
+            cache.close()
+
+    if sidecar:
+        for target in [output_path] + mirrors:
+            write_sha256_sidecar(target, writer.taps['sha256'].hexdigest)
+    if chapter_list and not streaming:
+        from .chapters import write_cue
+        for target in [output_path] + mirrors:
+            write_cue(target, fmt, chapter_list)
+    if 'peaks' in writer.taps:
+        from .peaks import write_peaks_files
+        builder = writer.taps['peaks'].builder
+        write_peaks_files(output_path, builder.mins, builder.maxs, builder.sample_rate)
+        logging.info(f"Wrote waveform peaks for {output_path} ({builder.cache_hits} inputs from cache)")
+
+    logging.info(f"Merged {len(paths)} files into {writer.path} ({fmt}): "
+                 f"{writer.cloned_bytes} bytes cloned, {writer.copied_bytes} bytes copied")
+    if mirrors:
+        logging.info(f"Mirrored {writer.path} to {', '.join(mirrors)}")
+    return writer
@@ -0,0 +1,485 @@
+"""FLAC: объединение на уровне фреймов с новым STREAMINFO и SEEKTABLE
+
+Из входов берутся только аудиофреймы; метаданные результата пишутся один раз
+с правильным числом сэмплов, размерами блоков/фреймов и таблицей перехода.
+Номера фреймов (или сэмплов) в заголовках продолжаются через границы входов,
+контрольные суммы фреймов пересчитываются без прохода по данным.
+"""
+import bisect
+import logging
+import os
+import struct
+from array import array
+
+from .formats import id3v2_length, trailing_tags_length
+from .taps import SampleCountTap
+
+FLAC_MARKER = b'fLaC'
+
+BLOCK_STREAMINFO = 0
+BLOCK_SEEKTABLE = 3
+BLOCK_VORBIS_COMMENT = 4
+BLOCK_CUESHEET = 5
+BLOCK_PICTURE = 6
+# Блоки первого входа, которые переносятся в результат (теги и обложка)
+KEPT_BLOCKS = (BLOCK_VORBIS_COMMENT, BLOCK_PICTURE)
+
+# Интервал точек SEEKTABLE в секундах
+SEEK_INTERVAL = 10
+SEEK_PLACEHOLDER = 0xFFFFFFFFFFFFFFFF
+
+# Объём данных, который копится в памяти перед записью переписанных фреймов
+WRITE_BATCH = 1024 * 1024
+
+CRC16_POLY = 0x8005
+
+
+def _crc8_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+def _crc16_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC16_POLY) & 0xFFFF if crc & 0x8000 else (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+
+CRC8_TABLE = _crc8_table()
+CRC16_TABLE = _crc16_table()
+
+
+def crc8(data):
+    """CRC-8 заголовка фрейма (полином x^8 + x^2 + x + 1)"""
+    crc = 0
+    for b in data:
+        crc = CRC8_TABLE[crc ^ b]
+    return crc
+
+
+def crc16(data, crc=0):
+    """CRC-16 фрейма (полином x^16 + x^15 + x^2 + 1), табличный"""
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[(crc >> 8) ^ b]
+    return crc
+
+
+def _gf2_mulmod(a, b):
+    """Произведение многочленов над GF(2) по модулю полинома CRC-16"""
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        b >>= 1
+        a <<= 1
+        if a & 0x10000:
+            a ^= 0x10000 | CRC16_POLY
+    return result
+
+
+def crc16_shift(state, length):
+    """Состояние CRC-16 после прохода length нулевых байт: state * x^(8*length) mod P
+
+    CRC без начального значения и финального XOR линеен, поэтому при замене
+    заголовка фрейма новая сумма = старая XOR crc16_shift(разница сумм заголовков, длина остатка).
+    """
+    bit = 0
+    while length:
+        if length & 1:
+            state = _gf2_mulmod(state, CRC16_SHIFT_POWERS[bit])
+        length >>= 1
+        bit += 1
+    return state
+
+
+def _shift_powers(count=48):
+    """x^(8 * 2^k) mod P для k = 0..count-1"""
+    powers = [1 << 8]
+    for _ in range(count - 1):
+        powers.append(_gf2_mulmod(powers[-1], powers[-1]))
+    return powers
+
+
+CRC16_SHIFT_POWERS = _shift_powers()
+
+
+def encode_number(value):
+    """Кодирует номер фрейма/сэмпла в UTF-8-подобную форму FLAC (до 36 бит)"""
+    if value < 0x80:
+        return bytes([value])
+    for size, bits in ((2, 11), (3, 16), (4, 21), (5, 26), (6, 31), (7, 36)):
+        if value < (1 << bits):
+            extra = size - 1
+            lead = (0xFF << (8 - size)) & 0xFF
+            tail = [0x80 | ((value >> (6 * i)) & 0x3F) for i in range(extra - 1, -1, -1)]
+            return bytes([lead | (value >> (6 * extra))] + tail)
+    raise ValueError("FLAC frame/sample number is out of range")
+
+
+class StreamInfo:
+    """Блок STREAMINFO"""
+
+    def __init__(self, data):
+        self.min_block, self.max_block = struct.unpack_from('>HH', data, 0)
+        self.min_frame = int.from_bytes(data[4:7], 'big')
+        self.max_frame = int.from_bytes(data[7:10], 'big')
+        packed = int.from_bytes(data[10:18], 'big')
+        self.sample_rate = packed >> 44
+        self.channels = ((packed >> 41) & 7) + 1
+        self.bits_per_sample = ((packed >> 36) & 0x1F) + 1
+        self.total_samples = packed & 0xFFFFFFFFF
+        self.md5 = bytes(data[18:34])
+
+    def params(self):
+        return self.sample_rate, self.channels, self.bits_per_sample
+
+    def to_bytes(self):
+        packed = ((self.sample_rate << 44) | ((self.channels - 1) << 41)
+                  | ((self.bits_per_sample - 1) << 36) | self.total_samples)
+        return (struct.pack('>HH', self.min_block, self.max_block)
+                + self.min_frame.to_bytes(3, 'big') + self.max_frame.to_bytes(3, 'big')
+                + packed.to_bytes(8, 'big') + self.md5)
+
+
+class FlacInput:
+    """Разобранный FLAC вход: STREAMINFO, прочие блоки метаданных и область фреймов"""
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+        view = mapped.data
+        start = id3v2_length(view)
+        if view[start:start + 4] != FLAC_MARKER:
+            raise ValueError(f"{os.path.basename(mapped.path)} is not a FLAC file")
+        pos = start + 4
+        self.streaminfo = None
+        self.blocks = []
+        while True:
+            if pos + 4 > len(view):
+                raise ValueError(f"Truncated FLAC metadata in {os.path.basename(mapped.path)}")
+            header = view[pos]
+            length = int.from_bytes(view[pos + 1:pos + 4], 'big')
+            block_type = header & 0x7F
+            body = view[pos + 4:pos + 4 + length]
+            if block_type == BLOCK_STREAMINFO:
+                self.streaminfo = StreamInfo(body)
+            else:
+                self.blocks.append((block_type, body))
+            pos += 4 + length
+            if header & 0x80:
+                break
+        if self.streaminfo is None:
+            raise ValueError(f"FLAC file {os.path.basename(mapped.path)} has no STREAMINFO")
+        self.frames_offset = pos
+        self.frames_end = len(view) - trailing_tags_length(view)
+
+
+def parse_frame_header(view, pos, end):
+    """Разбирает и проверяет (CRC-8) заголовок фрейма: (длина, размер блока, стратегия, номер) или None"""
+    if pos + 6 > end or view[pos] != 0xFF or (view[pos + 1] & 0xFE) != 0xF8:
+        return None
+    strategy = view[pos + 1] & 1
+    block_code = view[pos + 2] >> 4
+    rate_code = view[pos + 2] & 0x0F
+    channel_code = view[pos + 3] >> 4
+    if block_code == 0 or rate_code == 15 or channel_code > 10 or (view[pos + 3] & 1):
+        return None
+    p = pos + 4
+    first = view[p]
+    if first < 0x80:
+        number, extra = first, 0
+    elif first & 0xE0 == 0xC0:
+        number, extra = first & 0x1F, 1
+    elif first & 0xF0 == 0xE0:
+        number, extra = first & 0x0F, 2
+    elif first & 0xF8 == 0xF0:
+        number, extra = first & 0x07, 3
+    elif first & 0xFC == 0xF8:
+        number, extra = first & 0x03, 4
+    elif first & 0xFE == 0xFC:
+        number, extra = first & 0x01, 5
+    elif first == 0xFE:
+        number, extra = 0, 6
+    else:
+        return None
+    if p + 1 + extra >= end:
+        return None
+    for c in view[p + 1:p + 1 + extra]:
+        if c & 0xC0 != 0x80:
+            return None
+        number = (number << 6) | (c & 0x3F)
+    p += 1 + extra
+    if block_code == 1:
+        block_size = 192
+    elif block_code <= 5:
+        block_size = 576 << (block_code - 2)
+    elif block_code == 6:
+        block_size = view[p] + 1
+        p += 1
+    elif block_code == 7:
+        block_size = ((view[p] << 8) | view[p + 1]) + 1
+        p += 2
+    else:
+        block_size = 256 << (block_code - 8)
+    if rate_code == 12:
+        p += 1
+    elif rate_code in (13, 14):
+        p += 2
+    if p >= end or crc8(view[pos:p]) != view[p]:
+        return None
+    return p + 1 - pos, block_size, strategy, number
+
+
+class FrameIndex:
+    """Смещения фреймов входа, их размеры блоков и длины заголовков"""
+
+    def __init__(self, offsets, blocks, header_lengths, strategy, first_number):
+        self.offsets = offsets
+        self.blocks = blocks
+        self.header_lengths = header_lengths
+        self.strategy = strategy
+        self.first_number = first_number
+
+    def to_bytes(self):
+        return (struct.pack('<QBQ', len(self.offsets), self.strategy, self.first_number)
+                + self.offsets.tobytes() + self.blocks.tobytes() + self.header_lengths.tobytes())
+
+    @classmethod
+    def from_bytes(cls, blob):
+        count, strategy, first_number = struct.unpack_from('<QBQ', blob)
+        pos = struct.calcsize('<QBQ')
+        arrays = []
+        for code in ('Q', 'I', 'B'):
+            values = array(code)
+            size = values.itemsize * count
+            values.frombytes(blob[pos:pos + size])
+            arrays.append(values)
+            pos += size
+        return cls(arrays[0], arrays[1], arrays[2], strategy, first_number)
+
+
+def index_frames(flac, cache=None):
+    """Находит все фреймы входа; индекс кэшируется в кэше разбора"""
+    kind = f"flac-frames:{flac.frames_offset}:{flac.frames_end}"
+    if cache is not None:
+        cached = cache.get(flac.mapped, kind)
+        if cached is not None:
+            return FrameIndex.from_bytes(cached)
+
+    mapped = flac.mapped
+    view = mapped.data
+    end = flac.frames_end
+    header = parse_frame_header(view, flac.frames_offset, end)
+    if header is None:
+        raise ValueError(f"No FLAC audio frames found in {os.path.basename(mapped.path)}")
+    header_length, block_size, strategy, number = header
+    sync = bytes([0xFF, 0xF8 | strategy])
+    offsets, blocks, header_lengths = array('Q'), array('I'), array('B')
+    first_number = number
+    pos = flac.frames_offset
+    while True:
+        offsets.append(pos)
+        blocks.append(block_size)
+        header_lengths.append(header_length)
+        expected = number + (1 if strategy == 0 else block_size)
+        # Следующий фрейм - ближайшая синхропоследовательность с верным CRC-8 и продолжением нумерации
+        candidate = mapped.find(sync, pos + header_length, end)
+        while candidate != -1:
+            header = parse_frame_header(view, candidate, end)
+            if header is not None and header[3] == expected:
+                break
+            candidate = mapped.find(sync, candidate + 1, end)
+        if candidate == -1:
+            break
+        pos = candidate
+        header_length, block_size, _, number = header
+
+    index = FrameIndex(offsets, blocks, header_lengths, strategy, first_number)
+    if cache is not None:
+        cache.put(flac.mapped, kind, index.to_bytes())
+    return index
+
+
+def build_seektable(frame_samples, frame_offsets, frame_blocks, total_samples, interval, points):
+    """Точки перехода каждые interval сэмплов; неиспользованные места - заполнители"""
+    table = bytearray()
+    used = 0
+    last_frame = -1
+    for target in range(0, total_samples, interval):
+        if used == points:
+            break
+        i = bisect.bisect_right(frame_samples, target) - 1
+        if i == last_frame:
+            continue
+        table += struct.pack('>QQH', frame_samples[i], frame_offsets[i], frame_blocks[i])
+        last_frame = i
+        used += 1
+    for _ in range(points - used):
+        table += struct.pack('>QQH', SEEK_PLACEHOLDER, 0, 0)
+    return bytes(table)
+
+
+def metadata_block(block_type, body, last=False):
+    return bytes([block_type | (0x80 if last else 0)]) + len(body).to_bytes(3, 'big') + bytes(body)
+
+
+def build_header(template, frame_samples, frame_offsets, frame_blocks, samples, min_frame, max_frame,
+                 chapters=None):
+    """Метаданные нового потока: STREAMINFO по его фреймам, SEEKTABLE и сохраняемые блоки template
+
+    С chapters (engine.chapters.Chapter) в комментарии добавляются CHAPTERnnn
+    и пишется блок CUESHEET.
+    """
+    info = StreamInfo(template.streaminfo.to_bytes())
+    info.total_samples = samples
+    info.min_frame, info.max_frame = min_frame, max_frame
+    # Минимальный размер блока не учитывает последний фрейм потока
+    info.min_block = min(frame_blocks[:-1]) if len(frame_blocks) > 1 else frame_blocks[0]
+    info.max_block = max(frame_blocks)
+    info.md5 = bytes(16)  # MD5 несжатых данных неизвестен без декодирования
+
+    interval = info.sample_rate * SEEK_INTERVAL
+    points = max(1, -(-samples // interval))
+    blocks = [(BLOCK_SEEKTABLE, build_seektable(frame_samples, frame_offsets, frame_blocks,
+                                                 samples, interval, points))]
+    kept = [(block_type, body) for block_type, body in template.blocks if block_type in KEPT_BLOCKS]
+    if chapters:
+        from .chapters import flac_chapter_blocks
+        kept = flac_chapter_blocks(kept, chapters, info.sample_rate)
+    blocks += kept
+
+    header = bytearray(FLAC_MARKER)
+    header += metadata_block(BLOCK_STREAMINFO, info.to_bytes())
+    for i, (block_type, body) in enumerate(blocks):
+        header += metadata_block(block_type, body, last=i == len(blocks) - 1)
+    return header
+
+
+def frame_strategy(indexes):
+    """Стратегия нумерации общего потока фреймов: 0 - фиксированный размер блока, 1 - переменный"""
+    # Фиксированный размер блока сохраняется, только если все фреймы, кроме самого последнего, одинаковы
+    block = indexes[0].blocks[0]
+    fixed = all(index.strategy == 0 for index in indexes) and all(
+        all(b == block for b in (index.blocks if i < len(indexes) - 1 else index.blocks[:-1]))
+        for i, index in enumerate(indexes)
+    )
+    return 0 if fixed else 1
+
+
+def merge_flac(paths, writer, session, on_file=None, peaks=False, cache=None, chapters=None):
+    """FLAC: один блок метаданных и непрерывный поток аудиофреймов всех входов"""
+    inputs = [FlacInput(session.open(path, pin=True)) for path in paths]
+    first = inputs[0].streaminfo
+    for path, flac in zip(paths[1:], inputs[1:]):
+        if flac.streaminfo.params() != first.params():
+            info = flac.streaminfo
+            raise ValueError(f"FLAC format of {os.path.basename(path)} differs from "
+                             f"{os.path.basename(paths[0])} ({info.sample_rate} Hz, "
+                             f"{info.channels} ch, {info.bits_per_sample} bit)")
+    indexes = [index_frames(flac, cache) for flac in inputs]
+    strategy = frame_strategy(indexes)
+    fixed = strategy == 0
+    logging.info(f"FLAC merge uses {'fixed' if fixed else 'variable'} block size frames")
+
+    # План: новые номера, длины заголовков и смещения фреймов в результате
+    frame_samples, frame_offsets, frame_blocks = array('Q'), array('Q'), array('I')
+    unchanged = []
+    out_offset = 0
+    samples = 0
+    frame_number = 0
+    min_frame, max_frame = None, 0
+    for flac, index in zip(inputs, indexes):
+        keep = index.strategy == strategy and index.first_number == (frame_number if fixed else samples)
+        unchanged.append(keep)
+        count = len(index.offsets)
+        for i in range(count):
+            start = index.offsets[i]
+            stop = index.offsets[i + 1] if i + 1 < count else flac.frames_end
+            number = frame_number if fixed else samples
+            size = stop - start
+            if not keep:
+                old_number_length = number_length(flac.mapped.data[start + 4])
+                size += len(encode_number(number)) - old_number_length
+            frame_samples.append(samples)
+            frame_offsets.append(out_offset)
+            frame_blocks.append(index.blocks[i])
+            min_frame = size if min_frame is None else min(min_frame, size)
+            max_frame = max(max_frame, size)
+            out_offset += size
+            samples += index.blocks[i]
+            frame_number += 1
+
+    header = build_header(inputs[0], frame_samples, frame_offsets, frame_blocks, samples, min_frame, max_frame,
+                          chapters)
+    duration = writer.add_tap('duration', SampleCountTap(first.sample_rate))
+    writer.write(header)
+
+    frame_number = 0
+    samples = 0
+    for i, (path, flac, index, keep) in enumerate(zip(paths, inputs, indexes, unchanged), 1):
+        if on_file:
+            on_file(i, path)
+        if keep:
+            # Нумерация уже правильная - фреймы переносятся одним диапазоном без копирования в память
+            writer.copy_from(flac.mapped, flac.frames_offset, flac.frames_end - flac.frames_offset)
+            duration.add(sum(index.blocks), len(index.blocks))
+            frame_number += len(index.blocks)
+            samples += sum(index.blocks)
+            continue
+        frame_number, samples = write_renumbered(writer, flac, index, strategy, frame_number, samples, duration)
+
+
+def number_length(first):
+    """Длина закодированного номера по его первому байту"""
+    if first < 0x80:
+        return 1
+    length = 0
+    while first & 0x80:
+        length += 1
+        first <<= 1
+    return length
+
+
+def write_renumbered(writer, flac, index, strategy, frame_number, samples, duration):
+    """Переписывает заголовки фреймов входа с продолжением нумерации и пересчётом CRC"""
+    view = flac.mapped.data
+    count = len(index.offsets)
+    batch = bytearray()
+    for i in range(count):
+        start = index.offsets[i]
+        stop = index.offsets[i + 1] if i + 1 < count else flac.frames_end
+        header_length = index.header_lengths[i]
+        old_header = view[start:start + header_length]
+        old_length = number_length(view[start + 4])
+
+        new_header = bytearray(old_header[:4])
+        new_header[1] = 0xF8 | strategy
+        new_header += encode_number(frame_number if strategy == 0 else samples)
+        new_header += old_header[4 + old_length:header_length - 1]
+        new_header.append(crc8(new_header))
+
+        body = view[start + header_length:stop - 2]
+        old_crc = (view[stop - 2] << 8) | view[stop - 1]
+        new_crc = old_crc ^ crc16_shift(crc16(old_header) ^ crc16(new_header), len(body))
+
+        batch += new_header
+        batch += body
+        batch += struct.pack('>H', new_crc)
+        if len(batch) >= WRITE_BATCH:
+            writer.write(batch)
+            batch = bytearray()
+
+        duration.add(index.blocks[i])
+        frame_number += 1
+        samples += index.blocks[i]
+    if batch:
+        writer.write(batch)
+    return frame_number, samples
@@ -0,0 +1,342 @@
+"""Разбор заголовков и поиск полезных данных (payload) во входных файлах"""
+import os
+import struct
+
+# Расширения, для которых есть отдельные движки объединения
+FORMATS = {
+    '.wav': 'wav',
+    '.mp3': 'mp3',
+    '.flac': 'flac',
+    '.aac': 'aac',
+    '.ogg': 'ogg',
+    '.oga': 'ogg',
+    '.opus': 'ogg',
+}
+
+# Битрейты MPEG audio (кбит/с) по (версия MPEG-1?, слой)
+MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# Частоты дискретизации по битам версии: 0 - MPEG-2.5, 2 - MPEG-2, 3 - MPEG-1
+MP3_SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+
+# Коды формата WAV с несжатыми сэмплами; у EXTENSIBLE код лежит в начале GUID SubFormat
+WAVE_SAMPLE_FORMATS = {1: 'pcm', 3: 'float'}
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# Хвост GUID KSDATAFORMAT_SUBTYPE_*: 0000xxxx-0000-0010-8000-00aa00389b71
+WAVE_SUBFORMAT_SUFFIX = bytes.fromhex('000000001000800000aa00389b71')
+
+# Флаги полей заголовка Xing/Info
+XING_FRAMES, XING_BYTES, XING_TOC, XING_QUALITY = 1, 2, 4, 8
+
+# Длина расширения LAME за полями Xing/Info (последние два байта - его CRC)
+LAME_TAG_LENGTH = 36
+
+# Сколько байт в начале файла просматривать в поисках первого MP3 фрейма
+MP3_SYNC_WINDOW = 64 * 1024
+
+# Сколько первых байт потока нужно для распознавания формата по сигнатуре
+SNIFF_BYTES = 12
+
+
+def detect_format(path, mapped=None):
+    """Определяет формат по расширению; неизвестные форматы склеиваются как есть
+
+    Поток без расширения (stdin) и его временная копия распознаются по первым
+    байтам, если передан mapped.
+    """
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None and getattr(mapped, 'streaming', False):
+        return sniff_format(mapped.peek(SNIFF_BYTES))
+    if fmt is None and getattr(mapped, 'spooled', False):
+        return sniff_format(mapped.head(SNIFF_BYTES))
+    return fmt or 'raw'
+
+
+def sniff_format(head):
+    """Формат по сигнатуре в начале данных"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    if head[:3] == b'ID3':
+        return 'mp3'
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        # Синхрослово ADTS отличается от MPEG audio нулевыми битами слоя
+        return 'aac' if head[1] & 0xF6 == 0xF0 else 'mp3'
+    return 'raw'
+
+
+class Payload:
+    """Положение полезных данных во входном файле"""
+
+    def __init__(self, offset, length, info=None, tag_length=0, info_offset=None):
+        self.offset = offset
+        self.length = length
+        self.info = info
+        # Длина ведущего тега (ID3v2), который можно перенести в результат
+        self.tag_length = tag_length
+        # Положение пропущенного служебного фрейма MP3 (Xing/Info/VBRI), если он был
+        self.info_offset = info_offset
+
+
+class WavInfo:
+    """Параметры WAV файла из чанка fmt"""
+
+    def __init__(self, fmt, data_offset, data_length):
+        self.fmt = fmt
+        (self.format_tag, self.channels, self.sample_rate,
+         self.byte_rate, self.block_align, self.bits_per_sample) = struct.unpack_from('<HHIIHH', fmt)
+        self.data_offset = data_offset
+        self.data_length = data_length
+
+    def params(self):
+        return (self.format_tag, self.channels, self.sample_rate, self.block_align, self.bits_per_sample)
+
+    def sample_format(self):
+        """'pcm' (целые), 'float' (IEEE) или None для сжатых и прочих кодировок
+
+        У WAVE_FORMAT_EXTENSIBLE кодировку задаёт GUID SubFormat в расширении fmt.
+        """
+        tag = self.format_tag
+        if tag == WAVE_FORMAT_EXTENSIBLE:
+            if len(self.fmt) < 40 or self.fmt[26:40] != WAVE_SUBFORMAT_SUFFIX:
+                return None
+            tag = struct.unpack_from('<H', self.fmt, 24)[0]
+        return WAVE_SAMPLE_FORMATS.get(tag)
+
+
+def parse_wav(view):
+    """Разбирает RIFF/WAVE заголовок и находит чанк data"""
+    if len(view) < 12 or view[0:4] != b'RIFF' or view[8:12] != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+    pos = 12
+    fmt = None
+    while pos + 8 <= len(view):
+        chunk_id = view[pos:pos + 4]
+        chunk_size = struct.unpack_from('<I', view, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b'fmt ':
+            if chunk_size < 16:
+                raise ValueError("WAV fmt chunk is too short")
+            fmt = bytes(view[body:body + chunk_size])
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("WAV data chunk comes before fmt chunk")
+            # Размер может быть завышен (незавершённая запись) - ограничиваем концом файла
+            return WavInfo(fmt, body, min(chunk_size, len(view) - body))
+        pos = body + chunk_size + (chunk_size & 1)
+    raise ValueError("WAV file has no data chunk")
+
+
+def id3v2_tag_length(header):
+    """Полная длина одного ID3v2 тега по его 10-байтному заголовку или 0, если тега нет"""
+    if len(header) < 10 or header[0:3] != b'ID3':
+        return 0
+    size = 0
+    for b in header[6:10]:
+        size = (size << 7) | (b & 0x7F)
+    return 10 + size + (10 if header[5] & 0x10 else 0)
+
+
+def id3v2_length(view, offset=0):
+    """Длина ID3v2 тегов в начале данных (их может быть несколько подряд)"""
+    pos = offset
+    while True:
+        length = id3v2_tag_length(view[pos:pos + 10])
+        if not length:
+            break
+        pos += length
+    return min(pos, len(view)) - offset
+
+
+def trailing_tags_length(view):
+    """Длина тегов в конце файла: ID3v1 и APEv2"""
+    end = len(view)
+    if end >= 128 and view[end - 128:end - 125] == b'TAG':
+        end -= 128
+    if end >= 32 and view[end - 32:end - 24] == b'APETAGEX':
+        size, _, flags = struct.unpack_from('<III', view, end - 20)
+        end -= size + (32 if flags & 0x80000000 else 0)
+    return len(view) - max(end, 0)
+
+
+def parse_mp3_header(header):
+    """Разбирает 32-битный заголовок MP3 фрейма: (длина фрейма, сэмплов во фрейме, частота) или None"""
+    if (header >> 21) & 0x7FF != 0x7FF:
+        return None
+    version = (header >> 19) & 3
+    layer = 4 - ((header >> 17) & 3)
+    bitrate_index = (header >> 12) & 0xF
+    rate_index = (header >> 10) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    padding = (header >> 9) & 1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    samples = 1152 if (layer == 2 or mpeg1) else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate
+
+
+def find_mp3_frame(view, start, end, limit=MP3_SYNC_WINDOW):
+    """Ищет первый MP3 фрейм, за которым следует ещё один корректный заголовок"""
+    stop = min(end - 4, start + limit)
+    for i in range(start, stop):
+        if view[i] != 0xFF or (view[i + 1] & 0xE0) != 0xE0:
+            continue
+        frame = parse_mp3_header(struct.unpack_from('>I', view, i)[0])
+        if frame is None:
+            continue
+        following = i + frame[0]
+        if following + 4 > end or parse_mp3_header(struct.unpack_from('>I', view, following)[0]):
+            return i, frame
+    return None, None
+
+
+def xing_offset(header):
+    """Смещение заголовка Xing/Info от начала фрейма: он идёт сразу за side info"""
+    mpeg1 = (header >> 19) & 3 == 3
+    mono = (header >> 6) & 3 == 3
+    return 4 + ((17 if mono else 32) if mpeg1 else (9 if mono else 17))
+
+
+def is_mp3_info_frame(view, offset, frame_length):
+    """Проверяет, что фрейм служебный (Xing/Info/VBRI) и описывает только свой файл"""
+    xing = xing_offset(struct.unpack_from('>I', view, offset)[0])
+    frame = view[offset:offset + frame_length]
+    return frame[xing:xing + 4] in (b'Xing', b'Info') or frame[36:40] == b'VBRI'
+
+
+class Mp3InfoFrame:
+    """Служебный фрейм Xing/Info/VBRI: число аудиофреймов, байт и таблица перемотки
+
+    Отсутствующие в заголовке поля - None; lame - смещение расширения LAME во
+    фрейме, если его CRC сошлась.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.frames = self.bytes = self.toc = self.lame = None
+        xing = xing_offset(struct.unpack_from('>I', frame)[0])
+        if frame[36:40] == b'VBRI':
+            self.kind = b'VBRI'
+            self.bytes, self.frames = struct.unpack_from('>II', frame, 46)
+            return
+        self.kind = bytes(frame[xing:xing + 4])
+        self.flags = struct.unpack_from('>I', frame, xing + 4)[0] if len(frame) >= xing + 8 else 0
+        sizes = ((XING_FRAMES, 4), (XING_BYTES, 4), (XING_TOC, 100), (XING_QUALITY, 4))
+        if xing + 8 + sum(size for flag, size in sizes if self.flags & flag) > len(frame):
+            # Поля не помещаются во фрейм - заголовок испорчен
+            self.flags = 0
+        pos = xing + 8
+        if self.flags & XING_FRAMES:
+            self.frames = struct.unpack_from('>I', frame, pos)[0]
+            pos += 4
+        if self.flags & XING_BYTES:
+            self.bytes = struct.unpack_from('>I', frame, pos)[0]
+            pos += 4
+        if self.flags & XING_TOC:
+            self.toc = bytes(frame[pos:pos + 100])
+            pos += 100
+        if self.flags & XING_QUALITY:
+            pos += 4
+        self.fields = xing + 8
+        if pos + LAME_TAG_LENGTH <= len(frame) and lame_crc(frame[:pos + 34]) == \
+                struct.unpack_from('>H', frame, pos + 34)[0]:
+            self.lame = pos
+
+    def padding(self):
+        """Число сэмплов тишины, добавленных кодером в конец (из расширения LAME) или None"""
+        if self.lame is None:
+            return None
+        return struct.unpack_from('>I', b'\0' + bytes(self.frame[self.lame + 21:self.lame + 24]))[0] & 0xFFF
+
+
+def lame_crc(data):
+    """CRC-16 (ARC) расширения LAME: считается по фрейму до самого поля CRC"""
+    crc = 0
+    for b in bytes(data):
+        crc ^= b
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def build_mp3_info_frame(header, template, frames, size, toc, padding=None):
+    """Служебный фрейм Xing/Info для склеенного потока
+
+    Если у первого входа был фрейм Xing/Info со всеми полями, берётся он (с
+    расширением LAME), иначе собирается новый фрейм с параметрами header -
+    заголовка первого аудиофрейма. frames - число аудиофреймов (без этого),
+    size - длина потока вместе с этим фреймом, toc - 100 байт таблицы перемотки.
+    """
+    need = XING_FRAMES | XING_BYTES | XING_TOC
+    if template is not None and template.kind in (b'Xing', b'Info') and template.flags & need == need:
+        frame = bytearray(template.frame)
+        struct.pack_into('>II100s', frame, template.fields, frames, size, toc)
+        if template.lame is not None:
+            lame = template.lame
+            if padding is not None:
+                delay = struct.unpack_from('>I', b'\0' + bytes(frame[lame + 21:lame + 24]))[0] >> 12
+                frame[lame + 21:lame + 24] = struct.pack('>I', delay << 12 | min(padding, 0xFFF))[1:]
+            # Длина музыки - от этого фрейма до конца аудиоданных; CRC самих данных не пересчитать
+            struct.pack_into('>I', frame, lame + 28, size)
+            struct.pack_into('>H', frame, lame + 34, lame_crc(frame[:lame + 34]))
+        return bytes(frame)
+
+    # Новый фрейм: без CRC и выравнивания, с наименьшим битрейтом, в который помещаются поля
+    header = header & ~(0xF << 12) & ~(1 << 9) | (1 << 16)
+    xing = xing_offset(header)
+    for bitrate_index in range(1, 15):
+        candidate = header | bitrate_index << 12
+        length = parse_mp3_header(candidate)[0]
+        if length >= xing + 116:
+            break
+    frame = bytearray(length)
+    struct.pack_into('>I', frame, 0, candidate)
+    struct.pack_into('>4sIII100s', frame, xing, b'Xing', need, frames, size, toc)
+    return bytes(frame)
+
+
+def locate_payload(mapped, fmt):
+    """Находит полезные данные входа: без заголовков контейнера, тегов и служебных фреймов
+
+    Для потока (engine.streams.StreamInput) заголовки разбираются в его буфере;
+    длина полезных данных потока может быть неизвестна (None).
+    """
+    if getattr(mapped, 'streaming', False):
+        from .streams import stream_payload
+        return stream_payload(mapped, fmt)
+    view = mapped.data
+    if fmt == 'wav':
+        info = parse_wav(view)
+        return Payload(info.data_offset, info.data_length, info)
+    if fmt == 'mp3':
+        tag_length = id3v2_length(view)
+        end = len(view) - trailing_tags_length(view)
+        start, frame = find_mp3_frame(view, tag_length, end)
+        if start is None:
+            # Фреймы не нашлись - оставляем всё между тегами как есть
+            return Payload(tag_length, max(0, end - tag_length), tag_length=tag_length)
+        # Xing/Info заголовок описывает только свой файл - движок пишет общий заново
+        info_offset = None
+        if is_mp3_info_frame(view, start, frame[0]):
+            info_offset = start
+            start += frame[0]
+        return Payload(start, max(0, end - start), frame, tag_length=tag_length, info_offset=info_offset)
+    return Payload(0, mapped.size)
@@ -0,0 +1,168 @@
+"""Подготовка списка входов: раскрытие каталогов и масок, сортировка по имени, поиск дубликатов"""
+import fnmatch
+import glob
+import hashlib
+import logging
+import os
+import re
+
+from .formats import FORMATS
+
+# Сколько байт с начала и с конца файла сравнивается при поиске дубликатов
+SIMILARITY_BYTES = 8192
+
+# Числа в имени; компилируется один раз на модуль
+NUMBER_PATTERN = re.compile(r'\d+')
+
+# Метка числа в ключе: меньше любого печатного символа, как число в списке [текст, число, ...]
+NUMBER_MARK = '\x01'
+
+
+def _number_key(match):
+    """Число без ведущих нулей с префиксом длины: строки сравниваются как числа"""
+    digits = match.group().lstrip('0') or '0'
+    return NUMBER_MARK + chr(len(digits)) + digits
+
+
+def name_key(name):
+    """Ключ естественной сортировки имени одной строкой (сравнение строк идёт в C)"""
+    return NUMBER_PATTERN.sub(_number_key, name)
+
+
+def natural_keys(path):
+    """Ключ естественной сортировки по имени файла: "2.mp3" раньше "10.mp3\""""
+    return name_key(os.path.basename(path))
+
+
+def sort_inputs(paths):
+    """Входы в порядке объединения - по возрастанию имён (ключи считаются один раз на файл)"""
+    return sorted(paths, key=natural_keys)
+
+
+def _sort_entries(entries):
+    """Сортировка записей scandir по имени: ключ из entry.name без разбора пути"""
+    decorated = [(name_key(entry.name), entry.path) for entry in entries]
+    decorated.sort()
+    return [path for _, path in decorated]
+
+
+def is_audio_file(path):
+    # Расширение без os.path.splitext: на больших каталогах это заметная доля времени
+    return path[path.rfind('.'):].lower() in FORMATS
+
+
+def scan_directory(path, recursive=False):
+    """Аудиофайлы каталога по scandir (тип берётся из записи каталога, без stat)
+
+    Файлы каталога идут в естественном порядке имён; при recursive=True за ними
+    следуют подкаталоги, тоже в естественном порядке.
+    """
+    files = []
+    folders = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file():
+                if is_audio_file(entry.name):
+                    files.append(entry)
+            elif recursive and entry.is_dir() and not entry.name.startswith('.'):
+                folders.append(entry)
+    paths = _sort_entries(files)
+    for folder in _sort_entries(folders):
+        paths.extend(scan_directory(folder, recursive))
+    return paths
+
+
+def match_files(pattern):
+    """Файлы по маске; маска только в имени файла разбирается одним проходом scandir"""
+    folder, name = os.path.split(pattern)
+    if glob.has_magic(folder) or '**' in name:
+        # Совпадения из разных каталогов: естественный порядок всего пути, каталог за каталогом
+        matches = [path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)]
+        return sorted(matches, key=name_key)
+
+    match = re.compile(fnmatch.translate(os.path.normcase(name))).match
+    try:
+        with os.scandir(folder or os.curdir) as it:
+            entries = [entry for entry in it
+                       if match(os.path.normcase(entry.name)) and entry.is_file()
+                       and (name.startswith('.') or not entry.name.startswith('.'))]
+    except FileNotFoundError:
+        return []
+    # Пути в том виде, в каком их задала маска (без "./" для текущего каталога)
+    decorated = [(name_key(entry.name), os.path.join(folder, entry.name)) for entry in entries]
+    decorated.sort()
+    return [path for _, path in decorated]
+
+
+def expand_inputs(arguments, recursive=False):
+    """Раскрывает аргументы в список файлов
+
+    Каталог даёт все аудиофайлы в нём (с recursive=True - и во вложенных каталогах),
+    маска (*, ?, [..], ** для вложенных каталогов) - все подходящие файлы,
+    архив ZIP или TAR - свои аудиофайлы (пути "архив::элемент", engine.archives),
+    остальное считается путём к файлу как есть.
+    """
+    from .archives import archive_members, is_archive
+
+    paths = []
+    for argument in arguments:
+        if os.path.isdir(argument):
+            paths.extend(scan_directory(argument, recursive))
+            continue
+        if glob.has_magic(argument):
+            matches = match_files(argument)
+            if not matches:
+                logging.warning(f"No files match {argument}")
+        else:
+            matches = [argument]
+        for path in matches:
+            if is_archive(path) and os.path.isfile(path):
+                paths.extend(archive_members(path))
+            else:
+                paths.append(path)
+    return paths
+
+
+def resolve_output(output, paths):
+    """Без расширения результат получает расширение первого входа, как в окне приложения"""
+    if not os.path.splitext(output)[1]:
+        output += os.path.splitext(paths[0])[1]
+    return output
+
+
+def find_duplicates(paths, session, on_file=None):
+    """Группы вероятных дубликатов: одинаковый размер и одинаковые первые и последние байты"""
+    by_size = {}
+    for i, path in enumerate(paths, 1):
+        if on_file:
+            on_file(i, path)
+        try:
+            # Файл сразу отображается и переиспользуется при объединении
+            size = session.open(path).size
+            if size is None:
+                # Поток не с чем сравнить, не прочитав его целиком
+                logging.info(f"Skipping duplicate check for stream {path}")
+                continue
+            by_size.setdefault(size, []).append(path)
+        except Exception as e:
+            logging.warning(f"Could not analyze file {path}: {str(e)}")
+
+    duplicates = []
+    for files in by_size.values():
+        if len(files) > 1:
+            duplicates.extend(content_duplicates(files, session))
+    return duplicates
+
+
+def content_duplicates(paths, session):
+    """Группы файлов с одинаковым хешем первых и последних байтов (срезы без копирования)"""
+    by_hash = {}
+    for path in paths:
+        try:
+            mapped = session.open(path)
+            content_hash = hashlib.md5(mapped.head(SIMILARITY_BYTES))
+            content_hash.update(mapped.tail(SIMILARITY_BYTES))
+            by_hash.setdefault(content_hash.hexdigest(), []).append(path)
+        except Exception as e:
+            logging.warning(f"Could not read file content {path}: {str(e)}")
+    return [files for files in by_hash.values() if len(files) > 1]
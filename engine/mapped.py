@@ -0,0 +1,212 @@
+"""Входные файлы, отображённые в память: срезы без копирования для парсеров и хешей"""
+import logging
+import mmap
+import os
+import stat
+from collections import OrderedDict
+
+# Путь входа, означающий стандартный ввод
+STDIN_PATH = '-'
+
+# Разделитель пути архива и имени элемента в нём: "записи.zip::часть1.wav"
+ARCHIVE_SEPARATOR = '::'
+
+# Сколько входов держать открытыми, если предел дескрипторов процесса неизвестен (Windows)
+DEFAULT_MAX_OPEN = 2048
+
+# Меньше этого число открытых входов не опускается даже при тесном пределе дескрипторов
+MIN_OPEN = 16
+
+
+def default_max_open():
+    """Сколько входов сеанс держит открытыми: четверть предела дескрипторов процесса
+
+    У каждого отображения свой дескриптор в дополнение к файлу, а часть
+    дескрипторов нужна результату, кэшам и сокетам.
+    """
+    try:
+        import resource
+        soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ImportError, OSError, ValueError):
+        return DEFAULT_MAX_OPEN
+    if soft == resource.RLIM_INFINITY:
+        return DEFAULT_MAX_OPEN
+    return max(MIN_OPEN, soft // 4)
+
+
+class MappedInput:
+    """Входной файл, отображённый в память целиком; срезы отдаются как memoryview"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = path
+        self.file = open(path, 'rb', buffering=0)
+        st = os.fstat(self.file.fileno())
+        self.size = st.st_size
+        self.stamp = (st.st_size, st.st_mtime_ns)
+        if self.size:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = memoryview(self.map)
+        else:
+            # Пустой файл отобразить нельзя
+            self.map = None
+            self.data = memoryview(b'')
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def view(self, offset=0, length=None):
+        """Срез файла без копирования"""
+        if length is None:
+            return self.data[offset:]
+        return self.data[offset:offset + length]
+
+    def find(self, sub, start=0, end=None):
+        """Поиск байтовой последовательности средствами mmap (без копирования данных)"""
+        if self.map is None:
+            return -1
+        return self.map.find(sub, start, self.size if end is None else end)
+
+    def head(self, length):
+        return self.data[:length]
+
+    def tail(self, length):
+        return self.data[max(0, self.size - length):]
+
+    def seek(self, offset):
+        self.file.seek(offset)
+
+    def readinto(self, buffer):
+        return self.file.readinto(buffer)
+
+    def close(self):
+        self.data.release()
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # Где-то ещё жив срез - отображение закроется сборщиком мусора
+                logging.debug(f"Mapping of {self.path} is still referenced, leaving it to GC")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class MappedSession:
+    """Сеанс работы с входами: каждый файл открывается и отображается один раз
+
+    Открытыми остаются не больше max_open обычных файлов: давно не нужные
+    закрываются (LRU) и при следующем обращении открываются снова. Входы,
+    которые движок держит до конца объединения, закрепляются (pin=True) и не
+    вытесняются.
+    """
+
+    def __init__(self, max_open=None):
+        self.max_open = max_open or default_max_open()
+        self._inputs = {}
+        # Незакреплённые обычные файлы в порядке последнего обращения - кандидаты на закрытие
+        self._idle = OrderedDict()
+        self._pinned = set()
+        # Открытые архивы (engine.archives.Archive) по абсолютному пути
+        self.archives = {}
+
+    def open(self, path, pin=False):
+        """Возвращает отображение файла, переоткрывая его, только если файл изменился
+
+        Для stdin ('-'), канала или FIFO возвращается engine.streams.StreamInput:
+        такой вход читается один раз, поэтому повторно не открывается. Путь
+        "архив::элемент" даёт элемент архива (engine.archives). С pin=True
+        вход не закрывается до конца сеанса.
+        """
+        key = os.path.abspath(path)
+        mapped = self._inputs.get(key)
+        if mapped is not None:
+            # Потоки, их временные копии и элементы архивов открываются один раз за сеанс
+            if not isinstance(mapped, MappedInput) or getattr(mapped, 'spooled', False):
+                return mapped
+            st = os.stat(key)
+            if (st.st_size, st.st_mtime_ns) == mapped.stamp:
+                self._touch(key, pin)
+                return mapped
+            logging.debug(f"File changed since it was mapped, remapping: {path}")
+            self._idle.pop(key, None)
+            mapped.close()
+            mapped = None
+        if ARCHIVE_SEPARATOR in path:
+            from .archives import open_member
+            mapped = open_member(self, path)
+        if mapped is None:
+            if path == STDIN_PATH or not stat.S_ISREG(os.stat(path).st_mode):
+                from .streams import StreamInput
+                mapped = StreamInput(path)
+            else:
+                mapped = MappedInput(path)
+        self._inputs[key] = mapped
+        if isinstance(mapped, MappedInput):
+            self._touch(key, pin)
+        return mapped
+
+    def close_idle(self):
+        """Закрывает все незакреплённые файлы (дескрипторы нужны кому-то другому)"""
+        while self._idle:
+            key, _ = self._idle.popitem(last=False)
+            self._inputs.pop(key).close()
+
+    def _touch(self, key, pin):
+        """Обновляет место файла в очереди на закрытие и закрывает лишние"""
+        if pin:
+            self._pinned.add(key)
+            self._idle.pop(key, None)
+            return
+        if key in self._pinned:
+            return
+        self._idle[key] = True
+        self._idle.move_to_end(key)
+        while len(self._idle) > self.max_open:
+            oldest, _ = self._idle.popitem(last=False)
+            self._inputs.pop(oldest).close()
+
+    def spool(self, path, fmt='raw'):
+        """Заменяет поток временным файлом с произвольным доступом; файлы возвращаются как есть"""
+        mapped = self.open(path)
+        if getattr(mapped, 'streaming', False):
+            from .streams import spool
+            mapped = spool(mapped, fmt)
+            self._inputs[os.path.abspath(path)] = mapped
+        return mapped
+
+    def adopt(self, path, mapped):
+        """Добавляет в сеанс уже открытый вход (например, временный файл); закрывается с сеансом"""
+        key = os.path.abspath(path)
+        self.discard(key)
+        self._inputs[key] = mapped
+
+    def discard(self, path):
+        """Закрывает отображение файла (например, перед его перезаписью)"""
+        key = os.path.abspath(path)
+        self._idle.pop(key, None)
+        self._pinned.discard(key)
+        mapped = self._inputs.pop(key, None)
+        if mapped is not None:
+            mapped.close()
+
+    def close(self):
+        # В обратном порядке: элементы архивов закрываются раньше отображения архива
+        for mapped in reversed(list(self._inputs.values())):
+            mapped.close()
+        self._inputs.clear()
+        self._idle.clear()
+        self._pinned.clear()
+        for archive in self.archives.values():
+            archive.close()
+        self.archives.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,267 @@
+"""Ogg Vorbis/Opus: объединение на уровне страниц в один логический поток
+
+Страницы переносятся без декодирования пакетов: в заголовках переписываются
+серийный номер, номер страницы, позиция гранулы и флаги, после чего
+пересчитывается CRC. Заголовки кодека у последующих входов отбрасываются,
+если они совпадают с заголовками первого входа.
+"""
+import logging
+import os
+import struct
+import zlib
+
+from .taps import SampleCountTap
+
+OGG_CAPTURE = b'OggS'
+PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+
+FLAG_CONTINUED = 0x01
+FLAG_BOS = 0x02
+FLAG_EOS = 0x04
+
+# Позиция гранулы "нет завершённых пакетов на странице"
+NO_GRANULE = -1
+
+# Объём страниц, который копится в памяти перед записью
+WRITE_BATCH = 1024 * 1024
+
+# Таблица разворота битов в байте: CRC Ogg (MSB-first, без init/xorout) через zlib.crc32
+BIT_REVERSE = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def opus_packet_samples(packet):
+    """Число отсчётов (48 кГц) в пакете Opus по байту TOC (RFC 6716, 3.1)"""
+    if not packet:
+        return 0
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        frame = (480, 960, 1920, 2880)[config & 3]
+    elif config < 16:
+        frame = (480, 960)[config & 1]
+    else:
+        frame = (120, 240, 480, 960)[config & 3]
+    code = toc & 3
+    if code == 0:
+        count = 1
+    elif code < 3:
+        count = 2
+    else:
+        count = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frame * count
+
+
+def ogg_crc(data):
+    """CRC-32 страницы Ogg (полином 0x04C11DB7, MSB-first)
+
+    zlib считает отражённый CRC того же полинома, поэтому CRC Ogg получается
+    как развёрнутый по битам zlib-CRC от развёрнутых по битам байтов - на скорости C.
+    """
+    reflected = zlib.crc32(bytes(data).translate(BIT_REVERSE), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int.from_bytes(reflected.to_bytes(4, 'little').translate(BIT_REVERSE), 'big')
+
+
+class Page:
+    """Страница входа: положение, флаги, гранула и таблица сегментов"""
+
+    def __init__(self, offset, flags, granule, serial, segments, body_length):
+        self.offset = offset
+        self.flags = flags
+        self.granule = granule
+        self.serial = serial
+        self.segments = segments
+        self.body_offset = offset + PAGE_HEADER.size + len(segments)
+        self.body_length = body_length
+
+    @property
+    def end(self):
+        return self.body_offset + self.body_length
+
+
+def read_pages(mapped):
+    """Все страницы файла; мусор между страницами (теги и т. п.) пропускается"""
+    view = mapped.data
+    pages = []
+    pos = 0
+    while pos + PAGE_HEADER.size <= mapped.size:
+        if view[pos:pos + 4] != OGG_CAPTURE:
+            pos = mapped.find(OGG_CAPTURE, pos + 1)
+            if pos == -1:
+                break
+            continue
+        _, version, flags, granule, serial, _, _, count = PAGE_HEADER.unpack_from(view, pos)
+        segments = view[pos + PAGE_HEADER.size:pos + PAGE_HEADER.size + count]
+        body_length = sum(segments)
+        if version != 0 or len(segments) < count or pos + PAGE_HEADER.size + count + body_length > mapped.size:
+            # Не страница (или оборванная) - ищем следующую
+            pos = mapped.find(OGG_CAPTURE, pos + 1)
+            if pos == -1:
+                break
+            continue
+        page = Page(pos, flags, granule, serial, bytes(segments), body_length)
+        pages.append(page)
+        pos = page.end
+    return pages
+
+
+class OggInput:
+    """Разобранный Ogg вход: страницы, пакеты заголовков кодека и начало аудиостраниц"""
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+        self.pages = read_pages(mapped)
+        self.codec = None
+        self.headers = []
+        self.audio_start = None
+        if not self.pages or len({page.serial for page in self.pages}) != 1:
+            # Нет страниц, мультиплексированный или сцепленный поток - постранично не объединяется
+            return
+        first = bytes(mapped.view(self.pages[0].body_offset, 8))
+        if first.startswith(b'\x01vorbis'):
+            self.codec, count = 'vorbis', 3
+        elif first.startswith(b'OpusHead'):
+            self.codec, count = 'opus', 2
+        else:
+            return
+        packet = bytearray()
+        for index, page in enumerate(self.pages):
+            pos = page.body_offset
+            for i, lacing in enumerate(page.segments):
+                packet += mapped.view(pos, lacing)
+                pos += lacing
+                if lacing < 255:
+                    self.headers.append(bytes(packet))
+                    packet = bytearray()
+                    if len(self.headers) == count:
+                        # Аудио обязано начинаться с новой страницы
+                        if i != len(page.segments) - 1:
+                            self.codec = None
+                            return
+                        self.audio_start = index + 1
+                        return
+        self.codec = None
+
+    def setup_key(self):
+        """Заголовки, которые должны совпадать для склейки (комментарии могут отличаться)"""
+        if self.codec == 'vorbis':
+            return self.codec, self.headers[0], self.headers[2]
+        return self.codec, self.headers[0]
+
+    def sample_rate(self):
+        if self.codec == 'vorbis':
+            return struct.unpack_from('<I', self.headers[0], 12)[0]
+        return 48000
+
+    def pre_skip(self):
+        if self.codec == 'opus':
+            return struct.unpack_from('<H', self.headers[0], 10)[0]
+        return 0
+
+    def end_granule(self):
+        for page in reversed(self.pages):
+            if page.granule != NO_GRANULE:
+                return page.granule
+        return 0
+
+    def untrimmed_end_granule(self):
+        """Конечная гранула без обрезки хвоста на последней странице
+
+        Opus помечает лишние отсчёты последнего пакета уменьшенной гранулой
+        страницы EOS. В середине склеенного потока такая гранула недопустима,
+        поэтому гранула последней страницы пересчитывается по длительностям пакетов.
+        """
+        if self.codec != 'opus' or len(self.pages) <= self.audio_start:
+            return self.end_granule()
+        last = len(self.pages) - 1
+        previous = NO_GRANULE
+        for page in reversed(self.pages[self.audio_start:last]):
+            if page.granule != NO_GRANULE:
+                previous = page.granule
+                break
+        if previous == NO_GRANULE:
+            previous = 0
+        # Первый байт каждого пакета, завершённого на последней странице
+        samples = 0
+        packet_start = self._continued_packet_start(last)
+        pos = self.pages[last].body_offset
+        for lacing in self.pages[last].segments:
+            if packet_start is None:
+                packet_start = pos
+            pos += lacing
+            if lacing < 255:
+                samples += opus_packet_samples(bytes(self.mapped.view(packet_start, min(2, pos - packet_start))))
+                packet_start = None
+        return max(previous + samples, self.end_granule())
+
+    def _continued_packet_start(self, index):
+        """Начало пакета, продолжающегося на странице index, или None"""
+        while index > self.audio_start and self.pages[index].flags & FLAG_CONTINUED:
+            index -= 1
+            page = self.pages[index]
+            pos = page.body_offset
+            start = pos if not page.flags & FLAG_CONTINUED else None
+            for lacing in page.segments:
+                pos += lacing
+                if lacing < 255:
+                    start = pos
+            if start is not None and start < page.end:
+                return start
+        return None
+
+
+def merge_ogg(paths, writer, session, on_file=None, peaks=False, cache=None, chapters=None):
+    """Ogg: один логический поток с непрерывной нумерацией страниц и гранул"""
+    from .concat import merge_raw
+
+    inputs = [OggInput(session.open(path, pin=True)) for path in paths]
+    first = inputs[0]
+    for path, ogg in zip(paths, inputs):
+        if ogg.codec is None:
+            logging.warning(f"{os.path.basename(path)} is not a single Vorbis/Opus stream, "
+                            f"concatenating Ogg files as a chained stream")
+            return merge_raw(paths, writer, session, on_file)
+        if ogg.setup_key() != first.setup_key():
+            logging.warning(f"Codec setup of {os.path.basename(path)} differs from "
+                            f"{os.path.basename(paths[0])}, concatenating Ogg files as a chained stream")
+            return merge_raw(paths, writer, session, on_file)
+
+    duration = writer.add_tap('duration', SampleCountTap(first.sample_rate()))
+    serial = first.pages[0].serial
+    sequence = 0
+    base_granule = 0
+    batch = bytearray()
+    for i, (path, ogg) in enumerate(zip(paths, inputs), 1):
+        if on_file:
+            on_file(i, path)
+        pages = ogg.pages if i == 1 else ogg.pages[ogg.audio_start:]
+        last_input = i == len(inputs)
+        # Гранула последней страницы входа: обрезка хвоста остаётся только в конце результата
+        end_granule = ogg.end_granule() if last_input else ogg.untrimmed_end_granule()
+        for n, page in enumerate(pages):
+            flags = page.flags & FLAG_CONTINUED
+            if sequence == 0:
+                flags |= FLAG_BOS
+            if last_input and n == len(pages) - 1:
+                flags |= FLAG_EOS
+            granule = page.granule
+            if n == len(pages) - 1:
+                granule = end_granule
+            if granule != NO_GRANULE:
+                granule += base_granule
+            start = len(batch)
+            batch += PAGE_HEADER.pack(OGG_CAPTURE, 0, flags, granule, serial, sequence, 0, len(page.segments))
+            batch += page.segments
+            batch += ogg.mapped.view(page.body_offset, page.body_length)
+            struct.pack_into('<I', batch, start + 22, ogg_crc(memoryview(batch)[start:]))
+            sequence += 1
+            duration.add(0)
+            if len(batch) >= WRITE_BATCH:
+                writer.write(batch)
+                batch = bytearray()
+        duration.add(end_granule, frames=0)
+        base_granule += end_granule
+    if batch:
+        writer.write(batch)
+    # Пропуск в начале (pre-skip Opus) действует только один раз - в начале результата
+    duration.add(-first.pre_skip(), frames=0)
+    logging.info(f"Ogg {first.codec} merge wrote {sequence} pages, final granule {base_granule}")
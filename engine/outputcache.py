@@ -0,0 +1,232 @@
+"""Кэш результатов: объединение тех же входов в том же порядке берётся готовым
+
+Ключ объединения - SHA-256 от хешей содержимого входов по порядку, формата и
+версии движков: одинаковые наборы у разных людей и в разных каталогах дают
+один ключ. Параметры, которые не меняют байты результата (sidecar, peaks,
+verify), в ключ не входят. Результаты лежат в каталоге кэша, индекс - в SQLite;
+общий размер ограничен, вытесняются давно не использованные записи (LRU).
+"""
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from . import reflink
+from .probecache import default_cache_dir
+from .verify import hash_range
+
+OUTPUTS_DIRNAME = "outputs"
+INDEX_FILENAME = "outputs.sqlite"
+
+# Предел размера кэша результатов по умолчанию
+DEFAULT_LIMIT = 20 * 1024 * 1024 * 1024
+
+# Меняется, когда движки начинают писать другие байты для тех же входов
+KEY_VERSION = 1
+
+# Вид записи кэша разбора с хешем содержимого входа
+CONTENT_KIND = "content-sha256"
+
+
+def content_hash(mapped, cache=None):
+    """SHA-256 содержимого входа; запоминается в кэше разбора для этой версии файла"""
+    digest = cache.get(mapped, CONTENT_KIND) if cache is not None else None
+    if digest is None:
+        digest = hashlib.sha256(mapped.data).digest()
+        if cache is not None:
+            cache.put(mapped, CONTENT_KIND, digest)
+    return digest
+
+
+def merge_key(plan, cache=None):
+    """Ключ объединения по плану (engine.api.MergePlan) или None для потоковых входов"""
+    key = hashlib.sha256(f"smerge-output:{KEY_VERSION}:{plan.format}:{len(plan.paths)}".encode())
+    for path in plan.paths:
+        mapped = plan.session.open(path)
+        if getattr(mapped, 'streaming', False) or getattr(mapped, 'spooled', False):
+            # Поток нельзя хешировать, не прочитав его, а повторно его уже не прочитать
+            return None
+        key.update(content_hash(mapped, cache))
+    return key.hexdigest()
+
+
+def materialize(source, target):
+    """Создаёт target с содержимым source: клон (reflink), жёсткая ссылка или копия
+
+    Возвращает способ: 'reflink', 'hardlink' или 'copy'.
+    """
+    if os.path.lexists(target):
+        os.remove(target)
+    if reflink.reflink_available():
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            size = os.fstat(src.fileno()).st_size
+            cloned = reflink.clone_range(src.fileno(), 0, size, dst.fileno(), 0)
+        if cloned:
+            return 'reflink'
+        os.remove(target)
+    try:
+        os.link(source, target)
+        return 'hardlink'
+    except OSError:
+        pass
+    shutil.copyfile(source, target)
+    return 'copy'
+
+
+class CacheHit:
+    """Результат, взятый из кэша"""
+
+    def __init__(self, key, size, sha256, duration, method):
+        self.key = key
+        self.size = size
+        self.sha256 = sha256
+        self.duration = duration
+        # Как результат создан: 'reflink', 'hardlink' или 'copy'
+        self.method = method
+
+
+class OutputCache:
+    """Каталог готовых результатов с индексом в SQLite; ошибки кэша не мешают объединению"""
+
+    COLUMNS = ('key', 'file', 'size', 'mtime_ns', 'sha256', 'duration', 'created', 'used', 'hits')
+
+    def __init__(self, directory=None, limit=DEFAULT_LIMIT):
+        self.directory = directory or os.path.join(default_cache_dir(), OUTPUTS_DIRNAME)
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.db = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(self.directory, INDEX_FILENAME), timeout=10,
+                                      check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS outputs ("
+                " key TEXT PRIMARY KEY, file TEXT, size INTEGER, mtime_ns INTEGER, sha256 TEXT,"
+                " duration REAL, created REAL, used REAL, hits INTEGER)"
+            )
+            self.db.commit()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Output cache is unavailable ({self.directory}): {str(e)}")
+            self.db = None
+
+    def _entry(self, key):
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(self.COLUMNS)} FROM outputs WHERE key = ?",
+                                  (key,)).fetchone()
+        return dict(zip(self.COLUMNS, row)) if row else None
+
+    def _forget(self, entry, remove_file=True):
+        with self.lock:
+            self.db.execute("DELETE FROM outputs WHERE key = ?", (entry['key'],))
+            self.db.commit()
+        if remove_file:
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except FileNotFoundError:
+                pass
+
+    def _consistent(self, entry, path, check):
+        """Файл записи не изменился; при check=True или изменившемся отпечатке сверяется хеш"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._forget(entry, remove_file=False)
+            return False
+        if not check and (st.st_size, st.st_mtime_ns) == (entry['size'], entry['mtime_ns']):
+            return True
+        if st.st_size != entry['size'] or hash_range(path, 0, st.st_size).hex() != entry['sha256']:
+            logging.warning(f"Cached output {path} no longer matches its SHA-256, dropping it")
+            self._forget(entry)
+            return False
+        with self.lock:
+            self.db.execute("UPDATE outputs SET mtime_ns = ? WHERE key = ?", (st.st_mtime_ns, entry['key']))
+            self.db.commit()
+        return True
+
+    def fetch(self, key, target, check=False):
+        """Создаёт target из записи key; CacheHit или None, если записи нет
+
+        С check=True файл записи перед использованием перечитывается и сверяется
+        с хешем результата; иначе - только по размеру и времени изменения.
+        """
+        if self.db is None:
+            return None
+        try:
+            entry = self._entry(key)
+            path = os.path.join(self.directory, entry['file']) if entry else None
+            if entry is None or not self._consistent(entry, path, check):
+                return None
+            method = materialize(path, target)
+            with self.lock:
+                self.db.execute("UPDATE outputs SET used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+                self.db.commit()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Output cache read failed: {str(e)}")
+            return None
+        logging.info(f"Output cache hit {key[:12]}: {target} ({method})")
+        return CacheHit(key, entry['size'], entry['sha256'], entry['duration'], method)
+
+    def store(self, key, output_path, sha256, duration=None):
+        """Запоминает готовый результат под ключом key и вытесняет лишнее"""
+        if self.db is None:
+            return
+        try:
+            size = os.path.getsize(output_path)
+            if size > self.limit:
+                logging.info(f"{output_path} is larger than the output cache limit, not caching it")
+                return
+            name = key + os.path.splitext(output_path)[1]
+            path = os.path.join(self.directory, name)
+            temp_path = path + '.tmp'
+            method = materialize(output_path, temp_path)
+            os.replace(temp_path, path)
+            now = time.time()
+            with self.lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO outputs (key, file, size, mtime_ns, sha256, duration, created, used, hits)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                    (key, name, size, os.stat(path).st_mtime_ns, sha256, duration, now, now)
+                )
+                self.db.commit()
+            logging.info(f"Stored {output_path} in the output cache as {key[:12]} ({method})")
+            self.evict()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Output cache write failed: {str(e)}")
+
+    def evict(self):
+        """Удаляет давно не использованные записи, пока кэш не уложится в предел"""
+        with self.lock:
+            rows = self.db.execute("SELECT key, file, size FROM outputs ORDER BY used DESC").fetchall()
+        total = 0
+        for key, name, size in rows:
+            total += size
+            if total > self.limit:
+                logging.info(f"Evicting {name} from the output cache")
+                self._forget({'key': key, 'file': name})
+
+    def check(self):
+        """Перечитывает все записи и удаляет несовпавшие с хешем; возвращает (проверено, удалено)"""
+        if self.db is None:
+            return 0, 0
+        with self.lock:
+            keys = [row[0] for row in self.db.execute("SELECT key FROM outputs").fetchall()]
+        dropped = 0
+        for key in keys:
+            entry = self._entry(key)
+            if entry and not self._consistent(entry, os.path.join(self.directory, entry['file']), True):
+                dropped += 1
+        return len(keys), dropped
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,352 @@
+"""Обзор формы волны (пики) PCM результата в формате audiowaveform .dat
+
+Пики считаются на тех же кусках, которыми пишется результат; для неизменённых
+входов они берутся из кэша разбора и просто присоединяются.
+"""
+import struct
+import sys
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    # Без NumPy пики считаются на чистом Python (медленнее, 24-битный PCM не поддерживается)
+    np = None
+
+# Базовое окно (сэмпл-фреймов на точку); остальные уровни получаются из него
+BASE_WINDOW = 256
+# Уровни детализации, которые пишутся в файлы (кратны BASE_WINDOW)
+PEAK_LEVELS = (256, 1024, 4096)
+DAT_VERSION = 1
+# Флаг формата .dat: значения int8 вместо int16
+DAT_FLAG_8BIT = 1
+
+# Типы memoryview.cast для целочисленного PCM без NumPy
+CAST_CODES = {1: 'B', 2: 'h', 4: 'i'}
+# Типы NumPy для целочисленного PCM
+NUMPY_TYPES = {1: '<u1', 2: '<i2', 4: '<i4'}
+
+
+def peaks_supported(info):
+    """Можно ли построить пики для этого WAV: только целый PCM и 32-битный float"""
+    width = info.block_align // info.channels
+    sample_format = info.sample_format()
+    if sample_format is None:
+        # mu-law, A-law, ADPCM и прочее нельзя читать как PCM
+        return False
+    if sample_format == 'float':
+        return width == 4
+    if np is not None:
+        return width in (1, 2, 3, 4)
+    return width in CAST_CODES
+
+
+def _empty():
+    return np.zeros(0, dtype=np.int16) if np is not None else array('h')
+
+
+def _concat(parts):
+    if np is not None:
+        return np.concatenate(parts).astype(np.int16) if parts else _empty()
+    result = array('h')
+    for part in parts:
+        result.extend(part)
+    return result
+
+
+class InputPeaks:
+    """Пики одного входа: неполное окно в начале, полные окна и неполное окно в конце
+
+    head и tail - кортежи (минимум, максимум, сэмпл-фреймов) или None.
+    """
+
+    def __init__(self, head, mins, maxs, tail):
+        self.head = head
+        self.mins = mins
+        self.maxs = maxs
+        self.tail = tail
+
+    def to_bytes(self):
+        parts = []
+        for edge in (self.head, self.tail):
+            parts.append(struct.pack('<BhhQ', 1, *edge) if edge else struct.pack('<BhhQ', 0, 0, 0, 0))
+        parts.append(struct.pack('<Q', len(self.mins)))
+        for values in (self.mins, self.maxs):
+            data = array('h', values)
+            if sys.byteorder == 'big':
+                data.byteswap()
+            parts.append(data.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        edges = []
+        for offset in (0, 13):
+            present, low, high, frames = struct.unpack_from('<BhhQ', blob, offset)
+            edges.append((low, high, frames) if present else None)
+        count = struct.unpack_from('<Q', blob, 26)[0]
+        values = []
+        for i in range(2):
+            start = 34 + i * count * 2
+            if np is not None:
+                values.append(np.frombuffer(blob, dtype='<i2', count=count, offset=start).astype(np.int16))
+            else:
+                data = array('h', blob[start:start + count * 2])
+                if sys.byteorder == 'big':
+                    data.byteswap()
+                values.append(data)
+        return cls(edges[0], values[0], values[1], edges[1])
+
+
+class PeakReducer:
+    """Минимум и максимум по окнам для PCM потока, приходящего произвольными кусками"""
+
+    def __init__(self, info, window=BASE_WINDOW, head_frames=0):
+        self.channels = info.channels
+        self.width = info.block_align // info.channels
+        self.is_float = info.sample_format() == 'float'
+        self.window_samples = window * self.channels
+        # Первые head_frames фреймов дополняют последнее окно предыдущего входа
+        self.head_left = head_frames * self.channels
+        self.head = None
+        self.partial = None
+        self.mins = []
+        self.maxs = []
+        self.carry = b''
+
+    def feed(self, view):
+        if self.carry:
+            need = self.width - len(self.carry)
+            self.carry += bytes(view[:need])
+            if len(self.carry) < self.width:
+                return
+            self._reduce(self._samples(memoryview(self.carry)))
+            view = view[need:]
+            self.carry = b''
+        usable = len(view) - len(view) % self.width
+        if usable:
+            self._reduce(self._samples(view[:usable]))
+        if usable < len(view):
+            self.carry = bytes(view[usable:])
+
+    def _samples(self, view):
+        """Сэмплы куска без копирования (кроме 24-битного PCM)"""
+        if np is None:
+            return view.cast('f' if self.is_float else CAST_CODES[self.width])
+        if self.is_float:
+            return np.frombuffer(view, dtype='<f4')
+        if self.width == 3:
+            raw = np.frombuffer(view, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+            return (values ^ 0x800000) - 0x800000
+        return np.frombuffer(view, dtype=NUMPY_TYPES[self.width])
+
+    def _reduce(self, samples):
+        total = len(samples)
+        pos = 0
+        if self.head_left:
+            take = min(self.head_left, total)
+            self.head = self._merge(self.head, samples[:take], take)
+            self.head_left -= take
+            pos = take
+        if self.partial is not None and pos < total:
+            take = min(self.window_samples - self.partial[2], total - pos)
+            self.partial = self._merge(self.partial, samples[pos:pos + take], take)
+            pos += take
+            if self.partial[2] == self.window_samples:
+                self._emit([self.partial[0]], [self.partial[1]])
+                self.partial = None
+        full = (total - pos) // self.window_samples
+        if full:
+            block = samples[pos:pos + full * self.window_samples]
+            if np is not None:
+                block = block.reshape(full, self.window_samples)
+                self._emit(block.min(axis=1), block.max(axis=1))
+            else:
+                size = self.window_samples
+                parts = [block[i * size:(i + 1) * size] for i in range(full)]
+                self._emit([min(part) for part in parts], [max(part) for part in parts])
+            pos += full * self.window_samples
+        if pos < total:
+            self.partial = self._merge(self.partial, samples[pos:], total - pos)
+
+    @staticmethod
+    def _merge(state, part, count):
+        if np is not None:
+            low, high = part.min(), part.max()
+        else:
+            low, high = min(part), max(part)
+        if state is None:
+            return [low, high, count]
+        return [min(state[0], low), max(state[1], high), state[2] + count]
+
+    def _emit(self, mins, maxs):
+        self.mins.append(self._scale(mins))
+        self.maxs.append(self._scale(maxs))
+
+    def _scale(self, values):
+        """Приводит значения к шкале int16"""
+        if np is not None:
+            values = np.asarray(values)
+            if self.is_float:
+                return np.clip(values * 32767, -32768, 32767).astype(np.int16)
+            values = values.astype(np.int32)
+            if self.width == 1:
+                return ((values - 128) << 8).astype(np.int16)
+            return (values >> ((self.width - 2) * 8)).astype(np.int16)
+        if self.is_float:
+            return array('h', (max(-32768, min(32767, int(v * 32767))) for v in values))
+        if self.width == 1:
+            return array('h', ((v - 128) << 8 for v in values))
+        return array('h', (v >> ((self.width - 2) * 8) for v in values))
+
+    def _edge(self, state):
+        if state is None:
+            return None
+        low, high = self._scale([state[0], state[1]])
+        return int(low), int(high), state[2] // self.channels
+
+    def finish(self):
+        return InputPeaks(self._edge(self.head), _concat(self.mins), _concat(self.maxs), self._edge(self.partial))
+
+
+class PeakBuilder:
+    """Собирает пики всего результата по входам с использованием кэша разбора"""
+
+    def __init__(self, info, cache=None, window=BASE_WINDOW):
+        self.info = info
+        self.cache = cache
+        self.window = window
+        self.sample_rate = info.sample_rate
+        self.frames_total = 0
+        self.pending = None
+        self.parts_min = []
+        self.parts_max = []
+        self.reducer = None
+        self.source = None
+        self.key = None
+        self.in_input = False
+        self.cache_hits = 0
+        self.mins = None
+        self.maxs = None
+
+    def begin_input(self, mapped, payload):
+        """Начало очередного входа; возвращает True, если его пики взяты из кэша"""
+        head_frames = (-self.frames_total) % self.window
+        self.frames_total += payload.length // self.info.block_align
+        self.in_input = True
+        # Поток и его временная копия не кэшируются: повторно их уже не прочитать
+        self.source = None if getattr(mapped, 'streaming', False) or getattr(mapped, 'spooled', False) else mapped
+        self.key = (f"peaks:{self.window}:{head_frames}:{payload.offset}:{payload.length}:"
+                    f"{self.info.format_tag}:{self.info.channels}:{self.info.block_align}")
+        cached = self.cache.get(mapped, self.key) if self.cache is not None and self.source is not None else None
+        if cached is not None:
+            self.reducer = None
+            self._append(InputPeaks.from_bytes(cached))
+            self.cache_hits += 1
+            return True
+        self.reducer = PeakReducer(self.info, self.window, head_frames)
+        return False
+
+    def feed(self, view):
+        if not self.in_input:
+            # Поток без разметки по входам считается одним некэшируемым входом
+            self.in_input = True
+            self.source = None
+            self.reducer = PeakReducer(self.info, self.window)
+        if self.reducer is not None:
+            self.reducer.feed(view)
+
+    def end_input(self):
+        if self.reducer is not None:
+            peaks = self.reducer.finish()
+            if self.cache is not None and self.source is not None:
+                self.cache.put(self.source, self.key, peaks.to_bytes())
+            self._append(peaks)
+        self.reducer = None
+        self.in_input = False
+
+    def _append(self, peaks):
+        if peaks.head:
+            self.pending = self._combine(self.pending, peaks.head)
+            if self.pending[2] >= self.window:
+                self._flush_pending()
+        if len(peaks.mins):
+            self.parts_min.append(peaks.mins)
+            self.parts_max.append(peaks.maxs)
+        if peaks.tail:
+            self.pending = self._combine(self.pending, peaks.tail)
+
+    @staticmethod
+    def _combine(state, edge):
+        if state is None:
+            return list(edge)
+        return [min(state[0], edge[0]), max(state[1], edge[1]), state[2] + edge[2]]
+
+    def _flush_pending(self):
+        if np is not None:
+            self.parts_min.append(np.array([self.pending[0]], dtype=np.int16))
+            self.parts_max.append(np.array([self.pending[1]], dtype=np.int16))
+        else:
+            self.parts_min.append(array('h', [self.pending[0]]))
+            self.parts_max.append(array('h', [self.pending[1]]))
+        self.pending = None
+
+    def finish(self):
+        if self.in_input:
+            self.end_input()
+        if self.pending is not None:
+            self._flush_pending()
+        self.mins = _concat(self.parts_min)
+        self.maxs = _concat(self.parts_max)
+        return self.mins, self.maxs
+
+
+def downsample(values, factor, reduce_min):
+    """Укрупняет окна в factor раз: минимум минимумов или максимум максимумов"""
+    if factor == 1:
+        return values
+    if np is not None:
+        starts = np.arange(0, len(values), factor)
+        if not len(starts):
+            return values
+        return (np.minimum if reduce_min else np.maximum).reduceat(values, starts)
+    pick = min if reduce_min else max
+    return array('h', (pick(values[i:i + factor]) for i in range(0, len(values), factor)))
+
+
+def write_dat(path, mins, maxs, sample_rate, samples_per_pixel, bits=8):
+    """Пишет пики в формате audiowaveform .dat (версия 1), который читает peaks.js"""
+    count = len(mins)
+    header = struct.pack('<iIiiI', DAT_VERSION, DAT_FLAG_8BIT if bits == 8 else 0,
+                         sample_rate, samples_per_pixel, count)
+    if np is not None:
+        pairs = np.empty(count * 2, dtype='<i1' if bits == 8 else '<i2')
+        shift = 8 if bits == 8 else 0
+        pairs[0::2] = np.asarray(mins) >> shift
+        pairs[1::2] = np.asarray(maxs) >> shift
+        data = pairs.tobytes()
+    else:
+        pairs = array('b' if bits == 8 else 'h')
+        shift = 8 if bits == 8 else 0
+        for low, high in zip(mins, maxs):
+            pairs.append(low >> shift)
+            pairs.append(high >> shift)
+        if sys.byteorder == 'big' and bits != 8:
+            pairs.byteswap()
+        data = pairs.tobytes()
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(data)
+
+
+def write_peaks_files(output_path, mins, maxs, sample_rate, levels=PEAK_LEVELS, bits=8):
+    """Пишет по файлу <результат>.<окно>.dat на каждый уровень детализации"""
+    paths = []
+    for level in levels:
+        factor = level // BASE_WINDOW
+        path = f"{output_path}.{level}.dat"
+        write_dat(path, downsample(mins, factor, True), downsample(maxs, factor, False),
+                  sample_rate, level, bits)
+        paths.append(path)
+    return paths
@@ -0,0 +1,62 @@
+"""Продолжительность входов без декодирования: по заголовкам контейнера или оценка по размеру"""
+import logging
+
+from .formats import (Mp3InfoFrame, detect_format, find_mp3_frame, id3v2_length, is_mp3_info_frame, parse_wav,
+                      trailing_tags_length)
+
+# Битрейт для оценки, когда заголовков нет (кбит/с)
+FALLBACK_BITRATE = 128
+
+
+def estimate_by_size(size, bitrate=FALLBACK_BITRATE):
+    """Приблизительная оценка продолжительности по размеру и битрейту"""
+    return (size * 8) / (bitrate * 1000)
+
+
+def mp3_duration(mapped):
+    """MP3: число фреймов из Xing/Info, иначе оценка по первому фрейму"""
+    view = mapped.data
+    start = id3v2_length(view)
+    end = mapped.size - trailing_tags_length(view)
+    offset, frame = find_mp3_frame(view, start, end)
+    if offset is None:
+        return estimate_by_size(mapped.size)
+    frame_length, samples, rate = frame
+    if is_mp3_info_frame(view, offset, frame_length):
+        # Тот же разбор, что у движка: Xing/Info и VBRI
+        frames = Mp3InfoFrame(view[offset:offset + frame_length]).frames
+        if frames is not None:
+            return frames * samples / rate
+    return (end - offset) / frame_length * samples / rate
+
+
+def probe_duration(mapped, cache=None):
+    """Продолжительность входа в секундах или None, если её не удалось определить"""
+    if getattr(mapped, 'streaming', False):
+        # Поток нельзя перечитать; его продолжительность станет известна только после записи
+        return None
+    fmt = detect_format(mapped.path)
+    try:
+        if fmt == 'wav':
+            info = parse_wav(mapped.data)
+            return info.data_length / info.byte_rate
+        if fmt == 'mp3':
+            return mp3_duration(mapped)
+        if fmt == 'flac':
+            from .flac import FlacInput
+            streaminfo = FlacInput(mapped).streaminfo
+            return streaminfo.total_samples / streaminfo.sample_rate
+        if fmt == 'ogg':
+            from .ogg import OggInput
+            ogg = OggInput(mapped)
+            if ogg.codec is not None:
+                return (ogg.end_granule() - ogg.pre_skip()) / ogg.sample_rate()
+        if fmt == 'aac':
+            from .adts import AAC_BLOCK_SAMPLES, index_adts
+            index = index_adts(mapped, cache)
+            return index.blocks * AAC_BLOCK_SAMPLES / index.sample_rate
+        # Для других форматов определяем по размеру файла (приблизительно)
+        return estimate_by_size(mapped.size)
+    except Exception as e:
+        logging.warning(f"Could not determine duration for {mapped.path}: {str(e)}")
+        return None
@@ -0,0 +1,98 @@
+"""Кэш результатов разбора входных файлов (пики, индексы фреймов, хеши диапазонов)
+
+Записи привязаны к пути, размеру и времени изменения файла, поэтому изменённый
+файл автоматически считается новым.
+"""
+import logging
+import os
+import sqlite3
+import threading
+
+CACHE_FILENAME = "probe.sqlite"
+
+
+def default_cache_dir():
+    """Каталог кэша: SMERGE_CACHE_DIR, %LOCALAPPDATA%\\smerge или ~/.cache/smerge"""
+    if os.environ.get('SMERGE_CACHE_DIR'):
+        return os.environ['SMERGE_CACHE_DIR']
+    if os.name == 'nt' and os.environ.get('LOCALAPPDATA'):
+        return os.path.join(os.environ['LOCALAPPDATA'], 'smerge')
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'smerge')
+
+
+def file_stamp(path):
+    """Отпечаток файла для ключа кэша"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ProbeCache:
+    """Постоянный кэш в SQLite; ошибки кэша не мешают объединению, а только отключают его"""
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(default_cache_dir(), CACHE_FILENAME)
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                " path TEXT, size INTEGER, mtime_ns INTEGER, kind TEXT, value BLOB,"
+                " PRIMARY KEY (path, kind))"
+            )
+            self.db.commit()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Probe cache is unavailable ({path}): {str(e)}")
+            self.db = None
+
+    def _key(self, source):
+        """Путь и отпечаток для пути или отображённого входа"""
+        if hasattr(source, 'stamp'):
+            return os.path.abspath(source.path), source.stamp
+        return os.path.abspath(source), file_stamp(source)
+
+    def get(self, source, kind):
+        """Значение для актуальной версии файла или None"""
+        if self.db is None:
+            return None
+        path, (size, mtime_ns) = self._key(source)
+        try:
+            with self.lock:
+                row = self.db.execute(
+                    "SELECT value FROM probes WHERE path = ? AND kind = ? AND size = ? AND mtime_ns = ?",
+                    (path, kind, size, mtime_ns)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Probe cache read failed: {str(e)}")
+            return None
+        return row[0] if row else None
+
+    def put(self, source, kind, value):
+        """Сохраняет значение, заменяя запись для прежней версии файла"""
+        if self.db is None:
+            return
+        path, (size, mtime_ns) = self._key(source)
+        try:
+            with self.lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO probes (path, size, mtime_ns, kind, value) VALUES (?, ?, ?, ?, ?)",
+                    (path, size, mtime_ns, kind, value)
+                )
+                self.db.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Probe cache write failed: {str(e)}")
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,47 @@
+"""Клонирование диапазонов файлов (reflink) на файловых системах с копированием при записи"""
+import errno
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    # На Windows ioctl недоступен - клонирование просто не используется
+    fcntl = None
+
+# _IOW(0x94, 13, struct file_clone_range) из linux/fs.h
+FICLONERANGE = 0x4020940D
+
+# Ошибки, которые означают "здесь клонировать нельзя" (не та ФС, разные тома, невыровненный диапазон)
+UNSUPPORTED_ERRORS = {
+    errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL,
+    errno.ENOSYS, errno.EBADF, errno.EPERM,
+}
+
+
+def reflink_available():
+    """Проверяет, может ли платформа в принципе выполнять FICLONERANGE"""
+    return fcntl is not None
+
+
+def clone_range(src_fd, src_offset, length, dst_fd, dst_offset):
+    """Клонирует диапазон src в dst; возвращает False, если ФС этого не умеет"""
+    if fcntl is None or length <= 0:
+        return False
+    # struct file_clone_range { __s64 src_fd; __u64 src_offset; __u64 src_length; __u64 dest_offset; }
+    arg = struct.pack('=qQQQ', src_fd, src_offset, length, dst_offset)
+    try:
+        fcntl.ioctl(dst_fd, FICLONERANGE, arg)
+    except OSError as e:
+        if e.errno in UNSUPPORTED_ERRORS:
+            return False
+        raise
+    return True
+
+
+def block_size(fd):
+    """Размер блока файловой системы, к которому должны быть выровнены клонируемые диапазоны"""
+    try:
+        return os.fstat(fd).st_blksize or 4096
+    except (OSError, AttributeError):
+        return 4096
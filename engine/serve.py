@@ -0,0 +1,470 @@
+"""Локальная HTTP-служба объединения: очередь заданий, ограниченный параллелизм, статус через SSE
+
+    POST   /jobs              {"inputs": [...], "output": "...", параметры MergeOptions} -> 201 {"id": ...}
+    GET    /jobs              список заданий
+    GET    /jobs/<id>         состояние задания (с прогрессом, пока оно выполняется)
+    GET    /jobs/<id>/events  поток Server-Sent Events: progress ... и завершающее done
+    GET    /jobs/<id>/preview результат без записи на диск (VirtualMerge), с поддержкой Range
+    DELETE /jobs/<id>         отмена (ожидающее задание снимается, выполняющееся останавливается)
+
+Пути входов и результата - пути на сервере (как в манифесте пакетного режима).
+Очередь хранится в SQLite: задания, прерванные остановкой службы, при запуске
+возвращаются в очередь. Только стандартная библиотека.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .api import CancelToken, MergeCancelled, merge
+from .batch import make_job
+
+STATE_FILENAME = "serve.sqlite"
+DEFAULT_PORT = 8765
+
+# Состояния заданий
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Пауза потока событий, после которой отправляется комментарий, чтобы соединение не закрылось
+KEEPALIVE_SECONDS = 15.0
+
+# Размер куска ответа preview
+PREVIEW_CHUNK = 1024 * 1024
+
+# Сколько виртуальных результатов /preview держать открытыми (давно не запрошенные закрываются)
+PREVIEW_CACHE_SIZE = 8
+
+MEDIA_TYPES = {
+    'wav': 'audio/wav',
+    'mp3': 'audio/mpeg',
+    'flac': 'audio/flac',
+    'ogg': 'audio/ogg',
+    'aac': 'audio/aac',
+}
+
+
+class JobStore:
+    """Постоянная очередь заданий в SQLite"""
+
+    COLUMNS = ('id', 'status', 'request', 'result', 'error', 'created', 'started', 'finished')
+
+    def __init__(self, path):
+        import sqlite3
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, status TEXT, request TEXT, result TEXT, error TEXT,"
+            " created REAL, started REAL, finished REAL)"
+        )
+        # Задания, которые выполнялись при остановке службы, начинаются заново
+        self.db.execute("UPDATE jobs SET status = ?, started = NULL WHERE status = ?", (QUEUED, RUNNING))
+        self.db.commit()
+
+    def _row(self, row):
+        job = dict(zip(self.COLUMNS, row))
+        job['request'] = json.loads(job['request'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def add(self, request):
+        with self.lock:
+            cursor = self.db.execute("INSERT INTO jobs (status, request, created) VALUES (?, ?, ?)",
+                                     (QUEUED, json.dumps(request), time.time()))
+            self.db.commit()
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def list(self):
+        with self.lock:
+            rows = self.db.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs ORDER BY id").fetchall()
+        return [self._row(row) for row in rows]
+
+    def take(self):
+        """Первое ожидающее задание, помеченное как выполняющееся, или None"""
+        with self.lock:
+            row = self.db.execute("SELECT id, request FROM jobs WHERE status = ? ORDER BY id LIMIT 1",
+                                  (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE jobs SET status = ?, started = ? WHERE id = ?", (RUNNING, time.time(), row[0]))
+            self.db.commit()
+        return row[0], json.loads(row[1])
+
+    def finish(self, job_id, status, result=None, error=None):
+        with self.lock:
+            self.db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                            (status, json.dumps(result) if result is not None else None, error,
+                             time.time(), job_id))
+            self.db.commit()
+
+    def cancel_queued(self, job_id):
+        """Снимает ожидающее задание; False, если оно уже начато или завершено"""
+        with self.lock:
+            cursor = self.db.execute("UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?",
+                                     (CANCELLED, time.time(), job_id, QUEUED))
+            self.db.commit()
+            return cursor.rowcount == 1
+
+    def close(self):
+        self.db.close()
+
+
+class PreviewSlot:
+    """Виртуальный результат задания и число запросов, которые его сейчас читают"""
+
+    def __init__(self, preview):
+        self.preview = preview
+        self.users = 0
+        # Вытеснен из кэша или сброшен: закрывается, когда users дойдёт до нуля
+        self.retired = False
+
+
+class MergeService:
+    """Очередь и рабочие потоки; состояние заданий меняется под общим условием"""
+
+    def __init__(self, state_path, workers=2, base_dir=None):
+        self.store = JobStore(state_path)
+        self.workers = workers
+        self.base_dir = base_dir or os.getcwd()
+        self.condition = threading.Condition()
+        # Выполняющиеся задания: прогресс, токен отмены и счётчик изменений для потоков событий
+        self.progress = {}
+        self.tokens = {}
+        self.versions = {}
+        # Виртуальные результаты для /preview по заданиям (LRU, не больше PREVIEW_CACHE_SIZE)
+        self.previews = OrderedDict()
+        self.preview_lock = threading.Lock()
+        self.stopping = False
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"smerge-serve-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            for token in self.tokens.values():
+                token.cancel()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        with self.preview_lock:
+            for slot in self.previews.values():
+                self._retire(slot)
+            self.previews.clear()
+        self.store.close()
+
+    def open_preview(self, job_id, request):
+        """Виртуальный результат задания для запроса; после ответа - close_preview(slot)
+
+        Строится один раз и переиспользуется запросами, пока задание не
+        завершилось. Открыто не больше PREVIEW_CACHE_SIZE результатов:
+        давно не запрошенный вытесняется и закрывается, когда его дочитает
+        последний запрос.
+        """
+        from .api import MergePlan
+        from .virtual import VirtualMerge
+
+        with self.preview_lock:
+            slot = self.previews.get(job_id)
+            if slot is None:
+                job = make_job(request, self.base_dir, job_id)
+                slot = self.previews[job_id] = PreviewSlot(VirtualMerge(MergePlan(job.inputs, job.output,
+                                                                                  job.options)))
+                while len(self.previews) > PREVIEW_CACHE_SIZE:
+                    self._retire(self.previews.popitem(last=False)[1])
+            else:
+                self.previews.move_to_end(job_id)
+            slot.users += 1
+            return slot
+
+    def close_preview(self, slot):
+        with self.preview_lock:
+            slot.users -= 1
+            if slot.retired and not slot.users:
+                slot.preview.close()
+
+    def drop_preview(self, job_id):
+        """Забывает результат задания: после завершения его разметка устаревает"""
+        with self.preview_lock:
+            slot = self.previews.pop(job_id, None)
+            if slot is not None:
+                self._retire(slot)
+
+    def _retire(self, slot):
+        """Вызывается под self.preview_lock"""
+        slot.retired = True
+        if not slot.users:
+            slot.preview.close()
+
+    def _changed(self, job_id):
+        """Вызывается под self.condition"""
+        self.versions[job_id] = self.versions.get(job_id, 0) + 1
+        self.condition.notify_all()
+
+    def submit(self, request):
+        """Проверяет запрос (пути и параметры) и ставит задание в очередь"""
+        if not isinstance(request, dict):
+            raise ValueError("Job must be a JSON object")
+        make_job(request, self.base_dir, 'request')
+        job_id = self.store.add(request)
+        with self.condition:
+            self._changed(job_id)
+        return self.status(job_id)
+
+    def cancel(self, job_id):
+        with self.condition:
+            running = job_id in self.tokens
+            if running:
+                self.tokens[job_id].cancel()
+            elif self.store.cancel_queued(job_id):
+                self._changed(job_id)
+        # Выполняющееся задание сбросит свой результат само, когда остановится
+        if not running:
+            self.drop_preview(job_id)
+        return self.status(job_id)
+
+    def status(self, job_id):
+        job = self.store.get(job_id)
+        if job is not None and job_id in self.progress:
+            job['progress'] = self.progress[job_id]
+        return job
+
+    def version(self, job_id):
+        return self.versions.get(job_id, 0)
+
+    def wait_change(self, job_id, version, timeout):
+        """Ждёт изменения задания; возвращает новый счётчик изменений"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.versions.get(job_id, 0) != version or self.stopping, timeout)
+            return self.versions.get(job_id, 0)
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                taken = None
+                while not self.stopping:
+                    taken = self.store.take()
+                    if taken is not None:
+                        break
+                    self.condition.wait()
+                if taken is None:
+                    return
+                job_id, request = taken
+                token = self.tokens[job_id] = CancelToken()
+                self._changed(job_id)
+            self._run(job_id, request, token)
+
+    def _run(self, job_id, request, token):
+        def on_progress(progress):
+            with self.condition:
+                self.progress[job_id] = {'index': progress.index, 'count': progress.count,
+                                         'fraction': round(progress.fraction, 4)}
+                self._changed(job_id)
+
+        try:
+            job = make_job(request, self.base_dir, job_id)
+            result = merge(job.inputs, job.output, job.options, progress=on_progress, cancel=token)
+            status, data, error = DONE, result.to_dict(), None
+        except MergeCancelled:
+            # Остановка службы прерывает задание, но не отменяет его: после запуска оно начнётся заново
+            status, data, error = (QUEUED if self.stopping else CANCELLED), None, None
+        except Exception as e:
+            logging.warning(f"Job {job_id} failed: {str(e)}")
+            status, data, error = FAILED, None, str(e)
+        with self.condition:
+            self.store.finish(job_id, status, data, error)
+            self.tokens.pop(job_id, None)
+            self.progress.pop(job_id, None)
+            self._changed(job_id)
+        self.drop_preview(job_id)
+        logging.info(f"Job {job_id} {status}")
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Маршруты /jobs; служба доступна как self.server.service"""
+
+    server_version = "smerge"
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        """(id задания или None, остаток пути) для путей /jobs..., иначе None"""
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if parts[0] != 'jobs' or len(parts) > 3:
+            return None
+        if len(parts) == 1:
+            return None, None
+        if not parts[1].isdigit():
+            return None
+        return int(parts[1]), (parts[2] if len(parts) == 3 else None)
+
+    def _job_or_404(self, job_id):
+        job = self.server.service.status(job_id)
+        if job is None:
+            self._send_json(404, {'error': f"No job {job_id}"})
+        return job
+
+    def do_POST(self):
+        if self._route() != (None, None):
+            return self._send_json(404, {'error': "Not found"})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'null')
+            job = self.server.service.submit(request)
+        except (ValueError, TypeError, OSError) as e:
+            return self._send_json(400, {'error': str(e)})
+        self._send_json(201, job)
+
+    def do_GET(self):
+        route = self._route()
+        if route is None or route[1] not in (None, 'events', 'preview'):
+            return self._send_json(404, {'error': "Not found"})
+        job_id, tail = route
+        if job_id is None:
+            return self._send_json(200, self.server.service.store.list())
+        job = self._job_or_404(job_id)
+        if job is None:
+            return
+        if tail == 'events':
+            return self._stream_events(job_id)
+        if tail == 'preview':
+            return self._send_preview(job_id, job['request'])
+        self._send_json(200, self.server.service.status(job_id))
+
+    def do_DELETE(self):
+        route = self._route()
+        if route is None or route[0] is None or route[1] is not None:
+            return self._send_json(404, {'error': "Not found"})
+        if self._job_or_404(route[0]) is None:
+            return
+        self._send_json(200, self.server.service.cancel(route[0]))
+
+    def _send_preview(self, job_id, request):
+        """Отдаёт виртуальный результат целиком или один диапазон из заголовка Range"""
+        service = self.server.service
+        try:
+            slot = service.open_preview(job_id, request)
+        except (ValueError, OSError) as e:
+            return self._send_json(400, {'error': str(e)})
+        try:
+            self._send_range(slot.preview)
+        finally:
+            service.close_preview(slot)
+
+    def _send_range(self, preview):
+        size = preview.size
+        start, end = 0, size
+        try:
+            requested = parse_range(self.headers.get('Range'), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', f"bytes */{size}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if requested is not None:
+            start, end = requested
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', MEDIA_TYPES.get(preview.format, 'application/octet-stream'))
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        try:
+            while start < end:
+                data = preview.read_range(start, min(PREVIEW_CHUNK, end - start))
+                if not data:
+                    break
+                self.wfile.write(data)
+                start += len(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # Плееры обрывают соединение при перемотке - это не ошибка
+            pass
+
+    def _stream_events(self, job_id):
+        """SSE: событие progress на каждое изменение задания и done в конце"""
+        service = self.server.service
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        version = service.version(job_id)
+        try:
+            while True:
+                job = service.status(job_id)
+                finished = job['status'] in FINISHED
+                event = 'done' if finished else 'progress'
+                self.wfile.write(f"event: {event}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                if finished or service.stopping:
+                    return
+                changed = service.wait_change(job_id, version, KEEPALIVE_SECONDS)
+                if changed == version:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                version = changed
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент ушёл - задание продолжает выполняться
+            pass
+
+
+def parse_range(header, size):
+    """Один диапазон "bytes=a-b", "bytes=a-" или "bytes=-n" -> (начало, конец); None - весь файл
+
+    Несколько диапазонов не поддерживаются - тогда отдаётся весь файл (это допускает RFC 9110).
+    Невыполнимый диапазон - ValueError.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[6:].strip().partition('-')
+    if not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        start = max(0, size - int(last))
+        end = size if int(last) else start
+    else:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    if start >= size or end <= start:
+        raise ValueError(f"Range {header} is outside of {size} bytes")
+    return start, end
+
+
+def make_server(host='127.0.0.1', port=DEFAULT_PORT, state_path=None, workers=2):
+    """HTTP-сервер с запущенной службой; остановка - server.shutdown() и server.service.stop()"""
+    service = MergeService(state_path or os.path.join(os.getcwd(), STATE_FILENAME), workers)
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    service.start()
+    return server
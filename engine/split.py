@@ -0,0 +1,704 @@
+"""Разрезание аудио на части по границам фреймов, без декодирования
+
+    parts = split_audio('day.mp3', max_bytes=FAT32_LIMIT)
+    parts = split_audio('day.flac', max_seconds=30 * 60, output_dir='upload')
+    parts = merge_parts(['1.wav', '2.wav', '3.wav'], 'day.wav', max_seconds=3600)
+
+Сначала строится индекс границ: смещения фреймов MP3, AAC и FLAC (он
+сохраняется в кэше разбора) или блоков PCM для WAV, которые вычисляются, а не
+хранятся. Индексы нескольких входов стыкуются подряд, как их данные в
+объединении, - так merge_parts пишет объединение сразу частями, и целиком
+оно нигде не существует. Каждая часть получает свой заголовок (RIFF,
+STREAMINFO с SEEKTABLE, ID3v2 первого входа и фрейм Xing), а её данные
+переносятся диапазонами через OutputWriter - клонированием или
+copy_file_range. Только FLAC переписывает номера в заголовках фреймов,
+которые не совпадают с нумерацией части.
+"""
+import bisect
+import copy
+import json
+import logging
+import os
+import struct
+from array import array
+
+from .adts import AAC_BLOCK_SAMPLES, index_adts, parse_adts_header
+from .archives import split_member
+from .concat import RIFF_LIMIT, wav_header
+from .flac import (KEPT_BLOCKS, SEEK_INTERVAL, FlacInput, FrameIndex, build_header, encode_number,
+                   frame_strategy, index_frames, number_length, write_renumbered)
+from .formats import build_mp3_info_frame, detect_format, find_mp3_frame, locate_payload, parse_mp3_header
+from .mapped import MappedSession
+from .taps import HashTap, SampleCountTap, write_sha256_sidecar
+from .verify import VerificationError, remember_digests, verify_output
+from .writer import OutputWriter
+
+# Наибольший размер файла на FAT32
+FAT32_LIMIT = 4 * 1024 * 1024 * 1024 - 1
+
+# Имя части: <имя входа>.partNN<расширение>
+PART_NAME = "{stem}.part{number:0{width}d}{ext}"
+
+# Список частей объединения: <результат>.parts.json рядом с ними
+MANIFEST_SUFFIX = '.parts.json'
+
+SPLIT_FORMATS = ('wav', 'mp3', 'flac', 'aac')
+
+
+class UniformFrames:
+    """Равные фреймы (блоки PCM): i-я граница вычисляется, а не хранится"""
+
+    def __init__(self, start, step, count):
+        self.start = start
+        self.step = step
+        self.count = count
+
+    def __len__(self):
+        return self.count + 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count + 1
+        if not 0 <= i <= self.count:
+            raise IndexError(i)
+        return self.start + i * self.step
+
+
+class JoinedFrames:
+    """Границы фреймов нескольких входов подряд - как в их объединённых данных
+
+    Границы каждого входа отсчитываются от его первой, поэтому i-я граница -
+    число байт (или отсчётов) объединения до i-го фрейма.
+    """
+
+    def __init__(self, sequences):
+        self.sequences = sequences
+        # Номер первого фрейма каждого входа в общей нумерации; последний элемент - число фреймов
+        self.starts = [0]
+        self.bases = [0]
+        for values in sequences:
+            self.starts.append(self.starts[-1] + len(values) - 1)
+            self.bases.append(self.bases[-1] + values[-1] - values[0])
+
+    def __len__(self):
+        return self.starts[-1] + 1
+
+    def __getitem__(self, i):
+        count = self.starts[-1]
+        if i < 0:
+            i += count + 1
+        if not 0 <= i <= count:
+            raise IndexError(i)
+        if i == count:
+            return self.bases[-1]
+        s = bisect.bisect_right(self.starts, i) - 1
+        values = self.sequences[s]
+        return self.bases[s] + values[i - self.starts[s]] - values[0]
+
+
+class SplitIndex:
+    """Границы фреймов: смещение во входе и номер первого отсчёта каждого фрейма
+
+    Последний элемент offsets и positions - конец данных и общее число отсчётов.
+    """
+
+    def __init__(self, offsets, positions, sample_rate):
+        self.offsets = offsets
+        self.positions = positions
+        self.sample_rate = sample_rate
+
+    @property
+    def count(self):
+        return len(self.offsets) - 1
+
+    @property
+    def samples(self):
+        return self.positions[-1]
+
+    def to_bytes(self):
+        return struct.pack('<QI', len(self.offsets), self.sample_rate) + self.offsets.tobytes() + self.positions.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob):
+        count, sample_rate = struct.unpack_from('<QI', blob)
+        pos = struct.calcsize('<QI')
+        offsets, positions = array('Q'), array('Q')
+        offsets.frombytes(blob[pos:pos + 8 * count])
+        positions.frombytes(blob[pos + 8 * count:pos + 16 * count])
+        return cls(offsets, positions, sample_rate)
+
+
+def index_mp3(mapped, start, end, cache=None):
+    """Один проход по фреймам MP3 от start до end; индекс кэшируется в кэше разбора"""
+    kind = f"mp3-frames:{start}:{end}"
+    if cache is not None:
+        cached = cache.get(mapped, kind)
+        if cached is not None:
+            return SplitIndex.from_bytes(cached)
+
+    view = mapped.data
+    offsets, positions = array('Q'), array('Q')
+    sample_rate = None
+    samples = 0
+    pos = start
+    while pos + 4 <= end:
+        frame = parse_mp3_header(struct.unpack_from('>I', view, pos)[0])
+        if frame is None:
+            # Мусор между фреймами остаётся в предыдущем фрейме
+            pos, frame = find_mp3_frame(view, pos + 1, end, limit=end)
+            if pos is None:
+                break
+        length, frame_samples, rate = frame
+        if pos + length > end:
+            break
+        offsets.append(pos)
+        positions.append(samples)
+        samples += frame_samples
+        sample_rate = sample_rate or rate
+        pos += length
+    if not offsets:
+        raise ValueError(f"No MP3 frames found in {os.path.basename(mapped.path)}")
+    offsets.append(end)
+    positions.append(samples)
+
+    index = SplitIndex(offsets, positions, sample_rate)
+    if cache is not None:
+        cache.put(mapped, kind, index.to_bytes())
+    return index
+
+
+def check_params(name, paths, params, describe):
+    """Все входы должны быть в одном формате: params - параметры каждого, describe(i) - их описание"""
+    for i in range(1, len(paths)):
+        if params[i] != params[0]:
+            raise ValueError(f"{name} format of {os.path.basename(paths[i])} differs from "
+                             f"{os.path.basename(paths[0])} ({describe(i)})")
+
+
+class Splitter:
+    """Фреймы входов подряд, как в их объединении; подклассы пишут части своего формата
+
+    Входы берутся из сеанса при каждом обращении: при тесном пределе
+    дескрипторов сеанс закрывает давно не нужные, а индексы хранятся отдельно.
+    """
+
+    # Предел размера части, который задаёт сам формат
+    max_bytes = None
+
+    def __init__(self, paths, session, indexes, sample_rate):
+        self.paths = paths
+        self.session = session
+        self.indexes = indexes
+        offsets = JoinedFrames([index.offsets for index in indexes])
+        self.starts = offsets.starts
+        self.index = SplitIndex(offsets, JoinedFrames([index.positions for index in indexes]), sample_rate)
+        # on_file(номер, путь) вызывается, когда в часть впервые пишутся фреймы входа
+        self.on_file = None
+        self.entered = 0
+
+    def source(self, s):
+        return self.session.open(self.paths[s])
+
+    def enter(self, s):
+        if s >= self.entered:
+            self.entered = s + 1
+            if self.on_file:
+                self.on_file(s + 1, self.paths[s])
+
+    def pieces(self, i, j):
+        """(номер входа, первый фрейм в нём, конец) для фреймов объединения от i до j"""
+        s = bisect.bisect_right(self.starts, i) - 1
+        while s < len(self.indexes) and self.starts[s] < j:
+            first = max(i, self.starts[s]) - self.starts[s]
+            stop = min(j, self.starts[s + 1]) - self.starts[s]
+            if first < stop:
+                yield s, first, stop
+            s += 1
+
+    def ranges(self, i, j):
+        """Диапазоны байтов входов (номер входа, начало, конец) для фреймов от i до j"""
+        for s, first, stop in self.pieces(i, j):
+            offsets = self.indexes[s].offsets
+            yield s, offsets[first], offsets[stop]
+
+    def copy_ranges(self, writer, i, j):
+        for s, start, stop in self.ranges(i, j):
+            self.enter(s)
+            writer.copy_from(self.source(s), start, stop - start)
+
+
+class WavSplitter(Splitter):
+    """WAV: части по блокам PCM, у каждой свой заголовок RIFF"""
+
+    # Размер RIFF - 32 бита: больше 4 ГиБ часть быть не может
+    max_bytes = RIFF_LIMIT + 8
+
+    def __init__(self, paths, session, cache=None):
+        infos = [locate_payload(session.open(path), 'wav').info for path in paths]
+        check_params('WAV', paths, [info.params() for info in infos],
+                     lambda i: f"{infos[i].sample_rate} Hz, {infos[i].channels} ch, {infos[i].bits_per_sample} bit")
+        indexes = []
+        for info in infos:
+            # Неполный последний блок входа в части не попадает
+            frames = info.data_length // info.block_align
+            indexes.append(SplitIndex(UniformFrames(info.data_offset, info.block_align, frames),
+                                      UniformFrames(0, 1, frames), info.sample_rate))
+        self.info = infos[0]
+        super().__init__(paths, session, indexes, self.info.sample_rate)
+
+    def part_size(self, i, j):
+        length = self.index.offsets[j] - self.index.offsets[i]
+        return len(wav_header(self.info, length)) + length + (length & 1)
+
+    def write(self, writer, i, j):
+        length = self.index.offsets[j] - self.index.offsets[i]
+        writer.write(wav_header(self.info, length))
+        self.copy_ranges(writer, i, j)
+        if length & 1:
+            writer.write(b'\x00')
+
+
+class Mp3Splitter(Splitter):
+    """MP3: части по фреймам, у каждой ID3v2 тег первого входа и свой фрейм Xing
+
+    Фрейм Xing (число фреймов и байт части, таблица перемотки по её индексу)
+    пишется по тому же правилу, что и при объединении (concat.mp3_info_frame):
+    если он был хоть у одного входа или у входов разный битрейт. Расширение
+    LAME не переносится: задержка и добивка кодера относятся к краям входа, а
+    не части.
+    """
+
+    def __init__(self, paths, session, cache=None):
+        indexes = []
+        headers = set()
+        info_frames = False
+        for path in paths:
+            mapped = session.open(path)
+            payload = locate_payload(mapped, 'mp3')
+            if not indexes:
+                self.tag_length = payload.tag_length
+            index = index_mp3(mapped, payload.offset, payload.offset + payload.length, cache)
+            indexes.append(index)
+            headers.add(struct.unpack_from('>I', mapped.data, index.offsets[0])[0])
+            info_frames = info_frames or payload.info_offset is not None
+        super().__init__(paths, session, indexes, indexes[0].sample_rate)
+
+        self.header = struct.unpack_from('>I', session.open(paths[0]).data, indexes[0].offsets[0])[0]
+        bitrates = {header >> 12 & 0xF for header in headers}
+        self.info_length = 0
+        if (self.header >> 17) & 3 == 1 and (info_frames or len(bitrates) > 1):
+            self.info_length = len(build_mp3_info_frame(self.header, None, 0, 0, bytes(100)))
+
+    def part_size(self, i, j):
+        return self.tag_length + self.info_length + self.index.offsets[j] - self.index.offsets[i]
+
+    def info_frame(self, i, j):
+        """Фрейм Xing части из фреймов от i до j: все фреймы MP3 одной длительности"""
+        offsets = self.index.offsets
+        size = self.info_length + offsets[j] - offsets[i]
+        toc = bytes(min(255, (self.info_length + offsets[i + (j - i) * k // 100] - offsets[i]) * 256 // size)
+                    for k in range(100))
+        return build_mp3_info_frame(self.header, None, j - i, size, toc)
+
+    def write(self, writer, i, j):
+        if self.tag_length:
+            writer.copy_from(self.source(0), 0, self.tag_length)
+        if self.info_length:
+            writer.write(self.info_frame(i, j))
+        self.copy_ranges(writer, i, j)
+
+
+class AacSplitter(Splitter):
+    """AAC (ADTS): части по фреймам; мусор между сериями фреймов не переносится"""
+
+    def __init__(self, paths, session, cache=None):
+        adts = [index_adts(session.open(path), cache) for path in paths]
+        check_params('AAC', paths, [index.params for index in adts], lambda i: adts[i].describe())
+        self.runs = [index.runs for index in adts]
+        indexes = [self._frames(session.open(path), index, cache) for path, index in zip(paths, adts)]
+        super().__init__(paths, session, indexes, adts[0].sample_rate)
+
+    @staticmethod
+    def _frames(mapped, adts, cache):
+        """Границы фреймов входа по его сериям фреймов; кэшируются в кэше разбора"""
+        runs = adts.runs
+        kind = f"adts-frames:{len(runs)}:{adts.frames}"
+        cached = cache.get(mapped, kind) if cache is not None else None
+        if cached is not None:
+            return SplitIndex.from_bytes(cached)
+        view = mapped.data
+        offsets, positions = array('Q'), array('Q')
+        samples = 0
+        for r in range(0, len(runs), 2):
+            pos, end = runs[r], runs[r] + runs[r + 1]
+            while pos < end:
+                frame_length, _, blocks = parse_adts_header(view, pos, end)
+                offsets.append(pos)
+                positions.append(samples)
+                samples += blocks * AAC_BLOCK_SAMPLES
+                pos += frame_length
+        offsets.append(runs[-2] + runs[-1])
+        positions.append(samples)
+        index = SplitIndex(offsets, positions, adts.sample_rate)
+        if cache is not None:
+            cache.put(mapped, kind, index.to_bytes())
+        return index
+
+    def ranges(self, i, j):
+        """Диапазоны серий фреймов входов между границами i и j"""
+        for s, start, stop in super().ranges(i, j):
+            runs = self.runs[s]
+            for r in range(0, len(runs), 2):
+                run_start, run_end = runs[r], runs[r] + runs[r + 1]
+                if run_end > start and run_start < stop:
+                    yield s, max(start, run_start), min(stop, run_end)
+
+    def part_size(self, i, j):
+        return sum(stop - start for _, start, stop in self.ranges(i, j))
+
+    def write(self, writer, i, j):
+        self.copy_ranges(writer, i, j)
+
+
+class FlacSplitter(Splitter):
+    """FLAC: части по фреймам со своими STREAMINFO и SEEKTABLE; номера фреймов начинаются заново"""
+
+    def __init__(self, paths, session, cache=None):
+        inputs = [FlacInput(session.open(path)) for path in paths]
+        check_params('FLAC', paths, [flac.streaminfo.params() for flac in inputs],
+                     lambda i: "{} Hz, {} ch, {} bit".format(*inputs[i].streaminfo.params()))
+        self.frames = [index_frames(flac, cache) for flac in inputs]
+        self.strategy = frame_strategy(self.frames)
+        indexes = []
+        for flac, frames in zip(inputs, self.frames):
+            offsets = array('Q', frames.offsets)
+            offsets.append(flac.frames_end)
+            positions = array('Q', [0])
+            for block in frames.blocks:
+                positions.append(positions[-1] + block)
+            indexes.append(SplitIndex(offsets, positions, flac.streaminfo.sample_rate))
+        # Метаданные частей - из первого входа; блоки копируются, ведь сеанс может его закрыть
+        self.template = copy.copy(inputs[0])
+        self.template.mapped = None
+        self.template.blocks = [(block_type, bytes(body)) for block_type, body in inputs[0].blocks
+                                if block_type in KEPT_BLOCKS]
+        self.kept_length = sum(4 + len(body) for _, body in self.template.blocks)
+        super().__init__(paths, session, indexes, inputs[0].streaminfo.sample_rate)
+
+    def _number(self, k, i):
+        """Номер k-го фрейма объединения в части, которая начинается с фрейма i"""
+        positions = self.index.positions
+        return k - i if self.strategy == 0 else positions[k] - positions[i]
+
+    def part_size(self, i, j):
+        samples = self.index.positions[j] - self.index.positions[i]
+        points = max(1, -(-samples // (self.index.sample_rate * SEEK_INTERVAL)))
+        size = 4 + 4 + 34 + 4 + 18 * points + self.kept_length + self.index.offsets[j] - self.index.offsets[i]
+        # Оценка сверху: номера растут, поэтому новый номер куска не длиннее последнего, а прежний - не короче первого
+        for s, first, stop in self.pieces(i, j):
+            offsets = self.indexes[s].offsets
+            longest = len(encode_number(self._number(self.starts[s] + stop - 1, i)))
+            shortest = number_length(self.source(s).data[offsets[first] + 4])
+            size += (stop - first) * max(0, longest - shortest)
+        return size
+
+    def write(self, writer, i, j):
+        fixed = self.strategy == 0
+        pieces = list(self.pieces(i, j))
+        frame_samples, frame_offsets, frame_blocks = array('Q'), array('Q'), array('I')
+        unchanged = []
+        out_offset = 0
+        samples = 0
+        frame_number = 0
+        min_frame, max_frame = None, 0
+        for s, first, stop in pieces:
+            frames, offsets = self.frames[s], self.indexes[s].offsets
+            # Кусок, нумерация которого уже совпадает с нумерацией части, переносится одним диапазоном
+            old_number = frames.first_number + (first if fixed else self.indexes[s].positions[first])
+            keep = frames.strategy == self.strategy and old_number == (frame_number if fixed else samples)
+            unchanged.append(keep)
+            view = None if keep else self.source(s).data
+            for k in range(first, stop):
+                size = offsets[k + 1] - offsets[k]
+                if not keep:
+                    size += len(encode_number(frame_number if fixed else samples)) - number_length(view[offsets[k] + 4])
+                frame_samples.append(samples)
+                frame_offsets.append(out_offset)
+                frame_blocks.append(frames.blocks[k])
+                min_frame = size if min_frame is None else min(min_frame, size)
+                max_frame = max(max_frame, size)
+                out_offset += size
+                samples += frames.blocks[k]
+                frame_number += 1
+
+        duration = writer.add_tap('duration', SampleCountTap(self.index.sample_rate))
+        writer.write(build_header(self.template, frame_samples, frame_offsets, frame_blocks, samples,
+                                  min_frame, max_frame))
+        frame_number = 0
+        samples = 0
+        for (s, first, stop), keep in zip(pieces, unchanged):
+            self.enter(s)
+            frames, offsets = self.frames[s], self.indexes[s].offsets
+            mapped = self.source(s)
+            if keep:
+                blocks = sum(frames.blocks[first:stop])
+                writer.copy_from(mapped, offsets[first], offsets[stop] - offsets[first])
+                duration.add(blocks, stop - first)
+                frame_number += stop - first
+                samples += blocks
+                continue
+            flac = copy.copy(self.template)
+            flac.mapped = mapped
+            flac.frames_end = offsets[stop]
+            index = FrameIndex(frames.offsets[first:stop], frames.blocks[first:stop],
+                               frames.header_lengths[first:stop], frames.strategy, 0)
+            frame_number, samples = write_renumbered(writer, flac, index, self.strategy, frame_number,
+                                                     samples, duration)
+
+
+SPLITTERS = {
+    'wav': WavSplitter,
+    'mp3': Mp3Splitter,
+    'flac': FlacSplitter,
+    'aac': AacSplitter,
+}
+
+
+def plan_cuts(splitter, max_bytes=None, max_seconds=None, parts=None):
+    """Границы частей (номера фреймов, от 0 до числа фреймов) по пределам размера и продолжительности"""
+    index = splitter.index
+    count = index.count
+    if parts:
+        # Части равной продолжительности: каждая граница - ближайшая к доле общего числа отсчётов
+        cuts = [0]
+        for k in range(1, parts):
+            target = index.samples * k // parts
+            j = bisect.bisect_left(index.positions, target)
+            if j > 0 and target - index.positions[j - 1] < index.positions[j] - target:
+                j -= 1
+            if cuts[-1] < j < count:
+                cuts.append(j)
+        cuts.append(count)
+        if splitter.max_bytes is not None:
+            for i, j in zip(cuts, cuts[1:]):
+                if splitter.part_size(i, j) > splitter.max_bytes:
+                    raise ValueError(f"Parts would exceed the {splitter.max_bytes}-byte format limit, "
+                                     f"use more parts")
+        return cuts
+
+    if splitter.max_bytes is not None:
+        max_bytes = min(max_bytes or splitter.max_bytes, splitter.max_bytes)
+    max_samples = round(max_seconds * index.sample_rate) if max_seconds else None
+    cuts = [0]
+    i = 0
+    while i < count:
+        j = count
+        if max_samples:
+            # Фрейм длиннее предела всё равно идёт в часть целиком
+            j = min(j, max(i + 1, bisect.bisect_right(index.positions, index.positions[i] + max_samples) - 1))
+        if max_bytes:
+            j = min(j, bisect.bisect_right(index.offsets, index.offsets[i] + max_bytes) - 1)
+            while j > i and splitter.part_size(i, j) > max_bytes:
+                j -= 1
+            if j <= i:
+                raise ValueError(f"Frame {i} does not fit into a {max_bytes}-byte part")
+        cuts.append(j)
+        i = j
+    return cuts
+
+
+class SplitPart:
+    """Записанная часть"""
+
+    def __init__(self, path, bytes, start, duration, sha256, cloned_bytes, copied_bytes, verification=None):
+        self.path = path
+        self.bytes = bytes
+        # Начало части в исходном звуке, секунды
+        self.start = start
+        self.duration = duration
+        self.sha256 = sha256
+        self.cloned_bytes = cloned_bytes
+        self.copied_bytes = copied_bytes
+        self.verification = verification
+
+    def to_dict(self):
+        return {'path': self.path, 'bytes': self.bytes, 'start': self.start, 'duration': self.duration,
+                'sha256': self.sha256, 'cloned_bytes': self.cloned_bytes, 'copied_bytes': self.copied_bytes}
+
+
+def part_paths(path, count, output_dir=None):
+    """Имена частей: <имя>.partNN<расширение> в output_dir или рядом с path"""
+    # Части элемента архива ложатся рядом с архивом
+    member = split_member(path)
+    stem, ext = os.path.splitext(os.path.basename(member[1] if member else path))
+    directory = output_dir or os.path.dirname(os.path.abspath(member[0] if member else path))
+    width = max(2, len(str(count)))
+    return [os.path.join(directory, PART_NAME.format(stem=stem, number=n, width=width, ext=ext))
+            for n in range(1, count + 1)]
+
+
+def manifest_path(path):
+    return os.path.abspath(path) + MANIFEST_SUFFIX
+
+
+def write_manifest(path, fmt, inputs, parts):
+    """Список частей в JSON: имена относительно самого списка, начала и продолжительности частей"""
+    directory = os.path.dirname(os.path.abspath(path))
+    manifest = {
+        'format': fmt,
+        'inputs': [os.path.abspath(input_path) for input_path in inputs],
+        'bytes': sum(part.bytes for part in parts),
+        'duration': sum(part.duration for part in parts),
+        'parts': [{'file': os.path.relpath(part.path, directory), 'bytes': part.bytes, 'start': part.start,
+                   'duration': part.duration, 'sha256': part.sha256} for part in parts],
+    }
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def write_parts(splitter, cuts, paths, use_reflink=True, sidecar=True, verify=False, verify_workers=None,
+                cache=None, taps=None):
+    """Пишет части между границами cuts в файлы paths
+
+    Части пишутся во временные файлы и встают на место вместе, только когда
+    записаны (и проверены) все; при любой ошибке временные файлы удаляются,
+    а прежние части с их .sha256 остаются нетронутыми.
+    """
+    index = splitter.index
+    results = []
+    writers = []
+    try:
+        for part_path, i, j in zip(paths, cuts, cuts[1:]):
+            with OutputWriter(part_path, use_reflink=use_reflink, record_digests=verify, deferred=True) as writer:
+                writers.append(writer)
+                writer.add_tap('sha256', HashTap())
+                for name, tap in (taps or {}).items():
+                    writer.add_tap(name, tap)
+                splitter.write(writer, i, j)
+            verification = None
+            if verify:
+                verification = verify_output(writer.written_path, writer.layout, cache, workers=verify_workers)
+                if not verification.ok:
+                    raise VerificationError(verification)
+                remember_digests(writer.layout, cache, writer.segment_size)
+            start = index.positions[i] / index.sample_rate
+            duration = (index.positions[j] - index.positions[i]) / index.sample_rate
+            results.append(SplitPart(os.path.abspath(part_path), writer.position, start, duration,
+                                     writer.taps['sha256'].hexdigest, writer.cloned_bytes, writer.copied_bytes,
+                                     verification))
+            logging.info(f"Wrote {part_path}: frames {i}-{j}, {writer.position} bytes, {duration:.3f} s")
+        for writer in writers:
+            writer.commit()
+    except BaseException:
+        for writer in writers:
+            writer.discard()
+        raise
+    if sidecar:
+        for part in results:
+            write_sha256_sidecar(part.path, part.sha256)
+    return results
+
+
+def check_targets(paths, sources, overwrite):
+    """Части не должны затирать входы, а без overwrite - и существующие файлы"""
+    sources = {os.path.abspath(source) for source in sources}
+    for part_path in paths:
+        if os.path.abspath(part_path) in sources:
+            raise ValueError("A part file cannot replace an input file")
+        if not overwrite and os.path.exists(part_path):
+            raise FileExistsError(f"Output file already exists: {part_path}")
+
+
+def split_audio(path, max_bytes=None, max_seconds=None, parts=None, output_dir=None, overwrite=True,
+                use_reflink=True, sidecar=True, cache=None, session=None):
+    """Режет файл на части по границам фреймов; возвращает список SplitPart
+
+    Задаётся либо число частей равной продолжительности (parts), либо пределы
+    размера (max_bytes) и/или продолжительности (max_seconds) каждой части.
+    """
+    if parts is not None and (max_bytes or max_seconds):
+        raise ValueError("Give either the number of parts or size/duration limits, not both")
+    if parts is not None and parts < 1:
+        raise ValueError("The number of parts must be positive")
+    if not (parts or max_bytes or max_seconds):
+        raise ValueError("Give the number of parts or a size or duration limit")
+
+    own_session = session is None
+    if own_session:
+        session = MappedSession()
+    own_cache = cache is None
+    if own_cache:
+        from .probecache import ProbeCache
+        cache = ProbeCache()
+    try:
+        mapped = session.open(path)
+        if getattr(mapped, 'streaming', False):
+            raise ValueError(f"{mapped.name} is a stream; splitting needs a file")
+        fmt = detect_format(path, mapped)
+        if fmt not in SPLITTERS:
+            raise ValueError(f"Splitting {fmt} files is not supported (only {', '.join(SPLIT_FORMATS)})")
+        splitter = SPLITTERS[fmt]([path], session, cache)
+        cuts = plan_cuts(splitter, max_bytes, max_seconds, parts)
+        paths = part_paths(path, len(cuts) - 1, output_dir)
+        check_targets(paths, [getattr(mapped, 'file_path', path)], overwrite)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        results = write_parts(splitter, cuts, paths, use_reflink=use_reflink, sidecar=sidecar)
+    finally:
+        if own_session:
+            session.close()
+        if own_cache:
+            cache.close()
+    logging.info(f"Split {path} ({fmt}) into {len(results)} parts")
+    return results
+
+
+def merge_parts(paths, output_path, max_bytes=None, max_seconds=None, session=None, on_file=None,
+                overwrite=True, use_reflink=True, sidecar=True, cache=None, verify=False, verify_workers=None,
+                taps=None):
+    """Объединяет входы сразу частями не больше max_bytes и/или max_seconds; возвращает список SplitPart
+
+    Части называются по output_path (<имя>.partNN<расширение>), рядом с ними
+    пишется их список <результат>.parts.json; сам output_path не создаётся. Каждая
+    часть - самостоятельный файл со своим заголовком. Отводы taps видят
+    данные всех частей по порядку.
+    Поддерживаются те же форматы, что и у split_audio (SPLIT_FORMATS): входы
+    Ogg так не объединяются - части Ogg потребовали бы своих заголовков
+    кодека, номеров страниц и позиций granule, их объединяет только merge_audio.
+    """
+    if not (max_bytes or max_seconds):
+        raise ValueError("Give a size or duration limit for the parts")
+
+    own_session = session is None
+    if own_session:
+        session = MappedSession()
+    own_cache = cache is None
+    if own_cache:
+        from .probecache import ProbeCache
+        cache = ProbeCache()
+    try:
+        formats = {detect_format(path, session.open(path)) for path in paths}
+        fmt = formats.pop() if len(formats) == 1 else 'raw'
+        if fmt not in SPLITTERS:
+            raise ValueError(f"Merging into parts needs {', '.join(SPLIT_FORMATS)} inputs of one format, "
+                             f"not {fmt} (merge Ogg into a single file instead)")
+        # Индексам нужен произвольный доступ: потоки сохраняются во временные файлы
+        for path in paths:
+            session.spool(path, fmt)
+        splitter = SPLITTERS[fmt](paths, session, cache)
+        splitter.on_file = on_file
+        cuts = plan_cuts(splitter, max_bytes, max_seconds)
+        targets = part_paths(output_path, len(cuts) - 1)
+        check_targets(targets, [getattr(session.open(path), 'file_path', path) for path in paths], overwrite)
+        results = write_parts(splitter, cuts, targets, use_reflink=use_reflink, sidecar=sidecar, verify=verify,
+                              verify_workers=verify_workers, cache=cache, taps=taps)
+        write_manifest(manifest_path(output_path), fmt, paths, results)
+    finally:
+        if own_session:
+            session.close()
+        if own_cache:
+            cache.close()
+    logging.info(f"Merged {len(paths)} files into {len(results)} parts of {output_path} ({fmt})")
+    return results
@@ -0,0 +1,223 @@
+"""Входы без произвольного доступа: stdin, каналы и FIFO
+
+Такой вход читается один раз и только вперёд. Заголовки разбираются в
+ограниченном буфере по мере чтения, полезные данные передаются дальше кусками.
+Этапы, которым нужен произвольный доступ (индексы FLAC, Ogg и ADTS, проверка
+результата), получают поток, сохранённый во временный файл.
+"""
+import logging
+import os
+import stat
+import struct
+import sys
+
+from .formats import MP3_SYNC_WINDOW, Payload, find_mp3_frame, id3v2_tag_length, is_mp3_info_frame, parse_wav
+from .mapped import STDIN_PATH, MappedInput
+
+# Сколько данных потока можно держать в буфере, заглядывая вперёд
+STREAM_BUFFER_SIZE = 16 * 1024 * 1024
+
+# Размер одного чтения из потока
+READ_SIZE = 1024 * 1024
+
+# Начальный размер окна для поиска чанка data в заголовке WAV
+WAV_HEADER_WINDOW = 64 * 1024
+
+# Хвост MP3 потока, который придерживается до конца: там могут быть ID3v1 и APEv2
+MP3_TRAILER_WINDOW = 64 * 1024
+
+# Длины данных WAV, которые пишут в поток вместо настоящих, пока длина неизвестна
+WAV_UNKNOWN_LENGTHS = (0, 0xFFFFFFFF)
+
+# Форматы, которые объединяются прямо из потока; остальные сначала сохраняются во временный файл
+STREAM_FORMATS = ('raw', 'wav', 'mp3')
+
+
+def is_stream_path(path):
+    """Вход - stdin ('-'), канал или другой файл без произвольного доступа"""
+    if path == STDIN_PATH:
+        return True
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return False
+    return not stat.S_ISREG(mode) and not stat.S_ISDIR(mode)
+
+
+class StreamInput:
+    """Вход, который читается только вперёд; смещения считаются от начала потока
+
+    Заглянуть вперёд (peek) можно не дальше limit байт; уже прочитанное
+    не возвращается. Размер неизвестен (size = None).
+    """
+
+    streaming = True
+
+    def __init__(self, path, limit=STREAM_BUFFER_SIZE, file=None):
+        self.path = path
+        self.size = None
+        self.limit = limit
+        if file is not None:
+            # Уже открытый поток, например распаковываемый элемент архива
+            self.name = path
+            self.file = file
+        elif path == STDIN_PATH:
+            self.name = '<stdin>'
+            if os.name == 'nt':
+                # В текстовом режиме Windows заменила бы \r\n на \n прямо в аудиоданных
+                import msvcrt
+                msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+            self.file = open(sys.stdin.fileno(), 'rb', buffering=0, closefd=False)
+        else:
+            self.name = path
+            self.file = open(path, 'rb', buffering=0)
+        # Смещение первого байта буфера от начала потока
+        self.position = 0
+        self.buffer = bytearray()
+        self.eof = False
+
+    def _fill(self, length):
+        """Дочитывает буфер до length байт (меньше - только в конце потока)"""
+        if length > self.limit:
+            raise ValueError(f"{self.name}: {length} bytes of lookahead needed, "
+                             f"but the stream buffer holds {self.limit}")
+        while len(self.buffer) < length and not self.eof:
+            chunk = self.file.read(max(READ_SIZE, length - len(self.buffer)))
+            if chunk:
+                self.buffer += chunk
+            else:
+                self.eof = True
+
+    def peek(self, length, offset=0):
+        """length байт с текущего места (плюс offset) без продвижения; у конца потока - меньше"""
+        self._fill(offset + length)
+        return bytes(self.buffer[offset:offset + length])
+
+    def seek(self, offset):
+        """Переход вперёд к смещению offset от начала потока; назад поток не перематывается"""
+        if offset < self.position:
+            raise ValueError(f"Cannot seek back in {self.name}: it is not seekable")
+        skip = offset - self.position
+        while skip:
+            if not self.buffer:
+                self._fill(min(skip, READ_SIZE))
+                if not self.buffer:
+                    raise ValueError(f"{self.name} is truncated: it ended before the end of its data")
+            count = min(skip, len(self.buffer))
+            del self.buffer[:count]
+            self.position += count
+            skip -= count
+
+    def readinto(self, buffer):
+        """Читает с текущего места в buffer; 0 - конец потока"""
+        if self.buffer:
+            count = min(len(buffer), len(self.buffer))
+            buffer[:count] = self.buffer[:count]
+            del self.buffer[:count]
+        elif self.eof:
+            return 0
+        else:
+            # Буфер пуст - читаем сразу в память получателя
+            count = self.file.readinto(buffer) or 0
+            if not count:
+                self.eof = True
+        self.position += count
+        return count
+
+    def chunks(self, holdback=0):
+        """Остаток потока кусками, кроме holdback последних байтов - они остаются в буфере"""
+        while True:
+            self._fill(READ_SIZE + holdback)
+            count = len(self.buffer) - holdback
+            if count <= 0:
+                return
+            chunk = bytes(self.buffer[:count])
+            del self.buffer[:count]
+            self.position += count
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+class SpooledInput(MappedInput):
+    """Поток, сохранённый во временный файл; файл удаляется при закрытии"""
+
+    spooled = True
+
+    def __init__(self, temp_path, name):
+        super().__init__(temp_path)
+        self.name = name
+
+    def close(self):
+        super().close()
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            logging.warning(f"Could not remove temporary file {self.path}: {str(e)}")
+
+
+def spool(src, fmt='raw'):
+    """Сохраняет поток во временный файл и отображает его в память
+
+    Поток должен быть ещё не прочитан: заглядывание вперёд (peek) допустимо.
+    Временный файл получает расширение формата, чтобы его распознали по имени.
+    """
+    if src.position:
+        raise ValueError(f"{src.name} was partly read and cannot be spooled")
+    import tempfile
+
+    suffix = os.path.splitext(src.path)[1] or ('' if fmt == 'raw' else '.' + fmt)
+    fd, temp_path = tempfile.mkstemp(prefix='smerge-', suffix=suffix)
+    try:
+        with open(fd, 'wb') as out:
+            out.write(src.buffer)
+            while True:
+                chunk = src.file.read(READ_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+        spooled = SpooledInput(temp_path, src.name)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    finally:
+        src.close()
+    logging.info(f"Spooled {src.name} to {temp_path} ({spooled.size} bytes)")
+    return spooled
+
+
+def stream_payload(src, fmt):
+    """Полезные данные потока по заголовкам в буфере; None, если длина WAV не указана"""
+    if fmt == 'wav':
+        window = WAV_HEADER_WINDOW
+        while True:
+            head = src.peek(window)
+            try:
+                info = parse_wav(memoryview(head))
+                break
+            except ValueError:
+                # Чанк data может начинаться за окном (большие LIST и прочие чанки)
+                if len(head) < window or window * 4 > src.limit:
+                    raise
+                window *= 4
+        # parse_wav обрезает длину по размеру окна - берём объявленную
+        declared = struct.unpack_from('<I', head, info.data_offset - 4)[0]
+        if declared in WAV_UNKNOWN_LENGTHS:
+            return None
+        return Payload(info.data_offset, declared, info)
+    if fmt == 'mp3':
+        tag_length = 0
+        while True:
+            length = id3v2_tag_length(src.peek(10, tag_length))
+            if not length:
+                break
+            tag_length += length
+        head = memoryview(src.peek(tag_length + MP3_SYNC_WINDOW + 4))
+        start, frame = find_mp3_frame(head, tag_length, len(head))
+        if start is None:
+            return Payload(tag_length, None, tag_length=tag_length)
+        if is_mp3_info_frame(head, start, frame[0]):
+            start += frame[0]
+        return Payload(start, None, frame, tag_length=tag_length)
+    return Payload(0, None)
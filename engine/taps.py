@@ -0,0 +1,229 @@
+"""Отводы (taps): обработчики, которые видят каждый записанный кусок результата
+
+Все сведения о результате (хеш, продолжительность, пики) собираются за тот же
+проход, которым он пишется, поэтому выходной файл не нужно перечитывать.
+"""
+import hashlib
+import os
+import struct
+
+from .formats import id3v2_length, is_mp3_info_frame, parse_mp3_header
+
+
+class Tap:
+    """Базовый отвод: получает данные в порядке записи"""
+
+    def feed(self, data):
+        """Очередной записанный кусок (bytes или memoryview, действителен только во время вызова)"""
+
+    def finish(self):
+        """Вызывается после последней записи"""
+
+
+class HashTap(Tap):
+    """Инкрементальный SHA-256 результата"""
+
+    def __init__(self):
+        self.hash = hashlib.sha256()
+        self.hexdigest = None
+
+    def feed(self, data):
+        self.hash.update(data)
+
+    def finish(self):
+        self.hexdigest = self.hash.hexdigest()
+
+
+class PayloadTap(Tap):
+    """Отвод, которому нужны только полезные данные: пропускает заголовок и всё после limit байт"""
+
+    def __init__(self, skip=0, limit=None):
+        self.skip = skip
+        self.limit = limit
+
+    def feed(self, data):
+        view = memoryview(data)
+        if self.skip:
+            if self.skip >= len(view):
+                self.skip -= len(view)
+                return
+            view = view[self.skip:]
+            self.skip = 0
+        if self.limit is not None:
+            if not self.limit:
+                return
+            view = view[:self.limit]
+            self.limit -= len(view)
+        self.feed_payload(view)
+
+    def feed_payload(self, view):
+        """Очередной кусок полезных данных"""
+
+
+class SizeDurationTap(Tap):
+    """Оценка продолжительности по объёму данных (для форматов без разбора фреймов)"""
+
+    def __init__(self, bitrate=128):
+        self.bitrate = bitrate
+        self.total = 0
+        self.duration = None
+
+    def feed(self, data):
+        self.total += len(data)
+
+    def finish(self):
+        self.duration = (self.total * 8) / (self.bitrate * 1000)
+
+
+class PcmDurationTap(PayloadTap):
+    """Продолжительность PCM: количество целых сэмпл-фреймов в данных"""
+
+    def __init__(self, block_align, sample_rate, skip=0, limit=None):
+        super().__init__(skip, limit)
+        self.block_align = block_align
+        self.sample_rate = sample_rate
+        self.total = 0
+        self.frames = 0
+        self.duration = None
+
+    def feed_payload(self, view):
+        self.total += len(view)
+
+    def finish(self):
+        self.frames = self.total // self.block_align
+        self.duration = self.frames / self.sample_rate
+
+
+class Mp3DurationTap(Tap):
+    """Точная продолжительность MP3: подсчёт фреймов в потоке по мере записи"""
+
+    def __init__(self):
+        self.started = False
+        self.skip = 0
+        self.carry = b''
+        self.frames = 0
+        self.samples = 0
+        self.sample_rate = None
+        self.duration = None
+
+    def feed(self, data):
+        view = memoryview(data)
+        if not self.started:
+            if len(view) < 10:
+                self.carry += bytes(view)
+                if len(self.carry) < 10:
+                    return
+                view = memoryview(self.carry)
+                self.carry = b''
+            self.started = True
+            # Ведущий ID3v2 тег не содержит аудиофреймов
+            self.skip = id3v2_length(view)
+
+        if self.carry:
+            # Заголовок фрейма разрезан границей кусков - досматриваем его на склейке
+            joined = self.carry + bytes(view[:16])
+            if len(joined) < 4:
+                self.carry = joined
+                return
+            pos = self._walk(joined, 0, len(self.carry))
+            if pos < len(self.carry):
+                self.carry = joined[pos:]
+                return
+            self.skip = pos - len(self.carry)
+            self.carry = b''
+
+        pos = self._walk(view, self.skip, len(view))
+        if pos >= len(view):
+            self.skip = pos - len(view)
+        else:
+            self.skip = 0
+            self.carry = bytes(view[pos:])
+
+    def _walk(self, buf, pos, stop):
+        """Проходит по фреймам, начинающимся до stop; возвращает позицию следующего заголовка"""
+        end = len(buf)
+        while pos < stop:
+            if pos + 4 > end:
+                break
+            frame = parse_mp3_header(struct.unpack_from('>I', buf, pos)[0])
+            if frame is None:
+                # Мусор между фреймами - ищем синхронизацию дальше
+                pos += 1
+                continue
+            length, samples, sample_rate = frame
+            if self.frames == 0 and pos + length <= end and is_mp3_info_frame(buf, pos, length):
+                # Служебный фрейм Xing/Info не содержит звука
+                pos += length
+                continue
+            self.frames += 1
+            self.samples += samples
+            if self.sample_rate is None:
+                self.sample_rate = sample_rate
+            pos += length
+        return pos
+
+    def finish(self):
+        self.duration = self.samples / self.sample_rate if self.sample_rate else 0.0
+
+
+class SampleCountTap(Tap):
+    """Продолжительность по фреймам, которые движок пересчитывает сам во время записи"""
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.frames = 0
+        self.samples = 0
+        self.duration = None
+
+    def feed(self, data):
+        pass
+
+    def add(self, samples, frames=1):
+        self.samples += samples
+        self.frames += frames
+
+    def finish(self):
+        self.duration = self.samples / self.sample_rate if self.sample_rate else 0.0
+
+
+class ProgressTap(Tap):
+    """Сообщает число записанных байт не чаще, чем раз в step байт"""
+
+    def __init__(self, callback, step=1):
+        self.callback = callback
+        self.step = max(1, step)
+        self.bytes = 0
+        self.reported = 0
+
+    def feed(self, data):
+        self.bytes += len(data)
+        if self.bytes - self.reported >= self.step:
+            self.reported = self.bytes
+            self.callback(self.bytes)
+
+    def finish(self):
+        if self.bytes != self.reported:
+            self.reported = self.bytes
+            self.callback(self.bytes)
+
+
+class PeakTap(PayloadTap):
+    """Пики PCM: передаёт полезные данные построителю пиков (engine.peaks.PeakBuilder)"""
+
+    def __init__(self, builder, skip=0, limit=None):
+        super().__init__(skip, limit)
+        self.builder = builder
+
+    def feed_payload(self, view):
+        self.builder.feed(view)
+
+    def finish(self):
+        self.builder.finish()
+
+
+def write_sha256_sidecar(output_path, hexdigest):
+    """Пишет рядом с результатом файл .sha256 в формате sha256sum"""
+    sidecar_path = f"{output_path}.sha256"
+    with open(sidecar_path, 'w', encoding='utf-8') as f:
+        f.write(f"{hexdigest} *{os.path.basename(output_path)}\n")
+    return sidecar_path
@@ -0,0 +1,133 @@
+"""Запись одного результата сразу в несколько мест
+
+Основной результат пишется как обычно (с клонированием и copy_file_range),
+а каждый записанный кусок через отвод попадает в очередь копии. У каждой
+копии свой поток записи и своя очередь, ограниченная по объёму: медленное
+место (сетевой диск) отстаёт от быстрого не больше чем на этот объём, после
+чего запись результата ждёт его. Входы при этом читаются один раз.
+"""
+import collections
+import mmap
+import os
+import threading
+
+from .taps import Tap
+from .writer import open_output, remove_file, temp_output_path
+
+# Сколько данных может ждать записи в каждую копию
+DEFAULT_MIRROR_BUFFER = 64 * 1024 * 1024
+
+
+def mirror_paths(output_path, mirrors, streaming=False):
+    """Пути копий; копия в папку получает имя основного результата"""
+    paths = []
+    for mirror in mirrors:
+        if os.path.isdir(mirror):
+            if streaming:
+                raise ValueError(f"Mirror {mirror} is a folder, but the output has no file name")
+            mirror = os.path.join(mirror, os.path.basename(output_path))
+        paths.append(mirror)
+    absolute = [os.path.abspath(path) for path in paths]
+    if len(set(absolute)) != len(absolute) or (not streaming and os.path.abspath(output_path) in absolute):
+        raise ValueError("Output mirrors must be different files")
+    return paths
+
+
+class MirrorTap(Tap):
+    """Копия результата в другом файле: куски пишет отдельный поток из ограниченной очереди
+
+    Срезы отображённых входов ставятся в очередь без копирования, прочие
+    данные (заголовки, буфер копирования) копируются. Ошибка записи копии
+    прерывает объединение при следующем куске.
+    """
+
+    def __init__(self, path, buffer_size=DEFAULT_MIRROR_BUFFER):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.bytes = 0
+        self.error = None
+        self.chunks = collections.deque()
+        self.pending = 0
+        self.done = False
+        self.condition = threading.Condition()
+        # Как и основной результат, копия пишется во временный файл рядом и ставится на место в commit()
+        self.temp_path = temp_output_path(path)
+        self.file = open_output(path, self.temp_path)
+        if self.file.name != self.temp_path:
+            # Канал или устройство пишутся напрямую и при отмене не удаляются
+            self.temp_path = None
+        self.thread = threading.Thread(target=self._run, name=f"smerge-mirror-{os.path.basename(path)}",
+                                       daemon=True)
+        self.thread.start()
+
+    def feed(self, data):
+        if not (isinstance(data, memoryview) and isinstance(data.obj, mmap.mmap)):
+            data = bytes(data)
+        with self.condition:
+            # Пустая очередь принимает кусок любого размера, иначе ждём места
+            while self.pending and self.pending + len(data) > self.buffer_size and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise OSError(f"Could not write mirror {self.path}: {str(self.error)}")
+            self.chunks.append(data)
+            self.pending += len(data)
+            self.condition.notify_all()
+
+    def _run(self):
+        fd = self.file.fileno()
+        while True:
+            with self.condition:
+                while not self.chunks and not self.done:
+                    self.condition.wait()
+                if not self.chunks:
+                    return
+                data = self.chunks[0]
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+            except OSError as e:
+                with self.condition:
+                    self.error = e
+                    self.chunks.clear()
+                    self.pending = 0
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.chunks.popleft()
+                self.pending -= len(data)
+                self.bytes += len(data)
+                self.condition.notify_all()
+
+    @property
+    def written_path(self):
+        """Файл, в который идёт запись: временный до commit(), затем сама копия"""
+        return self.temp_path or self.path
+
+    def finish(self):
+        """Дожидается записи всей очереди"""
+        with self.condition:
+            self.done = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.file.close()
+
+    def commit(self):
+        """Ставит записанную копию на место"""
+        if self.temp_path is not None:
+            os.replace(self.temp_path, self.path)
+            self.temp_path = None
+
+    def abort(self):
+        """Прерывает копию: очередь отбрасывается, неполный файл удаляется, прежний остаётся"""
+        with self.condition:
+            self.chunks.clear()
+            self.pending = 0
+            self.done = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.file.close()
+        if self.temp_path is not None:
+            remove_file(self.temp_path)
+            self.temp_path = None
@@ -0,0 +1,101 @@
+"""Иерархическое объединение очень больших наборов входов
+
+Входы делятся на группы по fanout файлов; группы параллельно объединяются во
+временные файлы рядом с результатом, и уровень повторяется, пока файлов не
+останется не больше fanout. Последнюю склейку выполняет обычный движок:
+промежуточные файлы лежат на той же файловой системе, что и результат, поэтому
+их данные переносятся клонированием или copy_file_range. Каждое объединение
+держит открытыми не больше fanout входов - и десятки тысяч файлов укладываются
+в предел дескрипторов процесса.
+"""
+import logging
+import os
+import threading
+
+# Сколько входов объединяется в один промежуточный файл
+DEFAULT_FANOUT = 256
+
+# Форматы, движки которых держат все входы открытыми до конца объединения
+HOLDING_FORMATS = ('wav', 'flac', 'ogg', 'aac')
+
+
+def default_workers():
+    return min(4, os.cpu_count() or 1)
+
+
+def needs_tree(fmt, paths, session):
+    """Прямое объединение вышло бы за предел открытых входов сеанса"""
+    return fmt in HOLDING_FORMATS and len(paths) > session.max_open
+
+
+def build_levels(paths, session, directory=None, fanout=None, workers=None, on_file=None, **options):
+    """Объединяет входы группами в промежуточные файлы, пока их не станет не больше fanout
+
+    Возвращает (пути промежуточных файлов, [(номер, путь) первого входа каждого]).
+    Файлы добавлены в сеанс как временные и удаляются при его закрытии. Группы
+    объединяются merge_audio с options (use_reflink, verify, cache, ...);
+    on_file(номер, путь) вызывается по входам нижнего уровня по мере их записи.
+    """
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .concat import merge_audio
+    from .streams import SpooledInput
+
+    workers = workers or default_workers()
+    # Параллельные группы вместе не должны держать открытыми больше входов, чем сеанс
+    fanout = max(2, min(fanout or DEFAULT_FANOUT, session.max_open // workers))
+    suffix = os.path.splitext(paths[0])[1]
+    lock = threading.Lock()
+    created = []
+    done = [0]
+
+    def report(path):
+        # Номера сквозные по всем входам, а группы пишутся параллельно - вызовы по одному
+        with lock:
+            done[0] += 1
+            on_file(done[0], path)
+
+    def merge_group(group, leaf):
+        fd, temp_path = tempfile.mkstemp(prefix='.smerge-tree-', suffix=suffix, dir=directory)
+        os.close(fd)
+        with lock:
+            created.append(temp_path)
+        progress = (lambda i, path: report(path)) if leaf and on_file else None
+        merge_audio(group, temp_path, on_file=progress, sidecar=False, peaks=False, tree=False, **options)
+        return temp_path
+
+    # Группы открывают входы в своих сеансах - отображения этого сеанса им только мешают
+    session.close_idle()
+    level = list(paths)
+    spans = [(i, path) for i, path in enumerate(paths, 1)]
+    depth = 0
+    try:
+        while len(level) > fanout:
+            groups = range(0, len(level), fanout)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(merge_group, level[start:start + fanout], depth == 0) for start in groups]
+                try:
+                    merged = [future.result() for future in futures]
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            if depth:
+                for path in level:
+                    os.remove(path)
+            logging.info(f"Tree merge level {depth + 1}: {len(level)} files into {len(merged)}")
+            spans = [spans[start] for start in groups]
+            level = merged
+            depth += 1
+    except BaseException:
+        for path in created:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        raise
+    if depth:
+        for path in level:
+            session.adopt(path, SpooledInput(path, path))
+    return level, spans
@@ -0,0 +1,177 @@
+"""Проверка результата: параллельное перечитывание сегментов и сравнение хешей с входами"""
+import hashlib
+import logging
+import os
+import time
+
+from .writer import COPY_BUFFER_SIZE, SEGMENT_SIZE
+
+
+class VerificationError(Exception):
+    """Результат не совпадает с задуманной склейкой входов"""
+
+    def __init__(self, report):
+        mismatch = report.mismatch
+        if mismatch.reason == 'size':
+            where = "unexpected output size"
+        elif mismatch.source:
+            where = f"input {os.path.basename(mismatch.source)} at offset {mismatch.source_offset}"
+        else:
+            where = "generated header data"
+        super().__init__(f"Output differs at offset {mismatch.output_offset} ({where})")
+        self.report = report
+
+
+class Segment:
+    """Сегмент результата, который проверяется одним заданием"""
+
+    def __init__(self, offset, length, source, source_offset, digest):
+        self.offset = offset
+        self.length = length
+        self.source = source
+        self.source_offset = source_offset
+        self.digest = digest
+
+
+class Mismatch:
+    """Первое расхождение: смещение в результате и соответствующее место во входе"""
+
+    def __init__(self, output_offset, source, source_offset, reason='content'):
+        self.output_offset = output_offset
+        self.source = source
+        self.source_offset = source_offset
+        self.reason = reason
+
+
+class VerifyReport:
+    """Итог проверки"""
+
+    def __init__(self):
+        self.ok = True
+        self.segments = 0
+        self.bytes = 0
+        # Синтезированные участки без запомненного хеша проверить не с чем
+        self.unverified_bytes = 0
+        self.mismatch = None
+        self.seconds = 0.0
+
+
+def hash_range(path, offset, length):
+    """SHA-256 диапазона файла (собственный дескриптор - задания идут параллельно)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb', buffering=0) as f:
+        f.seek(offset)
+        buffer = bytearray(min(length, COPY_BUFFER_SIZE) or 1)
+        view = memoryview(buffer)
+        while length:
+            count = f.readinto(view[:min(length, len(view))])
+            if not count:
+                break
+            digest.update(view[:count])
+            length -= count
+    return digest.digest()
+
+
+def source_digest_kind(offset, length):
+    """Вид записи кэша разбора для хеша диапазона входа"""
+    return f"sha256:{offset}:{length}"
+
+
+def split_layout(layout, segment_size):
+    """Режет участки разметки на сегменты размером не больше segment_size"""
+    segments = []
+    for extent in layout:
+        for index, start in enumerate(range(0, extent.length, segment_size)):
+            length = min(segment_size, extent.length - start)
+            recorded = extent.segment_size == segment_size and index < len(extent.digests)
+            digest = extent.digests[index] if recorded else None
+            segments.append(Segment(extent.offset + start, length, extent.source,
+                                    extent.source_offset + start, digest))
+    return segments
+
+
+def remember_digests(layout, cache, segment_size):
+    """Сохраняет в кэш разбора хеши диапазонов входов, посчитанные во время записи"""
+    for segment in split_layout(layout, segment_size):
+        if segment.source and segment.digest:
+            cache.put(segment.source, source_digest_kind(segment.source_offset, segment.length), segment.digest)
+
+
+def expected_digest(segment, cache):
+    """Хеш, который должен получиться у сегмента результата"""
+    if segment.digest is not None or segment.source is None:
+        return segment.digest
+    kind = source_digest_kind(segment.source_offset, segment.length)
+    digest = cache.get(segment.source, kind) if cache is not None else None
+    if digest is None:
+        digest = hash_range(segment.source, segment.source_offset, segment.length)
+        if cache is not None:
+            cache.put(segment.source, kind, digest)
+    return digest
+
+
+def first_difference(output_path, segment):
+    """Точное смещение первого различающегося байта внутри сегмента"""
+    if segment.source is None:
+        return segment.offset, 0
+    with open(output_path, 'rb') as out, open(segment.source, 'rb') as src:
+        out.seek(segment.offset)
+        src.seek(segment.source_offset)
+        done = 0
+        while done < segment.length:
+            count = min(COPY_BUFFER_SIZE, segment.length - done)
+            a = out.read(count)
+            b = src.read(count)
+            if a != b:
+                for i in range(min(len(a), len(b))):
+                    if a[i] != b[i]:
+                        break
+                else:
+                    i = min(len(a), len(b))
+                return segment.offset + done + i, segment.source_offset + done + i
+            done += count
+    return segment.offset, segment.source_offset
+
+
+def verify_output(output_path, layout, cache=None, workers=None, segment_size=SEGMENT_SIZE):
+    """Перечитывает результат параллельными сегментами и сравнивает с ожидаемыми хешами"""
+    workers = workers or min(8, os.cpu_count() or 1)
+    started = time.monotonic()
+    report = VerifyReport()
+    segments = split_layout(layout, segment_size)
+    report.segments = len(segments)
+
+    def check(segment):
+        expected = expected_digest(segment, cache)
+        if expected is None:
+            return segment, None
+        return segment, hash_range(output_path, segment.offset, segment.length) == expected
+
+    actual_size = os.path.getsize(output_path)
+    expected_size = sum(extent.length for extent in layout)
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # map отдаёт результаты по порядку, значит первое расхождение - самое раннее
+        for segment, matched in pool.map(check, segments):
+            if matched is None:
+                report.unverified_bytes += segment.length
+            elif not matched:
+                report.ok = False
+                output_offset, source_offset = first_difference(output_path, segment)
+                report.mismatch = Mismatch(output_offset, segment.source, source_offset)
+                pool.shutdown(wait=False, cancel_futures=True)
+                break
+            report.bytes += segment.length
+
+    if report.ok and actual_size != expected_size:
+        report.ok = False
+        report.mismatch = Mismatch(min(actual_size, expected_size), None, 0, reason='size')
+
+    report.seconds = time.monotonic() - started
+    if report.ok:
+        logging.info(f"Verified {output_path}: {report.segments} segments, {report.bytes} bytes "
+                     f"in {report.seconds:.2f}s")
+    else:
+        logging.error(f"Verification of {output_path} failed at offset {report.mismatch.output_offset}")
+    return report
@@ -0,0 +1,274 @@
+"""Виртуальный результат объединения: файл только для чтения поверх входов, без записи на диск
+
+    plan = MergePlan(paths, 'merged.wav')
+    with VirtualMerge(plan) as merged:
+        merged.seek(merged.size // 2)
+        data = merged.read(65536)
+
+Движок объединения выполняется с записывающим разметку writer'ом: вместо байтов
+запоминается, какой диапазон какого входа лежит по каждому смещению результата.
+Синтезированные данные (заголовки) хранятся в памяти. Чтение по смещению -
+двоичный поиск по упорядоченному массиву начал участков, O(log n) на seek.
+"""
+import bisect
+import io
+import logging
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+from .api import DuplicateInputsError
+from .concat import ENGINES
+
+# Сколько входов держать открытыми одновременно
+HANDLE_POOL_SIZE = 32
+
+# Предел синтезированных данных в памяти: Ogg и перенумерованный FLAC переписывают
+# почти весь поток, и такой результат без записи не собрать
+LITERAL_LIMIT = 64 * 1024 * 1024
+
+# Источник участка, данные которого лежат в памяти, а не во входе
+LITERAL = -1
+
+
+class LayoutRecorder:
+    """Writer для движков, который не пишет, а запоминает разметку результата"""
+
+    def __init__(self, literal_limit=LITERAL_LIMIT):
+        self.position = 0
+        self.taps = {}
+        self.literal_limit = literal_limit
+        # Участки: начало в результате, номер входа (или LITERAL) и смещение во входе или в literals
+        self.starts = array('Q')
+        self.sources = array('l')
+        self.offsets = array('Q')
+        self.literals = bytearray()
+        self.paths = []
+        self.stamps = []
+        self._path_ids = {}
+
+    def add_tap(self, name, tap):
+        # Данные через writer не проходят - отводы получают только то, что движок сообщает сам
+        self.taps[name] = tap
+        return tap
+
+    def write(self, data):
+        if len(self.literals) + len(data) > self.literal_limit:
+            raise ValueError("This merge rewrites the audio data itself and cannot be served "
+                             "without writing the output")
+        self._extend(LITERAL, len(self.literals), len(data))
+        self.literals += data
+
+    def copy_from(self, src, offset, length):
+        if length <= 0:
+            return
+        if getattr(src, 'streaming', False):
+            raise ValueError(f"{src.name} is a stream and cannot be read at random offsets")
+        if getattr(src, 'spooled', False):
+            # Временная копия потока удаляется вместе с сеансом плана
+            raise ValueError(f"{src.name} is only available as a temporary copy of a stream")
+        # Элемент архива без сжатия читается прямо из файла архива
+        path = getattr(src, 'file_path', src.path)
+        source = self._path_ids.get(path)
+        if source is None:
+            source = self._path_ids[path] = len(self.paths)
+            self.paths.append(path)
+            self.stamps.append(src.stamp)
+        self._extend(source, offset + getattr(src, 'base', 0), length)
+
+    def copy_stream(self, src, offset, holdback=0, trim=None):
+        raise ValueError(f"{src.name} is a stream and cannot be read at random offsets")
+
+    def _extend(self, source, offset, length):
+        """Продолжает последний участок, если кусок к нему примыкает, иначе открывает новый"""
+        if self.starts:
+            last = len(self.starts) - 1
+            if (self.sources[last] == source
+                    and self.offsets[last] + (self.position - self.starts[last]) == offset):
+                self.position += length
+                return
+        self.starts.append(self.position)
+        self.sources.append(source)
+        self.offsets.append(offset)
+        self.position += length
+
+
+class PooledFile:
+    """Открытый вход пула: refs - сколько чтений идёт сейчас, такой файл не вытесняется"""
+
+    def __init__(self, file):
+        self.file = file
+        self.refs = 0
+        # Без preadv чтение - это seek и readinto, их нельзя перемежать между потоками
+        self.seek_lock = threading.Lock()
+
+
+class HandlePool:
+    """Открытые входы с вытеснением давно не читавшихся (LRU)
+
+    Блокировка пула нужна только для открытия и учёта; само чтение (pread)
+    идёт без неё, параллельно в разных потоках. Читаемый файл закреплён
+    счётчиком и не закрывается, даже если пул на время превышает size.
+    """
+
+    def __init__(self, paths, stamps, size=HANDLE_POOL_SIZE):
+        self.paths = paths
+        self.stamps = stamps
+        self.size = max(1, size)
+        self.lock = threading.Lock()
+        self._files = OrderedDict()
+        self.closed = False
+
+    def read_into(self, source, offset, view):
+        """Заполняет view данными входа source с offset"""
+        with self.lock:
+            entry = self._acquire(source)
+        try:
+            fd = entry.file.fileno()
+            filled = 0
+            while filled < len(view):
+                if hasattr(os, 'preadv'):
+                    count = os.preadv(fd, [view[filled:]], offset + filled)
+                else:
+                    with entry.seek_lock:
+                        entry.file.seek(offset + filled)
+                        count = entry.file.readinto(view[filled:])
+                if not count:
+                    raise ValueError(f"{self.paths[source]} is truncated: it ended before the end of its data")
+                filled += count
+        finally:
+            with self.lock:
+                entry.refs -= 1
+                self._trim()
+
+    def _acquire(self, source):
+        """Открытый вход source, закреплённый до конца чтения"""
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        entry = self._files.get(source)
+        if entry is not None:
+            self._files.move_to_end(source)
+            entry.refs += 1
+            return entry
+        path = self.paths[source]
+        file = open(path, 'rb', buffering=0)
+        st = os.fstat(file.fileno())
+        if (st.st_size, st.st_mtime_ns) != self.stamps[source]:
+            file.close()
+            raise ValueError(f"Input file changed since the merge was planned: {path}")
+        entry = self._files[source] = PooledFile(file)
+        entry.refs += 1
+        self._trim()
+        return entry
+
+    def _trim(self):
+        """Закрывает давно не читавшиеся входы сверх size (и все после close), кроме читаемых сейчас"""
+        limit = 0 if self.closed else self.size
+        if len(self._files) <= limit:
+            return
+        for source, entry in list(self._files.items()):
+            if len(self._files) <= limit:
+                break
+            if not entry.refs:
+                del self._files[source]
+                entry.file.close()
+
+    def close(self):
+        with self.lock:
+            # Читаемые сейчас файлы закроются, когда их чтение закончится
+            self.closed = True
+            self._trim()
+
+
+class VirtualMerge(io.RawIOBase):
+    """Результат объединения как файл только для чтения: ни одного байта не записывается
+
+    Строится из MergePlan (engine.api). Участки результата ищутся двоичным
+    поиском, входы открываются через пул на handles файлов. read_range читает
+    по смещению, не трогая текущую позицию, и годится для запросов HTTP Range
+    из нескольких потоков.
+    """
+
+    def __init__(self, plan, handles=HANDLE_POOL_SIZE):
+        super().__init__()
+        if plan.duplicates and not plan.options.allow_duplicates:
+            raise DuplicateInputsError(plan.duplicates)
+        self.name = plan.output
+        self.format = plan.format
+        self.duration = plan.duration
+        recorder = LayoutRecorder()
+        try:
+            ENGINES[plan.format](plan.paths, recorder, plan.session, cache=plan.options.cache)
+        finally:
+            # Отображения входов больше не нужны: данные читаются через пул
+            if plan.own_session:
+                plan.session.close()
+        self.size = recorder.position
+        # Последнее начало - конец результата: длина участка i = starts[i + 1] - starts[i]
+        self.starts = recorder.starts
+        self.starts.append(self.size)
+        self.sources = recorder.sources
+        self.offsets = recorder.offsets
+        self.literals = bytes(recorder.literals)
+        self.pool = HandlePool(recorder.paths, recorder.stamps, handles)
+        self.position = 0
+        logging.info(f"Virtual merge of {len(plan.paths)} files: {self.size} bytes in "
+                     f"{len(self.sources)} extents, {len(self.literals)} bytes in memory")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"Invalid whence: {whence}")
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self.position = offset
+        return offset
+
+    def readinto(self, buffer):
+        count = self.read_into_at(self.position, buffer)
+        self.position += count
+        return count
+
+    def read_range(self, offset, length):
+        """length байт результата с offset (меньше - у конца); текущая позиция не меняется"""
+        buffer = bytearray(max(0, min(length, self.size - offset)))
+        count = self.read_into_at(offset, buffer)
+        return bytes(buffer[:count])
+
+    def read_into_at(self, offset, buffer):
+        """Заполняет buffer данными результата с offset; возвращает число байт"""
+        view = memoryview(buffer).cast('B')
+        want = max(0, min(len(view), self.size - offset))
+        i = bisect.bisect_right(self.starts, offset) - 1
+        filled = 0
+        while filled < want:
+            start = self.starts[i]
+            take = min(self.starts[i + 1] - offset, want - filled)
+            source = self.sources[i]
+            position = self.offsets[i] + (offset - start)
+            if source == LITERAL:
+                view[filled:filled + take] = self.literals[position:position + take]
+            else:
+                self.pool.read_into(source, position, view[filled:filled + take])
+            filled += take
+            offset += take
+            i += 1
+        return filled
+
+    def close(self):
+        if not self.closed:
+            self.pool.close()
+        super().close()
@@ -0,0 +1,229 @@
+"""Наблюдение за папкой: готовые наборы сегментов объединяются автоматически
+
+Каждый подкаталог наблюдаемой папки - набор сегментов (например, запись одного
+рекордера). Набор считается готовым, когда его снимок (имена, размеры, mtime)
+не менялся в течение окна тишины. Тогда он объединяется в естественном порядке
+имён в <каталог результатов>/<имя набора><расширение>.
+
+Уже объединённые наборы хранятся в небольшой базе состояния (SQLite) вместе с
+отпечатком снимка: после перезапуска они не объединяются заново, а набор,
+в который добавились сегменты, объединяется ещё раз.
+
+На Linux изменения будят цикл через inotify (ctypes); иначе папка опрашивается
+через os.scandir с заданным интервалом.
+"""
+import hashlib
+import logging
+import os
+import select
+import time
+
+from .api import MergeOptions, merge
+from .inputs import is_audio_file
+
+STATE_FILENAME = ".smerge-watch.sqlite"
+
+# Маска inotify: появление, завершение записи, переименование и удаление файлов и каталогов
+# (IN_MODIFY не нужен: пока сегмент пишется, набор всё равно не готов)
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# Наибольшее время ожидания событий inotify без незавершённых наборов
+IDLE_WAIT = 300.0
+
+
+class Inotify:
+    """inotify через ctypes: используется только как сигнал "пора пересканировать\""""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watched = set()
+
+    def add(self, path):
+        if path in self.watched:
+            return
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK) >= 0:
+            self.watched.add(path)
+
+    def wait(self, timeout):
+        """Ждёт событий не дольше timeout; события вычитываются целиком"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_notifier():
+    """inotify, если он доступен, иначе None (остаётся опрос)"""
+    if not hasattr(select, 'select') or os.name != 'posix':
+        return None
+    try:
+        return Inotify()
+    except (OSError, AttributeError) as e:
+        logging.info(f"inotify is unavailable, polling instead: {str(e)}")
+        return None
+
+
+def snapshot(path):
+    """Снимок набора: отсортированные (имя, размер, mtime_ns) аудиофайлов каталога"""
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file() and is_audio_file(entry.name):
+                stat = entry.stat()
+                entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(entries))
+
+
+def fingerprint(entries):
+    return hashlib.sha256(repr(entries).encode('utf-8')).hexdigest()
+
+
+class WatchState:
+    """База состояния: отпечаток последнего объединения каждого набора и его итог"""
+
+    def __init__(self, path):
+        import sqlite3
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS merged ("
+            " folder TEXT PRIMARY KEY, fingerprint TEXT, output TEXT, sha256 TEXT, error TEXT, merged_at REAL)"
+        )
+        self.db.commit()
+
+    def fingerprint(self, folder):
+        row = self.db.execute("SELECT fingerprint FROM merged WHERE folder = ?", (folder,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, folder, fingerprint, output, sha256=None, error=None):
+        self.db.execute(
+            "INSERT OR REPLACE INTO merged (folder, fingerprint, output, sha256, error, merged_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (folder, fingerprint, output, sha256, error, time.time())
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class FolderWatcher:
+    """Находит готовые наборы в подкаталогах root и объединяет их"""
+
+    def __init__(self, root, output_dir=None, settle=30.0, interval=5.0, state_path=None, options=None):
+        self.root = os.path.abspath(root)
+        self.output_dir = os.path.abspath(output_dir or root)
+        self.settle = settle
+        self.interval = interval
+        # Сегменты рекордера различны по построению; тишина может дать одинаковые файлы
+        self.options = options or MergeOptions(allow_duplicates=True, overwrite=True)
+        self.state = WatchState(state_path or os.path.join(self.root, STATE_FILENAME))
+        # Набор -> (снимок, время последнего изменения снимка)
+        self.seen = {}
+        self.notifier = None
+        # Объединения за время работы: (набор, результат, MergeResult или None, ошибка)
+        self.history = []
+
+    def folders(self):
+        with os.scandir(self.root) as it:
+            return [entry.path for entry in it if entry.is_dir() and not entry.name.startswith('.')]
+
+    def scan(self, now=None):
+        """Один проход: объединяет готовые наборы; возвращает время до ближайшей проверки"""
+        now = time.time() if now is None else now
+        next_check = None
+        for folder in self.folders():
+            if self.notifier is not None:
+                self.notifier.add(folder)
+            try:
+                entries = snapshot(folder)
+            except OSError as e:
+                logging.warning(f"Could not scan {folder}: {str(e)}")
+                continue
+            if not entries:
+                continue
+            previous = self.seen.get(folder)
+            if previous is None:
+                # Первое наблюдение (в том числе после перезапуска): тишину отсчитываем от mtime файлов
+                changed_at = max(mtime for _, _, mtime in entries) / 1e9
+            elif previous[0] != entries:
+                changed_at = now
+            else:
+                changed_at = previous[1]
+            self.seen[folder] = (entries, changed_at)
+
+            current = fingerprint(entries)
+            if self.state.fingerprint(folder) == current:
+                continue
+            wait = changed_at + self.settle - now
+            if wait > 0:
+                next_check = wait if next_check is None else min(next_check, wait)
+                continue
+            self.merge_set(folder, entries, current)
+        return next_check
+
+    def output_path(self, folder, entries):
+        extension = os.path.splitext(entries[0][0])[1]
+        return os.path.join(self.output_dir, os.path.basename(folder) + extension)
+
+    def merge_set(self, folder, entries, current):
+        output = self.output_path(folder, entries)
+        paths = [os.path.join(folder, name) for name, _, _ in entries]
+        logging.info(f"Merging {len(paths)} segments of {folder} into {output}")
+        try:
+            result = merge(paths, output, self.options)
+        except Exception as e:
+            # Ошибка запоминается с отпечатком: набор повторится, только если он изменится
+            logging.error(f"Could not merge {folder}: {str(e)}")
+            self.state.record(folder, current, output, error=str(e))
+            self.history.append((folder, output, None, str(e)))
+            return None
+        self.state.record(folder, current, output, sha256=result.sha256)
+        self.history.append((folder, output, result, None))
+        logging.info(f"Merged {folder}: {result.bytes} bytes, {result.duration} s")
+        return result
+
+    def run(self, once=False):
+        """Цикл наблюдения; once=True - один проход (например, из cron)"""
+        if once:
+            self.scan()
+            return
+        self.notifier = open_notifier()
+        if self.notifier is not None:
+            self.notifier.add(self.root)
+        logging.info(f"Watching {self.root} (settle {self.settle} s, "
+                     f"{'inotify' if self.notifier else f'polling every {self.interval} s'})")
+        try:
+            while True:
+                next_check = self.scan()
+                if self.notifier is not None:
+                    # Событие будит раньше; незавершённый набор - не позже окончания его окна тишины
+                    self.notifier.wait(IDLE_WAIT if next_check is None else next_check + 0.1)
+                else:
+                    time.sleep(self.interval if next_check is None else min(self.interval, next_check + 0.1))
+        finally:
+            if self.notifier is not None:
+                self.notifier.close()
+
+    def close(self):
+        self.state.close()
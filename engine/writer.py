@@ -0,0 +1,364 @@
+"""Последовательная запись результата объединения"""
+import errno
+import hashlib
+import logging
+import os
+import stat
+
+from . import reflink
+
+# Размер буфера для обычного копирования
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Наибольший диапазон одного вызова copy_file_range: отводы (прогресс, отмена) видят данные не реже
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+
+# Размер сегмента, по которому считаются хеши для проверки результата
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Ошибки copy_file_range, после которых переходим на копирование через буфер
+KERNEL_COPY_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.EPERM}
+
+
+class Extent:
+    """Участок результата: диапазон входного файла или данные, синтезированные в памяти"""
+
+    def __init__(self, offset, source=None, source_offset=0):
+        self.offset = offset
+        self.length = 0
+        # Путь входа или None для синтезированных данных (заголовков и т. п.)
+        self.source = source
+        self.source_offset = source_offset
+        # SHA-256 каждого сегмента участка (если запись велась с digests)
+        self.digests = []
+        self.segment_size = None
+        self._hasher = None
+        self._fill = 0
+
+    def continues(self, source, source_offset, position):
+        """Продолжает ли новый кусок этот участок без разрыва"""
+        return (self.source == source and self.offset + self.length == position
+                and (source is None or self.source_offset + self.length == source_offset))
+
+    def digest(self, data, segment_size):
+        self.segment_size = segment_size
+        view = memoryview(data)
+        while view:
+            if self._hasher is None:
+                self._hasher = hashlib.sha256()
+            take = min(len(view), segment_size - self._fill)
+            self._hasher.update(view[:take])
+            self._fill += take
+            view = view[take:]
+            if self._fill == segment_size:
+                self._close_segment()
+
+    def _close_segment(self):
+        self.digests.append(self._hasher.digest())
+        self._hasher = None
+        self._fill = 0
+
+    def finish(self):
+        if self._hasher is not None:
+            self._close_segment()
+
+
+def is_stream(output):
+    """Результат - не путь, а открытый поток (файловый объект с fileno() или дескриптор)"""
+    return not isinstance(output, (str, bytes, os.PathLike))
+
+
+def temp_output_path(path):
+    """Имя временного файла рядом с path: скрытое, уникальное в пределах каталога"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}-{os.urandom(4).hex()}.part")
+
+
+def open_output(path, temp_path):
+    """Открывает запись в temp_path; канал или устройство по пути path открывается как есть"""
+    try:
+        if not stat.S_ISREG(os.stat(path).st_mode):
+            return open(path, 'wb', buffering=0)
+    except FileNotFoundError:
+        pass
+    return open(temp_path, 'xb', buffering=0)
+
+
+def remove_file(path):
+    """Удаляет неполный файл; ошибка удаления только записывается в журнал"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Could not remove partial output {path}: {str(e)}")
+
+
+class OutputWriter:
+    """Пишет выходной файл подряд, клонируя выровненные диапазоны входов вместо копирования
+
+    Попутно ведётся разметка результата (layout): из каких входов и диапазонов
+    состоит каждый его участок. С record_digests=True для каждого сегмента
+    участка запоминается SHA-256 прочитанных данных - это основа проверки.
+
+    Обычный файл пишется во временный рядом с ним (temp_path) и заменяет его
+    через os.replace только после успешной записи: при ошибке прежний файл
+    остаётся нетронутым, а временный удаляется. С deferred=True замену делает
+    владелец вызовом commit() - например, после проверки записанного.
+
+    Вместо пути можно передать поток (stdout, канал, сокет): запись идёт строго
+    подряд, а в каналы и сокеты диапазоны входов передаются через sendfile.
+    Поток не закрывается.
+    """
+
+    def __init__(self, path, use_reflink=True, record_digests=False, segment_size=SEGMENT_SIZE, deferred=False):
+        if is_stream(path):
+            if hasattr(path, 'flush'):
+                # Данные, уже лежащие в буфере файлового объекта, должны уйти раньше наших
+                path.flush()
+            self.fd = path if isinstance(path, int) else path.fileno()
+            self.path = getattr(path, 'name', f"<fd {self.fd}>")
+            self.file = None
+            self.temp_path = None
+        else:
+            self.path = path
+            # Новый файл заменит и жёсткую ссылку (например, из кэша результатов), не меняя общий
+            self.temp_path = temp_output_path(path)
+            self.file = open_output(path, self.temp_path)
+            if self.file.name != self.temp_path:
+                self.temp_path = None
+            self.fd = self.file.fileno()
+        self.deferred = deferred
+        # Канал или сокет: клонирование и copy_file_range невозможны, sendfile - да
+        self.streaming = not stat.S_ISREG(os.fstat(self.fd).st_mode)
+        self.closed = False
+        self.position = 0
+        self.block_size = reflink.block_size(self.fd)
+        # Клонирование пишет по смещениям от начала файла, поэтому только в свой файл
+        self.use_reflink = use_reflink and self.file is not None and reflink.reflink_available()
+        self.use_kernel_copy = hasattr(os, 'copy_file_range') and not self.streaming
+        self.use_sendfile = self.streaming and hasattr(os, 'sendfile')
+        self.cloned_bytes = 0
+        self.copied_bytes = 0
+        # Отводы по имени: каждый получает все записанные данные в порядке записи
+        self.taps = {}
+        self.layout = []
+        self.record_digests = record_digests
+        self.segment_size = segment_size
+        self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.discard()
+            return
+        self.close()
+        if not self.deferred:
+            self.commit()
+
+    @property
+    def written_path(self):
+        """Файл, в который идёт запись: временный до commit(), затем сам результат"""
+        return self.temp_path or self.path
+
+    def commit(self):
+        """Ставит записанный временный файл на место результата"""
+        self.close()
+        if self.temp_path is not None:
+            os.replace(self.temp_path, self.path)
+            self.temp_path = None
+
+    def discard(self):
+        """Отказ от записи: временный файл удаляется, прежний результат остаётся"""
+        self.close()
+        if self.temp_path is not None:
+            remove_file(self.temp_path)
+            self.temp_path = None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.file is not None:
+                self.file.close()
+            for extent in self.layout:
+                extent.finish()
+            for tap in self.taps.values():
+                tap.finish()
+
+    def add_tap(self, name, tap):
+        """Подключает отвод, который увидит все данные, записанные после этого"""
+        self.taps[name] = tap
+        return tap
+
+    def write(self, data):
+        """Записывает байты из памяти (заголовки и прочие синтезированные данные)"""
+        self._begin_extent(None, 0)
+        self._output(data)
+
+    def copy_from(self, src, offset, length):
+        """Переносит диапазон входа src (MappedInput или файл, открытый в 'rb') в конец результата"""
+        if length <= 0:
+            return
+        # Элемент архива - окно в файле архива: разметка и операции ядра идут по смещениям в нём
+        base = getattr(src, 'base', 0)
+        self._begin_extent(getattr(src, 'file_path', getattr(src, 'path', src.name)), offset + base)
+        if getattr(src, 'streaming', False):
+            # Поток (stdin, канал) читается только вперёд и только через буфер
+            self._read_copy(src, offset, length)
+            return
+        block = self.block_size
+        # Клонировать можно, только если смещения во входе и в выходе совпадают по модулю блока
+        if self.use_reflink and length >= block and (offset + base - self.position) % block == 0:
+            head = (-self.position) % block
+            if head:
+                self._copy(src, offset, head)
+                offset += head
+                length -= head
+            body = length - length % block
+            if body:
+                if reflink.clone_range(src.fileno(), offset + base, body, self.fd, self.position):
+                    if self.taps or self.record_digests:
+                        # Клонированные данные не проходят через память - отдаём их отводам из входа
+                        self._feed_taps(src, offset, body)
+                    self.position += body
+                    self.cloned_bytes += body
+                    self.layout[-1].length += body
+                    os.lseek(self.fd, self.position, os.SEEK_SET)
+                    offset += body
+                    length -= body
+                else:
+                    logging.debug(f"Reflink is not supported for {self.path}, falling back to copying")
+                    self.use_reflink = False
+        if length:
+            self._copy(src, offset, length)
+
+    def copy_stream(self, src, offset, holdback=0, trim=None):
+        """Переносит поток src (engine.streams.StreamInput) от offset до конца
+
+        Последние holdback байт придерживаются; trim(хвост) говорит, сколько
+        байт в конце хвоста отбросить (например, теги).
+        """
+        src.seek(offset)
+        self._begin_extent(src.path, offset)
+        for chunk in src.chunks(holdback):
+            self._output(chunk)
+        if holdback:
+            tail = src.peek(holdback)
+            keep = len(tail) - (trim(tail) if trim else 0)
+            if keep:
+                self._output(tail[:keep])
+
+    def _begin_extent(self, source, source_offset):
+        """Открывает новый участок разметки или продолжает текущий"""
+        if self.layout and self.layout[-1].continues(source, source_offset, self.position):
+            return
+        if self.layout:
+            self.layout[-1].finish()
+        self.layout.append(Extent(self.position, source, source_offset))
+
+    def _output(self, data):
+        """Физическая запись куска, отводы и учёт в текущем участке разметки"""
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        self.position += len(data)
+        self.copied_bytes += len(data)
+        self._observe(data)
+        self.layout[-1].length += len(data)
+
+    def _observe(self, data):
+        for tap in self.taps.values():
+            tap.feed(data)
+        if self.record_digests:
+            self.layout[-1].digest(data, self.segment_size)
+
+    def _copy(self, src, offset, length):
+        """Обычное копирование диапазона: сначала средствами ядра, затем через буфер"""
+        base = getattr(src, 'base', 0)
+        if self.use_sendfile:
+            try:
+                while length:
+                    sent = os.sendfile(self.fd, src.fileno(), offset + base, min(length, COPY_BUFFER_SIZE))
+                    if sent == 0:
+                        raise ValueError(f"{src.name} is truncated: it ended before the end of its data")
+                    # Переданные ядром данные отводы получают из входа, как при клонировании
+                    self._feed_taps(src, offset, sent)
+                    offset += sent
+                    length -= sent
+                    self.position += sent
+                    self.copied_bytes += sent
+                    self.layout[-1].length += sent
+                return
+            except OSError as e:
+                if e.errno not in KERNEL_COPY_ERRORS:
+                    raise
+                logging.debug(f"sendfile unavailable ({e}), using buffered copy")
+                self.use_sendfile = False
+
+        # Отводы и хеши сегментов получают скопированное ядром из отображения входа; вход без
+        # отображения пришлось бы для них читать отдельно - его пишем из того же буфера, которым читаем
+        observed = bool(self.taps) or self.record_digests
+        if self.use_kernel_copy and (hasattr(src, 'view') or not observed):
+            try:
+                while length:
+                    copied = os.copy_file_range(src.fileno(), self.fd, min(length, KERNEL_COPY_CHUNK),
+                                                offset + base)
+                    if copied == 0:
+                        raise ValueError(f"{src.name} is truncated: it ended before the end of its data")
+                    if observed:
+                        self._feed_taps(src, offset, copied)
+                    offset += copied
+                    length -= copied
+                    self.position += copied
+                    self.copied_bytes += copied
+                    self.layout[-1].length += copied
+                return
+            except OSError as e:
+                if e.errno not in KERNEL_COPY_ERRORS:
+                    raise
+                logging.debug(f"copy_file_range unavailable ({e}), using buffered copy")
+                self.use_kernel_copy = False
+
+        if hasattr(src, 'view'):
+            # Отображённый в память вход пишем прямо из его среза
+            while length:
+                chunk = src.view(offset, min(length, COPY_BUFFER_SIZE))
+                if not chunk:
+                    raise ValueError(f"{src.name} is truncated: it ended before the end of its data")
+                count = len(chunk)
+                self._output(chunk)
+                offset += count
+                length -= count
+            return
+        self._read_copy(src, offset, length)
+
+    def _read_copy(self, src, offset, length):
+        """Копирование через буфер чтением src.readinto"""
+        if self._buffer is None:
+            self._buffer = bytearray(COPY_BUFFER_SIZE)
+        buffer = memoryview(self._buffer)
+        src.seek(offset)
+        while length:
+            count = src.readinto(buffer[:min(length, len(buffer))])
+            if not count:
+                raise ValueError(f"{src.name} is truncated: it ended before the end of its data")
+            self._output(buffer[:count])
+            length -= count
+
+    def _feed_taps(self, src, offset, length):
+        """Передаёт отводам диапазон входа, который записывается без участия памяти"""
+        while length:
+            count = min(length, COPY_BUFFER_SIZE)
+            if hasattr(src, 'view'):
+                chunk = src.view(offset, count)
+            else:
+                src.seek(offset)
+                chunk = src.read(count)
+            if not chunk:
+                raise ValueError(f"{src.name} is truncated: it ended before the end of its data")
+            self._observe(chunk)
+            offset += len(chunk)
+            length -= len(chunk)
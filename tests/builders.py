@@ -0,0 +1,173 @@
+"""Маленькие входы для тестов и проверки получившихся потоков
+
+WAV и ADTS собираются побайтно; для MP3, FLAC и Ogg нужен кодер - их пишет
+libsndfile (soundfile), и без него такие тесты пропускаются.
+"""
+import random
+import struct
+
+import pytest
+
+from engine.flac import FlacInput, crc16, index_frames, parse_frame_header
+from engine.formats import Mp3InfoFrame, locate_payload
+from engine.mapped import MappedSession
+from engine.ogg import PAGE_HEADER, ogg_crc, read_pages
+
+# Формат libsndfile, подтип и частота кодированных входов
+ENCODED = {
+    'mp3': ('MP3', 'MPEG_LAYER_III', 44100),
+    'flac': ('FLAC', 'PCM_16', 44100),
+    'vorbis': ('OGG', 'VORBIS', 44100),
+    'opus': ('OGG', 'OPUS', 48000),
+}
+
+# Отсчётов в одном фрейме MP3 (MPEG-1 Layer III)
+MP3_FRAME_SAMPLES = 1152
+
+
+def soundfile():
+    return pytest.importorskip('soundfile')
+
+
+def tone(frames, rate, seed=0, channels=2):
+    """Нарастающий тон с шумом: кодер VBR выбирает для фреймов разный битрейт"""
+    np = pytest.importorskip('numpy')
+    t = np.arange(frames) / rate
+    noise = np.random.default_rng(seed).standard_normal(frames)
+    left = 0.3 * np.sin(2 * np.pi * (200 + 50 * seed) * t * (1 + t)) + 0.05 * noise
+    return np.stack([left, left[::-1]][:channels], 1).astype('float32')
+
+
+def write_wav(path, frames, rate=44100, channels=2, bits=16, seed=0):
+    """WAV PCM со случайными отсчётами и лишним чанком перед data"""
+    block = channels * bits // 8
+    data = random.Random(seed).randbytes(frames * block)
+    fmt = struct.pack('<HHIIHH', 1, channels, rate, rate * block, block, bits)
+    junk = b'JUNK' + struct.pack('<I', 3) + b'abc\x00'
+    body = b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt + junk + b'data' + struct.pack('<I', len(data)) + data
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', len(body)) + body)
+    return path
+
+
+def write_encoded(path, kind, frames, seed=0):
+    """MP3, FLAC или Ogg (Vorbis/Opus), закодированный libsndfile"""
+    sf = soundfile()
+    fmt, subtype, rate = ENCODED[kind]
+    sf.write(path, tone(frames, rate, seed), rate, format=fmt, subtype=subtype)
+    return path
+
+
+def adts_frame(payload_length, rng, rate_index=4, channels=2):
+    length = 7 + payload_length
+    header = bytes([
+        0xFF, 0xF1,
+        (1 << 6) | (rate_index << 2) | (channels >> 2),
+        ((channels & 3) << 6) | (length >> 11),
+        (length >> 3) & 0xFF,
+        ((length & 7) << 5) | 0x1F,
+        0xFC,
+    ])
+    return header + rng.randbytes(payload_length).replace(b'\xff', b'\x00')
+
+
+def write_adts(path, count, seed=0, junk=False, tag=False):
+    """Поток ADTS из count фреймов, по желанию с тегом ID3v2 в начале и мусором в середине; возвращает фреймы"""
+    rng = random.Random(seed)
+    frames = [adts_frame(rng.randrange(100, 400), rng) for _ in range(count)]
+    data = bytearray(b'ID3\x03\x00\x00\x00\x00\x00\x0a' + bytes(10) if tag else b'')
+    for i, frame in enumerate(frames):
+        data += frame
+        if junk and i == count // 2:
+            data += b'\x00junk\x00'
+    with open(path, 'wb') as f:
+        f.write(data)
+    return frames
+
+
+def decoded_frames(path):
+    """Сколько сэмплов даёт декодер (libsndfile)"""
+    sf = soundfile()
+    with sf.SoundFile(path) as f:
+        if f.frames:
+            return f.frames
+        return sum(len(block) for block in f.blocks(65536))
+
+
+def mp3_gapless(path):
+    """Из служебного фрейма LAME: (аудиофреймов, задержка кодера, добавленная тишина)"""
+    with MappedSession() as session:
+        mapped = session.open(path)
+        payload = locate_payload(mapped, 'mp3')
+        assert payload.info_offset is not None, "no Xing/Info frame"
+        info = Mp3InfoFrame(bytes(mapped.data[payload.info_offset:payload.offset]))
+    assert info.lame is not None, "no LAME extension"
+    delay = struct.unpack_from('>I', b'\0' + info.frame[info.lame + 21:info.lame + 24])[0] >> 12
+    return info.frames, delay, info.padding()
+
+
+def check_flac(path):
+    """Проверяет каждый фрейм FLAC: CRC-8 заголовка, CRC-16 фрейма и нумерацию
+
+    Возвращает (STREAMINFO, число фреймов, сэмплов во фреймах).
+    """
+    with MappedSession() as session:
+        flac = FlacInput(session.open(path))
+        index = index_frames(flac)
+        view = flac.mapped.data
+        ends = list(index.offsets[1:]) + [flac.frames_end]
+        number = 0
+        samples = 0
+        for i, (start, end) in enumerate(zip(index.offsets, ends)):
+            header = parse_frame_header(view, start, end)
+            assert header is not None, f"frame {i}: bad header"
+            _, block_size, strategy, frame_number = header
+            assert frame_number == (number if strategy == 0 else samples), f"frame {i}: number {frame_number}"
+            assert crc16(view[start:end - 2]) == struct.unpack_from('>H', view, end - 2)[0], f"frame {i}: CRC-16"
+            number += 1
+            samples += block_size
+        return flac.streaminfo, number, samples
+
+
+def check_ogg(path):
+    """Проверяет каждую страницу Ogg: CRC, один серийный номер, номера страниц, гранулы, BOS/EOS
+
+    Возвращает страницы.
+    """
+    with MappedSession() as session:
+        mapped = session.open(path)
+        pages = read_pages(mapped)
+        view = mapped.data
+        assert pages and pages[0].offset == 0
+        assert len({page.serial for page in pages}) == 1
+        granule = 0
+        for i, page in enumerate(pages):
+            raw = bytearray(view[page.offset:page.end])
+            stored = struct.unpack_from('<I', raw, 22)[0]
+            raw[22:26] = bytes(4)
+            assert ogg_crc(raw) == stored, f"page {i}: CRC"
+            assert PAGE_HEADER.unpack_from(raw)[5] == i, f"page {i}: sequence number"
+            assert bool(page.flags & 0x02) == (i == 0), f"page {i}: BOS"
+            assert bool(page.flags & 0x04) == (i == len(pages) - 1), f"page {i}: EOS"
+            if page.granule != -1:
+                assert page.granule >= granule, f"page {i}: granule goes back"
+                granule = page.granule
+        assert pages[-1].end == mapped.size
+        return pages
+
+
+def file_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def write_mp3_frames(path, count, bitrate_index=9, tag=False):
+    """MP3 из count пустых фреймов MPEG-1 Layer III 44100 Гц с постоянным битрейтом"""
+    header = 0xFFFB0000 | bitrate_index << 12
+    length = 144 * (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)[bitrate_index] * 1000 // 44100
+    frame = struct.pack('>I', header) + bytes(length - 4)
+    with open(path, 'wb') as f:
+        if tag:
+            f.write(b'ID3\x03\x00\x00\x00\x00\x00\x0a' + bytes(10))
+        f.write(frame * count)
+    return frame
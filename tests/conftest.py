@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# Движок импортируется из рабочего дерева
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Кэши разбора и результатов у каждого теста свои, во временной папке"""
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('SMERGE_CACHE_DIR', str(path))
+    return path
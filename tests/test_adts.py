@@ -0,0 +1,68 @@
+"""AAC (ADTS): разбор заголовков и серии верных фреймов"""
+import random
+
+import pytest
+
+from builders import adts_frame, write_adts
+from engine.adts import index_adts, parse_adts_header
+from engine.api import MergeOptions, merge
+from engine.mapped import MappedSession
+from engine.probecache import ProbeCache
+
+
+def index(path, cache=None):
+    with MappedSession() as session:
+        return index_adts(session.open(path), cache)
+
+
+def test_parse_header():
+    frame = adts_frame(200, random.Random(0))
+    assert parse_adts_header(frame, 0, len(frame)) == (207, (1, 4, 2), 1)
+    # Обрезанный заголовок и не синхропоследовательность
+    assert parse_adts_header(frame, 0, 6) is None
+    assert parse_adts_header(b'\xff\x00' + frame[2:], 0, len(frame)) is None
+
+
+def test_runs_skip_tag_and_junk(tmp_path):
+    path = str(tmp_path / 'in.aac')
+    frames = write_adts(path, 10, junk=True, tag=True)
+    result = index(path)
+    assert (result.frames, result.blocks) == (10, 10)
+    assert result.skipped == len(b'\x00junk\x00')
+    # Две серии: до мусора и после него; тег в начале в серии не входит
+    tag = 20
+    first = sum(len(frame) for frame in frames[:6])
+    rest = sum(len(frame) for frame in frames[6:])
+    assert list(result.runs) == [tag, first, tag + first + 6, rest]
+
+
+def test_foreign_frames_skipped(tmp_path):
+    rng = random.Random(1)
+    frames = [adts_frame(150, rng) for _ in range(6)]
+    # Фрейм с другой частотой посреди потока - не часть этого потока
+    data = b''.join(frames[:3]) + adts_frame(150, rng, rate_index=3) + b''.join(frames[3:])
+    path = tmp_path / 'in.aac'
+    path.write_bytes(data)
+    result = index(str(path))
+    assert result.frames == 6
+    assert result.skipped == 157
+    assert result.runs[1] + result.runs[3] == sum(len(frame) for frame in frames)
+
+
+def test_index_cached(tmp_path, cache_dir):
+    path = str(tmp_path / 'in.aac')
+    write_adts(path, 12, junk=True)
+    with ProbeCache() as cache:
+        first = index(path, cache)
+        second = index(path, cache)
+    assert second is not first
+    assert (list(second.runs), second.frames, second.skipped) == (list(first.runs), first.frames, first.skipped)
+
+
+def test_merge_rejects_different_params(tmp_path):
+    rng = random.Random(2)
+    a, b = tmp_path / 'a.aac', tmp_path / 'b.aac'
+    a.write_bytes(b''.join(adts_frame(100, rng) for _ in range(3)))
+    b.write_bytes(b''.join(adts_frame(100, rng, channels=1) for _ in range(3)))
+    with pytest.raises(ValueError, match='differs'):
+        merge([str(a), str(b)], str(tmp_path / 'out.aac'), MergeOptions(sidecar=False))
@@ -0,0 +1,136 @@
+"""Главы: лист .cue, чанки cue в WAV, кадры CHAP в MP3 и CUESHEET во FLAC"""
+import itertools
+import struct
+
+import pytest
+
+from builders import file_bytes, write_encoded, write_mp3_frames, write_wav
+from engine.api import MergeOptions, merge
+from engine.chapters import (Chapter, cue_sheet, cue_time, id3_frame, id3_title, id3_with_chapters,
+                             plan_chapters, syncsafe, syncsafe_value, vorbis_comment)
+from engine.flac import BLOCK_CUESHEET, BLOCK_VORBIS_COMMENT, FlacInput
+from engine.mapped import MappedSession
+
+RATE = 44100
+LENGTHS = [RATE, RATE // 2, 3 * RATE // 4]
+
+
+def chapter_options():
+    return MergeOptions(sidecar=False, chapters=True)
+
+
+def starts(lengths):
+    return [0] + list(itertools.accumulate(lengths))[:-1]
+
+
+def id3_frames(tag):
+    """Кадры тега ID3v2.3: [(имя, тело)]"""
+    end = 10 + syncsafe_value(tag[6:10])
+    frames = []
+    pos = 10
+    while pos + 10 <= end and tag[pos] != 0:
+        size = struct.unpack_from('>I', tag, pos + 4)[0]
+        frames.append((tag[pos:pos + 4], tag[pos + 10:pos + 10 + size]))
+        pos += 10 + size
+    return frames
+
+
+@pytest.mark.parametrize('seconds, text', [(0, '00:00:00'), (1 + 1 / 75, '00:01:01'), (59.999, '01:00:00'),
+                                           (3600.4, '60:00:30')])
+def test_cue_time(seconds, text):
+    assert cue_time(seconds) == text
+
+
+def test_cue_sheet():
+    chapters = [Chapter('One', 0, 2.4), Chapter('Say "two"', 2.4, 60)]
+    assert cue_sheet('out "x".mp3', 'mp3', chapters) == (
+        'FILE "out \'x\'.mp3" MP3\n'
+        '  TRACK 01 AUDIO\n'
+        '    TITLE "One"\n'
+        '    INDEX 01 00:00:00\n'
+        '  TRACK 02 AUDIO\n'
+        '    TITLE "Say \'two\'"\n'
+        '    INDEX 01 00:02:30\n'
+    )
+
+
+def test_plan_chapters():
+    chapters = plan_chapters(['a/01 intro.wav', 'b/02.wav'], [1.5, 2.0])
+    assert [(chapter.title, chapter.start, chapter.end) for chapter in chapters] == [
+        ('01 intro', 0.0, 1.5), ('02', 1.5, 3.5)]
+    with pytest.raises(ValueError):
+        plan_chapters(['a.wav'], [None])
+
+
+def test_wav_chapters(tmp_path):
+    paths = [write_wav(str(tmp_path / f"{k}.wav"), frames, seed=k) for k, frames in enumerate(LENGTHS)]
+    result = merge(paths, str(tmp_path / 'out.wav'), chapter_options())
+    data = file_bytes(result.output)
+    assert struct.unpack_from('<I', data, 4)[0] == len(data) - 8
+    chunks = {}
+    pos = 12
+    while pos < len(data):
+        chunk_id, length = struct.unpack_from('<4sI', data, pos)
+        chunks[chunk_id] = data[pos + 8:pos + 8 + length]
+        pos += 8 + length + (length & 1)
+    assert pos == len(data)
+    points = chunks[b'cue ']
+    count = struct.unpack_from('<I', points)[0]
+    assert count == 3
+    assert [struct.unpack_from('<II4sIII', points, 4 + 24 * k)[5] for k in range(count)] == starts(LENGTHS)
+    assert b'labl' in chunks[b'LIST'] and chunks[b'LIST'].startswith(b'adtl')
+    assert file_bytes(result.cue).decode('utf-8-sig').startswith('FILE "out.wav" WAVE\n')
+
+
+def test_mp3_chapters(tmp_path):
+    paths = [str(tmp_path / f"{k}.mp3") for k in range(3)]
+    frames = [write_mp3_frames(path, 10 * (k + 1), tag=k == 0) for k, path in enumerate(paths)]
+    result = merge(paths, str(tmp_path / 'out.mp3'), chapter_options())
+    data = file_bytes(result.output)
+    assert data[:4] == b'ID3\x03'
+    tag_length = 10 + syncsafe_value(data[6:10])
+    # Аудиоданные не меняются: теги входов отброшены, фрейм Xing не нужен
+    assert data[tag_length:] == b''.join(frame * 10 * (k + 1) for k, frame in enumerate(frames))
+    tag = id3_frames(data[:tag_length])
+    chaps = [body for name, body in tag if name == b'CHAP']
+    assert [body[:4] for body in chaps] == [b'ch1\x00', b'ch2\x00', b'ch3\x00']
+    frame_ms = 1152 * 1000 / RATE
+    times = [struct.unpack_from('>II', body, 4) for body in chaps]
+    assert times == [(round(a * frame_ms), round(b * frame_ms)) for a, b in [(0, 10), (10, 30), (30, 60)]]
+    toc = dict(tag)[b'CTOC']
+    assert toc == b'toc\x00\x03\x03ch1\x00ch2\x00ch3\x00'
+
+
+def test_id3_with_chapters_keeps_frames():
+    chapters = [Chapter('A', 0, 1)]
+    old = id3_frame(b'TIT2', b'\x00Old', 3) + id3_frame(b'CHAP', b'x\x00' + bytes(16), 3)
+    tag = id3_with_chapters(b'ID3\x03\x00\x00' + syncsafe(len(old) + 20) + old + bytes(20), chapters)
+    names = [name for name, _ in id3_frames(tag)]
+    assert names == [b'TIT2', b'CHAP', b'CTOC']
+    assert dict(id3_frames(tag))[b'TIT2'] == b'\x00Old'
+    assert id3_title('A', 3) in dict(id3_frames(tag))[b'CHAP']
+    # Рассинхронизированный тег не переписывается
+    unsync = b'ID3\x03\x00\x80' + syncsafe(len(old)) + old
+    assert id3_with_chapters(unsync, chapters) == unsync
+
+
+def test_flac_chapters(tmp_path):
+    paths = [write_encoded(str(tmp_path / f"{k}.flac"), 'flac', frames, seed=k) for k, frames in enumerate(LENGTHS)]
+    result = merge(paths, str(tmp_path / 'out.flac'), chapter_options())
+    with MappedSession() as session:
+        blocks = dict((block_type, bytes(body)) for block_type, body in
+                      FlacInput(session.open(result.output)).blocks)
+    sheet = blocks[BLOCK_CUESHEET]
+    assert sheet[395] == 4
+    tracks = []
+    pos = 396
+    for _ in range(4):
+        offset, number = struct.unpack_from('>QB', sheet, pos)
+        indexes = sheet[pos + 35]
+        tracks.append((offset, number))
+        pos += 36 + 12 * indexes
+    assert pos == len(sheet)
+    assert tracks == list(zip(starts(LENGTHS) + [sum(LENGTHS)], [1, 2, 3, 255]))
+    _, comments = vorbis_comment(blocks[BLOCK_VORBIS_COMMENT])
+    assert b'CHAPTER001=00:00:00.000' in comments and b'CHAPTER002NAME=1' in comments
+    assert b'CHAPTER002=00:00:01.000' in comments
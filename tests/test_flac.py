@@ -0,0 +1,87 @@
+"""FLAC: контрольные суммы, перенумерация фреймов и метаданные результата"""
+import struct
+
+import pytest
+
+from builders import check_flac, decoded_frames, write_encoded
+from engine.api import MergeOptions, merge
+from engine.flac import (BLOCK_SEEKTABLE, SEEK_PLACEHOLDER, FlacInput, crc8, crc16, encode_number,
+                         parse_frame_header)
+from engine.mapped import MappedSession
+
+BLOCK = 4096
+
+
+def test_crc_check_values():
+    # Контрольные значения CRC-8 (многочлен 0x07) и CRC-16 (0x8005) для "123456789"
+    assert crc8(b'123456789') == 0xF4
+    assert crc16(b'123456789') == 0xFEE8
+    assert crc16(b'56789', crc16(b'1234')) == 0xFEE8
+
+
+@pytest.mark.parametrize('value, length', [(0, 1), (0x7F, 1), (0x80, 2), (0x7FF, 2), (0x800, 3),
+                                           (0xFFFF, 3), (0x10000, 4), (0x7FFFFFFF, 6), (0xFFFFFFFFF, 7)])
+def test_encode_number(value, length):
+    encoded = encode_number(value)
+    assert len(encoded) == length
+    # Номер в заголовке с размером блока 4096 и CRC-8 разбирается обратно
+    header = bytearray(b'\xff\xf9\xc9\x18') + encoded
+    header.append(crc8(header))
+    assert parse_frame_header(header, 0, len(header) + 2) == (len(header), BLOCK, 1, value)
+
+
+def test_encode_number_range():
+    with pytest.raises(ValueError):
+        encode_number(1 << 36)
+
+
+def test_parse_frame_header_rejects_bad_crc():
+    header = bytearray(b'\xff\xf8\xc9\x18\x05')
+    header.append(crc8(header) ^ 1)
+    assert parse_frame_header(header, 0, len(header) + 2) is None
+
+
+def merged(tmp_path, lengths):
+    paths = [write_encoded(str(tmp_path / f"in{k}.flac"), 'flac', frames, seed=k)
+             for k, frames in enumerate(lengths)]
+    return paths, merge(paths, str(tmp_path / 'out.flac'), MergeOptions(sidecar=False))
+
+
+def test_fixed_block_renumbering(tmp_path):
+    # Все фреймы, кроме последнего, по 4096 сэмплов: номера фреймов доходят до двухбайтовых
+    lengths = [BLOCK * 70, BLOCK * 70, 10000]
+    _, result = merged(tmp_path, lengths)
+    streaminfo, frames, samples = check_flac(result.output)
+    assert frames == 70 + 70 + 3
+    assert streaminfo.total_samples == samples == sum(lengths)
+    assert (streaminfo.min_block, streaminfo.max_block) == (BLOCK, BLOCK)
+    with MappedSession() as session:
+        view = session.open(result.output).data
+        assert view[FlacInput(session.open(result.output)).frames_offset + 1] == 0xF8
+    assert decoded_frames(result.output) == sum(lengths)
+
+
+def test_variable_block_renumbering(tmp_path):
+    # Короткие последние фреймы в середине: результат нумеруется по сэмплам
+    lengths = [30000, 17001, 44100]
+    _, result = merged(tmp_path, lengths)
+    streaminfo, _, samples = check_flac(result.output)
+    assert streaminfo.total_samples == samples == sum(lengths)
+    assert streaminfo.md5 == bytes(16)
+    assert decoded_frames(result.output) == sum(lengths)
+
+
+def test_seektable_points_at_frames(tmp_path):
+    _, result = merged(tmp_path, [44100 * 8, 44100 * 7])
+    with MappedSession() as session:
+        flac = FlacInput(session.open(result.output))
+        view = flac.mapped.data
+        table = dict(flac.blocks)[BLOCK_SEEKTABLE]
+        points = [struct.unpack_from('>QQH', table, pos) for pos in range(0, len(table), 18)]
+        used = [point for point in points if point[0] != SEEK_PLACEHOLDER]
+        assert len(used) == 2
+        for sample, offset, block in used:
+            header = parse_frame_header(view, flac.frames_offset + offset, flac.frames_end)
+            assert header is not None
+            assert header[1] == block
+            assert header[3] == (sample if header[2] else sample // BLOCK)
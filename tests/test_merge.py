@@ -0,0 +1,118 @@
+"""Объединение: длина результата по декодеру, виртуальное и иерархическое объединение"""
+import random
+
+import pytest
+
+from builders import (MP3_FRAME_SAMPLES, check_flac, check_ogg, decoded_frames, file_bytes, mp3_gapless,
+                      write_adts, write_encoded, write_wav)
+from engine.api import MergeOptions, MergePlan, merge
+from engine.virtual import VirtualMerge
+
+LENGTHS = [30000, 17001, 44100]
+
+EXTENSIONS = {'wav': '.wav', 'mp3': '.mp3', 'flac': '.flac', 'vorbis': '.ogg', 'opus': '.ogg', 'aac': '.aac'}
+
+
+def make_inputs(directory, kind, lengths=LENGTHS):
+    paths = []
+    for k, frames in enumerate(lengths):
+        path = str(directory / f"in{k}{EXTENSIONS[kind]}")
+        if kind == 'wav':
+            write_wav(path, frames, seed=k)
+        elif kind == 'aac':
+            write_adts(path, frames // 1024, seed=k, junk=k == 1, tag=k == 2)
+        else:
+            write_encoded(path, kind, frames, seed=k)
+        paths.append(path)
+    return paths
+
+
+def options(**kwargs):
+    return MergeOptions(sidecar=False, allow_duplicates=True, **kwargs)
+
+
+def test_wav_samples(tmp_path):
+    paths = make_inputs(tmp_path, 'wav')
+    result = merge(paths, str(tmp_path / 'out.wav'), options())
+    assert decoded_frames(result.output) == sum(LENGTHS)
+    assert result.duration == pytest.approx(sum(LENGTHS) / 44100)
+
+
+def test_mp3_samples(tmp_path):
+    paths = make_inputs(tmp_path, 'mp3')
+    result = merge(paths, str(tmp_path / 'out.mp3'), options())
+    inputs = [mp3_gapless(path) for path in paths]
+    frames, delay, padding = mp3_gapless(result.output)
+    assert frames == sum(count for count, _, _ in inputs)
+    assert (delay, padding) == (inputs[0][1], inputs[-1][2])
+    # Задержка кодера и тишина в конце срезаются только у результата в целом
+    assert decoded_frames(result.output) == frames * MP3_FRAME_SAMPLES - delay - padding
+
+
+def test_flac_samples(tmp_path):
+    paths = make_inputs(tmp_path, 'flac')
+    result = merge(paths, str(tmp_path / 'out.flac'), options())
+    streaminfo, frames, samples = check_flac(result.output)
+    assert streaminfo.total_samples == samples == sum(LENGTHS)
+    assert frames == sum(check_flac(path)[1] for path in paths)
+    assert decoded_frames(result.output) == sum(LENGTHS)
+
+
+def test_vorbis_samples(tmp_path):
+    paths = make_inputs(tmp_path, 'vorbis')
+    result = merge(paths, str(tmp_path / 'out.ogg'), options())
+    pages = check_ogg(result.output)
+    assert pages[-1].granule == sum(LENGTHS)
+    assert decoded_frames(result.output) == sum(LENGTHS)
+
+
+def test_opus_samples(tmp_path):
+    paths = make_inputs(tmp_path, 'opus')
+    result = merge(paths, str(tmp_path / 'out.ogg'), options())
+    pages = check_ogg(result.output)
+    pre_skip = int.from_bytes(file_bytes(result.output)[pages[0].body_offset + 10:pages[0].body_offset + 12],
+                              'little')
+    decoded = decoded_frames(result.output)
+    # Вступления входов после первого остаются в звуке: результат не короче суммы
+    assert decoded == pages[-1].granule - pre_skip >= sum(LENGTHS)
+    assert decoded == round(result.duration * 48000)
+
+
+def test_aac_frames(tmp_path):
+    paths = [str(tmp_path / f"in{k}.aac") for k in range(3)]
+    frames = []
+    for k, path in enumerate(paths):
+        frames += write_adts(path, 20 + k, seed=k, junk=k == 1, tag=k == 2)
+    result = merge(paths, str(tmp_path / 'out.aac'), options())
+    # Только фреймы входов: без тегов и мусора
+    assert file_bytes(result.output) == b''.join(frames)
+    assert result.duration == pytest.approx(len(frames) * 1024 / 44100)
+
+
+@pytest.mark.parametrize('kind', ['wav', 'mp3', 'flac', 'vorbis', 'opus', 'aac'])
+def test_virtual_equals_merge(tmp_path, kind):
+    paths = make_inputs(tmp_path, kind)
+    output = str(tmp_path / f"out{EXTENSIONS[kind]}")
+    merge(paths, output, options())
+    expected = file_bytes(output)
+
+    with VirtualMerge(MergePlan(paths, output, options())) as virtual:
+        assert virtual.size == len(expected)
+        assert virtual.read() == expected
+        rng = random.Random(0)
+        for _ in range(50):
+            offset = rng.randrange(len(expected))
+            length = rng.randrange(1, 20000)
+            assert virtual.read_range(offset, length) == expected[offset:offset + length]
+        assert virtual.read_range(len(expected), 10) == b''
+        virtual.seek(-100, 2)
+        assert virtual.read(1000) == expected[-100:]
+
+
+@pytest.mark.parametrize('kind', ['wav', 'flac', 'vorbis', 'aac'])
+def test_tree_equals_direct(tmp_path, kind):
+    paths = make_inputs(tmp_path, kind, [5000 + 1000 * k for k in range(5)])
+    direct = merge(paths, str(tmp_path / f"direct{EXTENSIONS[kind]}"), options(tree=False))
+    tree = merge(paths, str(tmp_path / f"tree{EXTENSIONS[kind]}"), options(tree=2))
+    assert file_bytes(tree.output) == file_bytes(direct.output)
+    assert tree.duration == pytest.approx(direct.duration)
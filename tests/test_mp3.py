@@ -0,0 +1,89 @@
+"""MP3: фрейм Xing/Info результата и частей, длительность по нему"""
+import pytest
+
+from builders import (MP3_FRAME_SAMPLES, decoded_frames, file_bytes, write_encoded, write_mp3_frames)
+from engine.api import MergeOptions, merge
+from engine.formats import Mp3InfoFrame, locate_payload
+from engine.mapped import MappedSession
+from engine.probe import mp3_duration
+from engine.split import index_mp3, split_audio
+
+
+def xing(path):
+    """(Mp3InfoFrame, смещения аудиофреймов от служебного фрейма, конец данных от него же)"""
+    with MappedSession() as session:
+        mapped = session.open(path)
+        payload = locate_payload(mapped, 'mp3')
+        assert payload.info_offset is not None, "no Xing/Info frame"
+        info = Mp3InfoFrame(bytes(mapped.data[payload.info_offset:payload.offset]))
+        index = index_mp3(mapped, payload.offset, payload.offset + payload.length)
+        offsets = [offset - payload.info_offset for offset in index.offsets]
+    return info, offsets[:-1], offsets[-1]
+
+
+def check_xing(path, slack=1):
+    """Счётчики фрейма Xing совпадают с потоком, таблица перемотки указывает на свои фреймы
+
+    slack - допустимый выход точки таблицы за её фрейм, в 1/256 длины потока.
+    """
+    info, offsets, size = xing(path)
+    assert info.frames == len(offsets)
+    assert info.bytes == size
+    assert list(info.toc) == sorted(info.toc)
+    bounds = offsets + [size]
+    for percent, value in enumerate(info.toc):
+        # Точка таблицы - внутри фрейма, на который приходится этот процент времени
+        k = percent * len(offsets) // 100
+        low, high = bounds[k] * 256 / size - slack, bounds[k + 1] * 256 / size + slack
+        assert low <= value <= high, f"TOC {percent}%: {value}, expected {low:.1f}-{high:.1f}"
+    return info
+
+
+def test_vbr_merge_xing(tmp_path):
+    paths = [write_encoded(str(tmp_path / f"in{k}.mp3"), 'mp3', frames, seed=k)
+             for k, frames in enumerate([30000, 17001, 44100])]
+    result = merge(paths, str(tmp_path / 'out.mp3'), MergeOptions(sidecar=False))
+    # Внутри входа точки берутся из его собственной таблицы, а она сама приблизительна
+    info = check_xing(result.output, slack=3)
+    assert info.frames == sum(xing(path)[0].frames for path in paths)
+    assert result.duration == pytest.approx(info.frames * MP3_FRAME_SAMPLES / 44100)
+
+
+def test_cbr_merge_is_plain_concat(tmp_path):
+    paths = [str(tmp_path / f"in{k}.mp3") for k in range(3)]
+    frames = [write_mp3_frames(path, 10 + k, tag=k == 1) for k, path in enumerate(paths)]
+    result = merge(paths, str(tmp_path / 'out.mp3'), MergeOptions(sidecar=False))
+    # Один битрейт и ни одного фрейма Xing: служебный фрейм не нужен, теги входов отбрасываются
+    assert file_bytes(result.output) == b''.join(frame * (10 + k) for k, frame in enumerate(frames))
+
+
+def test_mixed_bitrate_merge_gets_xing(tmp_path):
+    paths = [str(tmp_path / 'a.mp3'), str(tmp_path / 'b.mp3')]
+    write_mp3_frames(paths[0], 20, bitrate_index=9)
+    write_mp3_frames(paths[1], 30, bitrate_index=11)
+    result = merge(paths, str(tmp_path / 'out.mp3'), MergeOptions(sidecar=False))
+    info = check_xing(result.output)
+    assert (info.kind, info.frames, info.lame) == (b'Xing', 50, None)
+    with MappedSession() as session:
+        assert mp3_duration(session.open(result.output)) == pytest.approx(50 * MP3_FRAME_SAMPLES / 44100)
+
+
+def test_probe_uses_info_frame(tmp_path):
+    path = write_encoded(str(tmp_path / 'in.mp3'), 'mp3', 60000)
+    info = xing(path)[0]
+    with MappedSession() as session:
+        assert mp3_duration(session.open(path)) == info.frames * MP3_FRAME_SAMPLES / 44100
+
+
+def test_vbr_split_parts(tmp_path):
+    path = write_encoded(str(tmp_path / 'in.mp3'), 'mp3', 44100 * 4)
+    parts = split_audio(path, parts=3, sidecar=False)
+    assert len(parts) == 3
+    total = 0
+    for part in parts:
+        info = check_xing(part.path)
+        assert info.frames * MP3_FRAME_SAMPLES == round(part.duration * 44100)
+        total += info.frames
+        # Без своего фрейма Xing декодер оценил бы часть по первому фрейму; остаётся лишь задержка декодера
+        assert abs(decoded_frames(part.path) - part.duration * 44100) < MP3_FRAME_SAMPLES
+    assert total == xing(path)[0].frames
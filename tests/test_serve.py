@@ -0,0 +1,28 @@
+"""Служба: разбор заголовка Range"""
+import pytest
+
+from engine.serve import parse_range
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', (0, 100)),
+    ('bytes=100-', (100, 1000)),
+    ('bytes=990-5000', (990, 1000)),
+    ('bytes=-10', (990, 1000)),
+    ('bytes=-5000', (0, 1000)),
+    ('bytes= 5-9', (5, 10)),
+])
+def test_single_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header', [None, '', 'items=0-1', 'bytes=0-1,5-6', 'bytes=-', 'bytes=a-5', 'bytes=1-b'])
+def test_whole_file(header):
+    # Непонятный заголовок или несколько диапазонов - отдаётся весь файл
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=5-4', 'bytes=-0'])
+def test_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
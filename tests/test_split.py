@@ -0,0 +1,158 @@
+"""Части: планирование границ, разрезание и объединение сразу частями"""
+import json
+import os
+
+import pytest
+
+from builders import check_flac, decoded_frames, file_bytes, write_adts, write_encoded, write_wav
+from engine.api import MergeOptions, merge
+from engine.formats import parse_wav
+from engine.mapped import MappedSession
+from engine.split import WavSplitter, merge_parts, part_paths, plan_cuts, split_audio
+from engine.taps import Tap
+
+RATE = 44100
+BLOCK_ALIGN = 4
+
+
+def wav_data(path):
+    data = file_bytes(path)
+    info = parse_wav(data)
+    return data[info.data_offset:info.data_offset + info.data_length]
+
+
+def plan(paths, *args, **kwargs):
+    with MappedSession() as session:
+        splitter = WavSplitter(paths, session)
+        cuts = plan_cuts(splitter, *args, **kwargs)
+        sizes = [splitter.part_size(i, j) for i, j in zip(cuts, cuts[1:])]
+    return splitter, cuts, sizes
+
+
+@pytest.fixture
+def wav_inputs(tmp_path):
+    return [write_wav(str(tmp_path / f"in{k}.wav"), frames, seed=k)
+            for k, frames in enumerate([RATE, RATE // 2 + 1, 2 * RATE])]
+
+
+def test_plan_equal_parts(wav_inputs):
+    splitter, cuts, _ = plan(wav_inputs, parts=4)
+    total = splitter.index.count
+    assert total == RATE + RATE // 2 + 1 + 2 * RATE
+    assert cuts[0] == 0 and cuts[-1] == total and len(cuts) == 5
+    assert all(i < j for i, j in zip(cuts, cuts[1:]))
+    # Отсчёт WAV - свой фрейм: границы ровно на долях общей длины
+    assert [j - i for i, j in zip(cuts, cuts[1:])] == [total * (k + 1) // 4 - total * k // 4 for k in range(4)]
+
+
+def test_plan_limits(wav_inputs):
+    _, cuts, _ = plan(wav_inputs, max_seconds=1.25)
+    assert all(j - i <= 1.25 * RATE for i, j in zip(cuts, cuts[1:]))
+    assert len(cuts) - 1 == 3
+
+    _, cuts, sizes = plan(wav_inputs, max_bytes=150000)
+    assert max(sizes) <= 150000
+    # Части заполняются до предела: короче только последняя
+    assert all(size > 150000 - BLOCK_ALIGN for size in sizes[:-1])
+
+    _, both, _ = plan(wav_inputs, max_bytes=150000, max_seconds=0.5)
+    assert all(j - i <= RATE // 2 for i, j in zip(both, both[1:]))
+
+
+def test_plan_errors(wav_inputs):
+    with pytest.raises(ValueError, match='does not fit'):
+        plan(wav_inputs, max_bytes=40)
+    with pytest.raises(ValueError):
+        split_audio(wav_inputs[0], parts=2, max_seconds=1)
+    with pytest.raises(ValueError):
+        split_audio(wav_inputs[0], parts=0)
+    with pytest.raises(ValueError):
+        split_audio(wav_inputs[0])
+
+
+def test_part_paths(tmp_path):
+    assert [os.path.basename(path) for path in part_paths('a/day.mp3', 3)] == \
+        ['day.part01.mp3', 'day.part02.mp3', 'day.part03.mp3']
+    paths = part_paths('day.wav', 100, output_dir=str(tmp_path))
+    assert paths[0] == str(tmp_path / 'day.part001.wav') and paths[-1] == str(tmp_path / 'day.part100.wav')
+
+
+def test_split_wav_round_trip(tmp_path, wav_inputs):
+    parts = split_audio(wav_inputs[2], max_bytes=100001, output_dir=str(tmp_path / 'parts'))
+    assert len(parts) == 4
+    assert all(part.bytes == os.path.getsize(part.path) <= 100001 for part in parts)
+    assert b''.join(wav_data(part.path) for part in parts) == wav_data(wav_inputs[2])
+    assert [part.start for part in parts] == pytest.approx([0] + [sum(p.duration for p in parts[:k])
+                                                                   for k in range(1, 4)])
+    for part in parts:
+        assert os.path.exists(part.path + '.sha256')
+        assert decoded_frames(part.path) == round(part.duration * RATE)
+
+
+def test_split_flac(tmp_path):
+    path = write_encoded(str(tmp_path / 'in.flac'), 'flac', 5 * RATE)
+    parts = split_audio(path, parts=3, sidecar=False)
+    total = 0
+    for part in parts:
+        # Каждая часть - самостоятельный поток с нумерацией фреймов с нуля
+        streaminfo, _, samples = check_flac(part.path)
+        assert streaminfo.total_samples == samples == round(part.duration * RATE)
+        assert decoded_frames(part.path) == samples
+        total += samples
+    assert total == 5 * RATE
+
+
+def test_split_aac(tmp_path):
+    path = str(tmp_path / 'in.aac')
+    frames = write_adts(path, 50, junk=True, tag=True)
+    parts = split_audio(path, max_bytes=4000, sidecar=False)
+    assert all(part.bytes <= 4000 for part in parts)
+    assert b''.join(file_bytes(part.path) for part in parts) == b''.join(frames)
+
+
+def test_split_unsupported(tmp_path):
+    path = write_encoded(str(tmp_path / 'in.ogg'), 'vorbis', RATE)
+    with pytest.raises(ValueError, match='not supported'):
+        split_audio(path, parts=2)
+
+
+def test_sharded_merge(tmp_path, wav_inputs):
+    direct = merge(wav_inputs, str(tmp_path / 'direct.wav'), MergeOptions(sidecar=False))
+    result = merge(wav_inputs, str(tmp_path / 'out.wav'), MergeOptions(sidecar=False, max_part_seconds=1))
+    assert not os.path.exists(tmp_path / 'out.wav')
+    assert len(result.parts) == 4
+    assert b''.join(wav_data(part.path) for part in result.parts) == wav_data(direct.output)
+    assert result.duration == pytest.approx(direct.duration)
+
+    with open(result.manifest, encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert manifest['format'] == 'wav'
+    assert [entry['file'] for entry in manifest['parts']] == [f"out.part0{k}.wav" for k in range(1, 5)]
+    assert [entry['sha256'] for entry in manifest['parts']] == [part.sha256 for part in result.parts]
+
+
+class FailingTap(Tap):
+    """Отвод, который падает, когда записано больше limit байт"""
+
+    def __init__(self, limit):
+        self.left = limit
+
+    def feed(self, data):
+        self.left -= len(data)
+        if self.left < 0:
+            raise OSError("disk full")
+
+
+def test_failed_rerun_keeps_parts(tmp_path, wav_inputs):
+    directory = tmp_path / 'out'
+    directory.mkdir()
+    output = str(directory / 'out.wav')
+    parts = merge_parts(wav_inputs, output, max_seconds=1)
+    before = {name: file_bytes(str(directory / name)) for name in os.listdir(directory)}
+    assert len(before) == 2 * len(parts) + 1
+
+    # Второй прогон с другими входами падает на второй части: прежние части, их хеши и список не тронуты
+    write_wav(wav_inputs[0], RATE, seed=10)
+    with pytest.raises(OSError, match='disk full'):
+        merge_parts(wav_inputs, output, max_seconds=1, taps={'fail': FailingTap(parts[0].bytes + 1000)})
+    assert {name: file_bytes(str(directory / name)) for name in os.listdir(directory)} == before